@@ -1,7 +1,10 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import sys
 import os
+import time
 
 # Add the current directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -9,19 +12,61 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # Import utility modules
 from utils.analysis import static_analysis
 from utils.optimization import suggest_optimization
-from utils.emissions import estimate_emissions
+from utils.emissions import estimate_emissions, measure_savings, verified_savings
 from utils.algorithm_analyzer import analyze_algorithm
-from utils.ai_optimizer import ai_optimize
+from utils.complexity_profiler import profile_complexity
+from utils.ai_optimizer import AIOptimizer, ai_optimize
 from utils.optimization_variants import generate_optimization_variants
+from utils.inference_worker import inference_stats
+from utils.model_registry import model_registry
+from utils.result_cache import result_cache, make_cache_key
+from utils.semantic_cache import semantic_cache
+from utils.parsed_source import parse_source
+from utils.jobs import job_manager, JobQueueFull
+from utils.metrics import install_metrics, observe_stage
+from utils.pipeline import Stage, StagePipeline, stage_executor
+from utils.sandbox import sandbox_pool
+from utils.streaming import stream_events, SSE_HEADERS
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+install_metrics(app)  # Request metrics and the /metrics endpoint
+
+# Worker pool shared by batch requests
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "500"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+# Start loading the optimization model in the background so the server answers
+# right away; requests use rule-based optimization until the model is ready
+if os.getenv("PRELOAD_MODEL", "1") == "1":
+    AIOptimizer().get_model(wait=False)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint to check if the server is running"""
-    return jsonify({"status": "healthy", "message": "GreenCode AI Backend is running"})
+    return jsonify({
+        "status": "healthy",
+        "message": "GreenCode AI Backend is running",
+        "models": model_registry.stats(),
+        "inference": inference_stats(),
+        "cache": result_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "jobs": job_manager.stats(),
+        "sandbox": sandbox_pool.stats()
+    })
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 while a model is still loading, with its progress"""
+    readiness = model_registry.readiness()
+    return jsonify(readiness), 200 if readiness["ready"] else 503
 
 @app.route('/analyze', methods=['POST'])
 def analyze_code():
@@ -32,67 +77,364 @@ def analyze_code():
         optimization_context = data.get("context", "energy_efficiency")
         use_advanced_analysis = data.get("advanced", True)  # Default to advanced analysis
         show_variants = data.get("variants", True)  # Whether to show fast/green versions
+        use_profiling = data.get("profile", False)  # Whether to time functions at growing input sizes
+        model_id = data.get("model")
         
         if not code:
             return jsonify({"error": "No code provided"}), 400
         
-        # Step 1: Static Analysis
-        analysis_results = static_analysis(code)
+        # Serve repeated snippets from the result cache
+        cache_key = make_cache_key(code, optimization_context, use_advanced_analysis, show_variants, model_id, use_profiling)
+        results = result_cache.get(cache_key)
+        if results is not None:
+            # Timings in a cached result are those of the run that produced it
+            results["cached"] = True
+            response = jsonify(results)
+            response.headers["X-Cache"] = "HIT"
+            return response
         
-        # Step 2: Advanced Algorithm Analysis (if enabled)
-        algorithm_analysis = {}
-        if use_advanced_analysis:
-            algorithm_analysis = analyze_algorithm(code)
-            
-        # Step 3: AI-Powered Optimization
-        optimization_results = ai_optimize(code, context=optimization_context, analysis_results=algorithm_analysis)
+        results = run_analysis(code, optimization_context, use_advanced_analysis, show_variants, use_profiling)
+        _cache_results(cache_key, results)
         
-        # Step 4: Energy and CO2 Estimation
-        energy_results = estimate_emissions(code)
+        response = jsonify(results)
+        response.headers["X-Cache"] = "MISS"
+        return response
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many snippets or files, streaming one NDJSON line per item as it finishes"""
+    try:
+        if request.files:
+            options = request.form
+            items = [
+                {"id": f.filename, "code": f.read().decode("utf-8", errors="replace")}
+                for f in request.files.getlist("files")
+            ]
+        else:
+            options = request.json or {}
+            items = [
+                item if isinstance(item, dict) else {"code": item}
+                for item in options.get("items", [])
+            ]
         
-        # Step 5: Generate optimization variants (fast vs. green)
-        variants_results = {}
-        if show_variants:
-            variants_results = generate_optimization_variants(code, analysis_results, algorithm_analysis)
+        optimization_context = options.get("context", "energy_efficiency")
+        use_advanced_analysis = _as_bool(options.get("advanced", True))
+        show_variants = _as_bool(options.get("variants", True))
+        use_profiling = _as_bool(options.get("profile", False))
+        model_id = options.get("model")
         
-        # Calculate a simple green score (0-100)
-        green_score = calculate_green_score(analysis_results, algorithm_analysis)
-        optimized_score = green_score + min(35, green_score // 2)  # Improved scoring
+        if not items:
+            return jsonify({"error": "No items provided"}), 400
+        if len(items) > MAX_BATCH_ITEMS:
+            return jsonify({"error": f"Too many items: {len(items)} (maximum is {MAX_BATCH_ITEMS})"}), 413
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    
+    def generate():
+        start_time = time.time()
+        # Group identical inputs so each distinct snippet is analyzed once
+        pending = {}
+        errors = 0
+        for index, item in enumerate(items):
+            item_id = item.get("id", item.get("path", index))
+            code = item.get("code", "")
+            if not code:
+                errors += 1
+                yield _ndjson({"type": "result", "index": index, "id": item_id, "status": "error", "error": "No code provided"})
+                continue
+            key = make_cache_key(code, optimization_context, use_advanced_analysis, show_variants, model_id, use_profiling)
+            pending.setdefault(key, {"code": code, "targets": []})["targets"].append((index, item_id))
+        
+        futures = {}
+        try:
+            for key, entry in pending.items():
+                cached = result_cache.get(key)
+                if cached is not None:
+                    for index, item_id in entry["targets"]:
+                        yield _ndjson({"type": "result", "index": index, "id": item_id, "status": "ok", "cached": True, "result": cached})
+                    continue
+                future = batch_executor.submit(
+                    run_analysis, entry["code"], optimization_context, use_advanced_analysis, show_variants,
+                    use_profiling
+                )
+                futures[future] = key
+            
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    result = future.result()
+                    _cache_results(key, result)
+                    lines = [
+                        {"type": "result", "index": index, "id": item_id, "status": "ok", "cached": False, "result": result}
+                        for index, item_id in pending[key]["targets"]
+                    ]
+                except Exception as e:
+                    errors += len(pending[key]["targets"])
+                    lines = [
+                        {"type": "result", "index": index, "id": item_id, "status": "error", "error": str(e)}
+                        for index, item_id in pending[key]["targets"]
+                    ]
+                for line in lines:
+                    yield _ndjson(line)
+            
+            yield _ndjson({
+                "type": "summary",
+                "total": len(items),
+                "unique": len(pending),
+                "errors": errors,
+                "elapsed": round(time.time() - start_time, 2)
+            })
+        finally:
+            # Client went away: don't keep analyzing items nobody will read
+            for future in futures:
+                future.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route('/analyze/stream', methods=['GET', 'POST'])
+def analyze_stream():
+    """Stream analysis results as Server-Sent Events: stage results first, then generated tokens, then a summary"""
+    data = request.json if request.method == 'POST' else request.args
+    data = data or {}
+    code = data.get("code", "")
+    optimization_context = data.get("context", "energy_efficiency")
+    use_advanced_analysis = _as_bool(data.get("advanced", True))
+    show_variants = _as_bool(data.get("variants", True))
+    use_profiling = _as_bool(data.get("profile", False))
+    model_id = data.get("model")
+    
+    if not code:
+        return jsonify({"error": "No code provided"}), 400
+    
+    cache_key = make_cache_key(code, optimization_context, use_advanced_analysis, show_variants, model_id, use_profiling)
+    
+    def produce(emit):
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            emit("summary", dict(cached, cached=True))
+            return
+        results = run_analysis(
+            code, optimization_context, use_advanced_analysis, show_variants, use_profiling,
+            on_stage=emit,
+            on_token=lambda text: emit("token", {"text": text})
+        )
+        _cache_results(cache_key, results)
+        emit("summary", results)
+    
+    return Response(stream_with_context(stream_events(produce)), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Start an analysis in the background and return its job id immediately"""
+    try:
+        data = request.json or {}
+        code = data.get("code", "")
+        optimization_context = data.get("context", "energy_efficiency")
+        use_advanced_analysis = data.get("advanced", True)
+        show_variants = data.get("variants", True)
+        use_profiling = data.get("profile", False)
+        model_id = data.get("model")
         
-        # Determine which optimized code to use as default based on context
-        default_optimized_code = optimization_results["optimized_code"]
+        if not code:
+            return jsonify({"error": "No code provided"}), 400
         
-        # If variants are enabled, use the recommended version
-        if show_variants and variants_results:
-            if variants_results["recommended"] == "fast":
-                default_optimized_code = variants_results["fast_version"]["code"]
-            elif variants_results["recommended"] == "green":
-                default_optimized_code = variants_results["green_version"]["code"]
+        cache_key = make_cache_key(code, optimization_context, use_advanced_analysis, show_variants, model_id, use_profiling)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            job = job_manager.complete(dict(cached, cached=True))
+        else:
+            def run_job(on_stage):
+                results = run_analysis(
+                    code, optimization_context, use_advanced_analysis, show_variants, use_profiling,
+                    on_stage=on_stage
+                )
+                _cache_results(cache_key, results)
+                return results
+            
+            total_stages = (4 + int(bool(use_advanced_analysis)) + int(bool(show_variants))
+                            + int(bool(use_profiling)))
+            job = job_manager.submit(run_job, total_stages=total_stages)
         
-        return jsonify({
-            "original_code": code,
-            "optimized_code": default_optimized_code,
-            "analysis": analysis_results,
-            "algorithm_analysis": algorithm_analysis,
-            "optimization": {
-                "changes": optimization_results["changes"],
-                "explanation": optimization_results["explanation"],
-                "context": optimization_context,
-                "optimization_time": optimization_results.get("optimization_time", 0)
-            },
-            "energy_saved": energy_results["energy_saved"],
-            "co2_saved": energy_results["co2_saved"],
-            "green_score": {
-                "original": green_score,
-                "optimized": optimized_score,
-                "improvement": optimized_score - green_score
-            },
-            "variants": variants_results
-        })
+        job["status_url"] = f"/jobs/{job['id']}"
+        return jsonify(job), 202
     
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Return the progress and (partial) results of a background analysis"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    """Endpoint to inspect result cache statistics"""
+    return jsonify(dict(result_cache.stats(), semantic=semantic_cache.stats()))
+
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Endpoint to drop all cached results after a model or rule change"""
+    result_cache.invalidate()
+    semantic_cache.invalidate()
+    return jsonify({"status": "invalidated", "cache": dict(result_cache.stats(), semantic=semantic_cache.stats())})
+
+def run_analysis(code, optimization_context="energy_efficiency", use_advanced_analysis=True, show_variants=True,
+                 use_profiling=False, on_stage=None, on_token=None):
+    """
+    Run the full analysis pipeline for a snippet and build the response payload.
+    
+    The stages form a dependency graph and run concurrently where they can: static
+    analysis, algorithm analysis and energy measurement start together, and the LLM
+    optimization runs alongside the energy measurement once the algorithm analysis is done.
+    Finally the original and optimized code run side by side on the same inputs, and the
+    reported savings come from that comparison when the shown code is verified equivalent.
+    With ``use_profiling`` each function is also timed at growing input sizes and the
+    measured growth is reported next to the static complexity estimate.
+    If ``on_stage`` is given it is called as ``on_stage(name, result)`` after each stage so
+    callers can report partial results, and ``on_token`` receives the optimized code as it
+    is generated.
+    """
+    start_time = time.time()
+    
+    # Parse and index the code once for every stage
+    parse_start = time.time()
+    source = parse_source(code)
+    observe_stage("parse", time.time() - parse_start)
+    
+    stages = [
+        Stage("static_analysis", lambda inputs: static_analysis(source)),
+        Stage("energy", lambda inputs: estimate_emissions(source)),
+    ]
+    # Advanced algorithm analysis (if enabled)
+    if use_advanced_analysis:
+        stages.append(Stage("algorithm_analysis", lambda inputs: analyze_algorithm(source)))
+    algorithm_stage = ("algorithm_analysis",) if use_advanced_analysis else ()
+    # Empirical complexity from timings at growing input sizes (if enabled)
+    if use_profiling:
+        stages.append(Stage("complexity_profile", lambda inputs: profile_complexity(source)))
+    # Optimization variants (fast vs. green)
+    if show_variants:
+        stages.append(Stage(
+            "variants",
+            lambda inputs: generate_optimization_variants(
+                source, inputs["static_analysis"], inputs.get("algorithm_analysis", {})
+            ),
+            depends_on=("static_analysis",) + algorithm_stage,
+        ))
+    # AI-powered optimization
+    stages.append(Stage(
+        "optimization",
+        lambda inputs: ai_optimize(
+            source, context=optimization_context,
+            analysis_results=inputs.get("algorithm_analysis", {}), on_token=on_token
+        ),
+        depends_on=algorithm_stage,
+    ))
+    # Run the original and optimized code side by side to verify the savings
+    stages.append(Stage(
+        "verification",
+        lambda inputs: measure_savings(source, optimization_candidates(inputs)),
+        # Wait for profiling too so the two don't skew each other's measurements
+        depends_on=("optimization",) + (("variants",) if show_variants else ())
+                   + (("complexity_profile",) if use_profiling else ()),
+    ))
+    
+    results, stage_timings = StagePipeline(stages).run(stage_executor, on_stage=on_stage)
+    for name, seconds in stage_timings.items():
+        observe_stage(name, seconds)
+    analysis_results = results["static_analysis"]
+    algorithm_analysis = results.get("algorithm_analysis", {})
+    energy_results = results["energy"]
+    variants_results = results.get("variants", {})
+    optimization_results = results["optimization"]
+    verification = results["verification"]
+    if use_profiling:
+        algorithm_analysis = dict(algorithm_analysis, empirical_complexity=results["complexity_profile"])
+    
+    # Calculate a simple green score (0-100)
+    green_score = calculate_green_score(analysis_results, algorithm_analysis)
+    optimized_score = green_score + min(35, green_score // 2)  # Improved scoring
+    
+    # Determine which optimized code to use as default based on context
+    default_optimized_code = optimization_results["optimized_code"]
+    default_candidate = "optimized"
+    
+    # If variants are enabled, use the recommended version
+    if show_variants and variants_results:
+        if variants_results["recommended"] == "fast":
+            default_optimized_code = variants_results["fast_version"]["code"]
+            default_candidate = "fast"
+        elif variants_results["recommended"] == "green":
+            default_optimized_code = variants_results["green_version"]["code"]
+            default_candidate = "green"
+    
+    # Prefer measured savings of the shown code over the single-run estimate
+    savings = verified_savings(verification, default_candidate) or energy_results
+    
+    return {
+        "original_code": code,
+        "optimized_code": default_optimized_code,
+        "analysis": analysis_results,
+        "algorithm_analysis": algorithm_analysis,
+        "optimization": {
+            "changes": optimization_results["changes"],
+            "explanation": optimization_results["explanation"],
+            "context": optimization_context,
+            "optimization_time": optimization_results.get("optimization_time", 0),
+            # Set when the rule-based fallback was used because the model was loading or failed
+            **{key: optimization_results[key] for key in ("model_status", "error") if key in optimization_results}
+        },
+        "energy_saved": savings["energy_saved"],
+        "co2_saved": savings["co2_saved"],
+        "energy_explanation": savings["explanation"],
+        "green_score": {
+            "original": green_score,
+            "optimized": optimized_score,
+            "improvement": optimized_score - green_score
+        },
+        "variants": variants_results,
+        "verification": verification,
+        "timings": {
+            "stages": stage_timings,
+            "total": round(time.time() - start_time, 4)
+        }
+    }
+
+def optimization_candidates(inputs):
+    """Collect the optimized code of each finished stage for verification"""
+    candidates = {"optimized": inputs["optimization"]["optimized_code"]}
+    variants = inputs.get("variants") or {}
+    for name in ("fast", "green"):
+        if variants.get(f"{name}_version"):
+            candidates[name] = variants[f"{name}_version"]["code"]
+    return candidates
+
+def _ndjson(payload):
+    """Serialize one NDJSON line"""
+    return json.dumps(payload) + "\n"
+
+def _cache_results(key, results):
+    """Cache an analysis unless its optimization is a fallback that a ready model would replace"""
+    optimization = results.get("optimization") or {}
+    if "model_status" in optimization or "error" in optimization:
+        return
+    result_cache.set(key, results)
+
+def _as_bool(value):
+    """Accept booleans from JSON bodies as well as strings from form fields"""
+    if isinstance(value, str):
+        return value.strip().lower() not in ("false", "0", "no", "off", "")
+    return bool(value)
+
 def calculate_green_score(analysis_results, algorithm_analysis=None):
     """Calculate a green score based on analysis results and algorithm analysis"""
     # Base score starts higher
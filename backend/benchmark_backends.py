@@ -0,0 +1,116 @@
+"""
+Side-by-side latency and throughput benchmark of the inference backends.
+
+Loads the same model with each backend, then generates for the prompts of every
+optimization context, one at a time and as one batch.
+
+Usage:
+python benchmark_backends.py --model bigcode/starcoderbase-1b --backends transformers,onnx,stub --new-tokens 64
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.ai_optimizer import AIOptimizer
+from utils.inference_backends import BACKENDS, get_backend
+
+SAMPLE_CODE = """def process_data(data):
+    result = []
+    for item in data:
+        if item > 0:
+            result.append(item * 2)
+    total = 0
+    for value in result:
+        total += value
+    return result, total
+"""
+
+
+def build_prompts(code):
+    """Return the prompt of every optimization context for the code."""
+    optimizer = AIOptimizer()
+    return [
+        optimizer._build_context_aware_prompt(code, context_info)
+        for context_info in optimizer.optimization_context.values()
+    ]
+
+
+def count_new_tokens(pipeline, prompt, output):
+    """Number of tokens generated after the prompt."""
+    text = output[0]["generated_text"]
+    if text.startswith(prompt):
+        text = text[len(prompt):]
+    return len(pipeline.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def benchmark(pipeline, prompts, new_tokens):
+    """Time sequential and batched generation; returns latencies and tokens per second."""
+    generate_kwargs = {"max_new_tokens": new_tokens, "do_sample": False}
+    if getattr(pipeline.tokenizer, "pad_token", None) is None:
+        pipeline.tokenizer.pad_token = pipeline.tokenizer.eos_token
+    pipeline.tokenizer.padding_side = "left"
+    pipeline(prompts[0], max_new_tokens=4, do_sample=False)  # warm up
+
+    latencies, tokens = [], 0
+    start_time = time.perf_counter()
+    for prompt in prompts:
+        call_start = time.perf_counter()
+        output = pipeline(prompt, **generate_kwargs)
+        latencies.append(time.perf_counter() - call_start)
+        tokens += count_new_tokens(pipeline, prompt, output)
+    sequential_speed = tokens / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    outputs = pipeline(prompts, batch_size=len(prompts), **generate_kwargs)
+    batched_time = time.perf_counter() - start_time
+    batched_tokens = sum(count_new_tokens(pipeline, prompt, output) for prompt, output in zip(prompts, outputs))
+
+    return {
+        "p50": statistics.median(latencies),
+        "p95": sorted(latencies)[max(0, int(round(0.95 * len(latencies))) - 1)],
+        "sequential_tps": sequential_speed,
+        "batched_tps": batched_tokens / batched_time,
+    }
+
+
+def main(argv=None):
+    """Load the model with every backend and print one line per backend."""
+    parser = argparse.ArgumentParser(description="Compare inference backends on the same model and prompts.")
+    parser.add_argument("--model", default="bigcode/starcoderbase-1b", help="Model id or local path")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to compare")
+    parser.add_argument("--new-tokens", type=int, default=64, help="Tokens generated per prompt")
+    parser.add_argument("--code-file", help="Python file to use as the user's code")
+    args = parser.parse_args(argv)
+
+    code = SAMPLE_CODE
+    if args.code_file:
+        with open(args.code_file) as f:
+            code = f.read()
+    prompts = build_prompts(code)
+
+    print(f"{'backend':<14}{'load s':>9}{'p50 ms':>10}{'p95 ms':>10}{'seq tok/s':>11}{'batch tok/s':>13}")
+    for name in args.backends.split(","):
+        start_time = time.perf_counter()
+        try:
+            pipeline = get_backend(name).load(args.model)
+        except Exception as e:
+            print(f"{name:<14}failed to load: {e}")
+            continue
+        load_time = time.perf_counter() - start_time
+        result = benchmark(pipeline, prompts, args.new_tokens)
+        print(
+            f"{name:<14}{load_time:>9.1f}{result['p50'] * 1000:>10.1f}{result['p95'] * 1000:>10.1f}"
+            f"{result['sequential_tps']:>11.1f}{result['batched_tps']:>13.1f}"
+        )
+        del pipeline
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Benchmark of the prompt preamble KV cache on CPU.
+
+For every optimization context, compares prefilling the whole prompt with
+prefilling only the code after the cached preamble, and checks that both give
+the same next-token logits.
+
+Usage:
+python benchmark_prefix_cache.py --model bigcode/starcoderbase-1b --repeats 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from utils.ai_optimizer import AIOptimizer
+from utils.prefix_cache import PrefixCache
+
+SAMPLE_CODE = """def process_data(data):
+    result = []
+    for item in data:
+        if item > 0:
+            result.append(item * 2)
+    total = 0
+    for value in result:
+        total += value
+    return result, total
+"""
+
+
+def full_prefill(model, tokenizer, prompt):
+    """Prefill the whole prompt and return the next-token logits."""
+    input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    with torch.no_grad():
+        return model(input_ids, use_cache=True).logits[:, -1]
+
+
+def cached_prefill(model, prefix_cache, prompt, prefix):
+    """Prefill only the code after the cached preamble and return the next-token logits."""
+    inputs = prefix_cache.prepare([prompt], prefix)
+    mask = inputs["attention_mask"]
+    with torch.no_grad():
+        return model(
+            inputs["input_ids"][:, -1:],
+            past_key_values=inputs["past_key_values"],
+            attention_mask=mask,
+            position_ids=mask.long().cumsum(-1)[:, -1:] - 1,
+            use_cache=True,
+        ).logits[:, -1]
+
+
+def time_call(func, repeats):
+    """Return the result of the last call and the mean seconds per call."""
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return result, (time.perf_counter() - start_time) / repeats
+
+
+def main(argv=None):
+    """Run the benchmark and print one line per context."""
+    parser = argparse.ArgumentParser(description="Measure prefill time saved by the preamble KV cache.")
+    parser.add_argument("--model", default="bigcode/starcoderbase-1b", help="Model id or local path")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per measurement")
+    parser.add_argument("--code-file", help="Python file to use as the user's code")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    code = SAMPLE_CODE
+    if args.code_file:
+        with open(args.code_file) as f:
+            code = f.read()
+
+    print(f"Loading {args.model} on CPU...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+    prefix_cache = PrefixCache(model, tokenizer)
+    optimizer = AIOptimizer(args.model)
+
+    print(f"{'context':<20}{'prefix tok':>11}{'prompt tok':>11}{'full ms':>10}{'cached ms':>11}{'saved ms':>10}{'max |dlogit|':>14}")
+    for context, context_info in optimizer.optimization_context.items():
+        prefix = context_info["prompt_prefix"]
+        prompt = optimizer._build_context_aware_prompt(code, context_info)
+        prefix_cache.get(prefix)  # encoded once at startup, not per request
+
+        full_ids = tokenizer(prompt)["input_ids"]
+        prefix_ids = tokenizer(prefix)["input_ids"]
+        full_prefill(model, tokenizer, prompt)  # warm up
+        full_logits, full_time = time_call(lambda: full_prefill(model, tokenizer, prompt), args.repeats)
+        cached_logits, cached_time = time_call(
+            lambda: cached_prefill(model, prefix_cache, prompt, prefix), args.repeats
+        )
+        difference = (full_logits - cached_logits).abs().max().item()
+
+        print(
+            f"{context:<20}{len(prefix_ids):>11}{len(full_ids):>11}{full_time * 1000:>10.1f}"
+            f"{cached_time * 1000:>11.1f}{(full_time - cached_time) * 1000:>10.1f}{difference:>14.2e}"
+        )
+    print(prefix_cache.stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Benchmark of INT8 dynamic quantization against float32 on CPU.
+
+Generates greedily from a fixed prompt set with the float32 model, quantizes it
+in place, generates again and reports the weight footprint, decode throughput
+and how closely the int8 generations follow the float32 ones.
+
+Usage:
+python benchmark_quantization.py --model bigcode/starcoderbase-1b --new-tokens 64
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import psutil
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from utils.ai_optimizer import AIOptimizer
+from utils.quantization import model_memory_bytes, parity_metrics, quantize_model
+
+# Fixed prompt set: each snippet is wrapped in every optimization context's prompt
+SAMPLE_SNIPPETS = [
+    """def process_data(data):
+    result = []
+    for item in data:
+        if item > 0:
+            result.append(item * 2)
+    total = 0
+    for value in result:
+        total += value
+    return result, total
+""",
+    """def find_duplicates(items):
+    duplicates = []
+    for i in range(len(items)):
+        for j in range(i + 1, len(items)):
+            if items[i] == items[j] and items[i] not in duplicates:
+                duplicates.append(items[i])
+    return duplicates
+""",
+    """def build_report(lines):
+    report = ""
+    for line in lines:
+        report += line.strip() + "\\n"
+    return report
+""",
+]
+
+
+def build_prompts():
+    """Return the prompts of every optimization context for every sample snippet."""
+    optimizer = AIOptimizer()
+    return [
+        optimizer._build_context_aware_prompt(snippet, context_info)
+        for snippet in SAMPLE_SNIPPETS
+        for context_info in optimizer.optimization_context.values()
+    ]
+
+
+def generate_all(model, tokenizer, prompts, new_tokens):
+    """Generate greedily for every prompt and return the new token ids and tokens per second."""
+    generations = []
+    generated_tokens = 0
+    start_time = time.perf_counter()
+    for prompt in prompts:
+        input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+        with torch.no_grad():
+            output = model.generate(
+                input_ids, max_new_tokens=new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id
+            )
+        tokens = output[0, input_ids.shape[1]:].tolist()
+        generated_tokens += len(tokens)
+        generations.append(tokens)
+    return generations, generated_tokens / (time.perf_counter() - start_time)
+
+
+def rss_mb():
+    """Resident memory of this process in MB."""
+    return psutil.Process().memory_info().rss / (1024 ** 2)
+
+
+def main(argv=None):
+    """Run the benchmark and print one line per mode, then the parity metrics."""
+    parser = argparse.ArgumentParser(description="Compare int8 dynamic quantization with float32 on CPU.")
+    parser.add_argument("--model", default="bigcode/starcoderbase-1b", help="Model id or local path")
+    parser.add_argument("--new-tokens", type=int, default=64, help="Tokens generated per prompt")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N prompts")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    prompts = build_prompts()[:args.limit]
+
+    print(f"Loading {args.model} on CPU...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32).eval()
+
+    print(f"{'mode':<8}{'weights MB':>12}{'RSS MB':>10}{'tokens/s':>10}")
+    generate_all(model, tokenizer, prompts[:1], 4)  # warm up
+    reference, fp32_speed = generate_all(model, tokenizer, prompts, args.new_tokens)
+    print(f"{'fp32':<8}{model_memory_bytes(model) / 1024 ** 2:>12.1f}{rss_mb():>10.1f}{fp32_speed:>10.2f}")
+
+    model = quantize_model(model, "int8")
+    generate_all(model, tokenizer, prompts[:1], 4)
+    candidate, int8_speed = generate_all(model, tokenizer, prompts, args.new_tokens)
+    print(f"{'int8':<8}{model_memory_bytes(model) / 1024 ** 2:>12.1f}{rss_mb():>10.1f}{int8_speed:>10.2f}")
+
+    print(f"speedup: {int8_speed / fp32_speed:.2f}x")
+    print(parity_metrics(reference, candidate))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+Gunicorn settings: shared Prometheus metrics across the pre-forked workers
+"""
+
+import os
+import shutil
+import tempfile
+
+# Every worker writes its metric values here and /metrics aggregates them.
+# Must be set before the workers import the app.
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "greencode-ai-metrics")
+)
+
+
+def on_starting(server):
+    # Values from a previous run would be summed in
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drop the live gauges (in-flight requests, loaded models) of the dead worker
+    multiprocess.mark_process_dead(worker.pid)
@@ -3,18 +3,25 @@ Simplified server script that explicitly uses cached models only.
 """
 import os
 import sys
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from transformers import pipeline
 
 # Add utils to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from utils.analysis import static_analysis
 from utils.emissions import estimate_emissions
+from utils.generation_controller import GENERATION_DEADLINE_SECONDS, token_budget
+from utils.inference_worker import get_inference_worker, inference_stats
+from utils.metrics import install_metrics, observe_stage
+from utils.model_registry import get_pipeline, model_registry, pipeline_key
+from utils.parsed_source import parse_source
+from utils.streaming import generate_with_streamer, stream_events, SSE_HEADERS
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
+install_metrics(app)
 
 # Check if model cache exists
 model_path = "./models/models--bigcode--starcoderbase-1b"
@@ -37,19 +44,25 @@ if not os.path.exists(model_file_path):
 else:
     print(f"✓ Found cached model at: {model_path}")
     use_remote = False
-    try:
-        print("Loading model...")
-        if use_remote:
-            print("Using remote model (this will download it first time)")
-            model = pipeline("text-generation", model="bigcode/starcoderbase-1b")
-        else:
-            print("Using locally cached model")
-            model = pipeline("text-generation", model=model_path)
-        print("Model loaded successfully!")
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        print("Using a simpler fallback method instead")
-        model = None
+
+if use_remote:
+    print("Using remote model (this will download it first time)")
+    model_source = "bigcode/starcoderbase-1b"
+else:
+    print("Using locally cached model")
+    model_source = model_path
+
+
+def get_model():
+    """Return the batching worker for the model, or None while it is loading in the background"""
+    pipeline = get_pipeline(model_source, wait=False, on_loaded=get_inference_worker)
+    return get_inference_worker(pipeline) if pipeline is not None else None
+
+
+# Start loading right away without blocking startup; requests use the fallback
+# optimization until the model is ready
+print("Loading model in the background...")
+get_model()
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -57,9 +70,22 @@ def health_check():
     return jsonify({
         "status": "healthy", 
         "message": "GreenCode AI Backend is running",
-        "model_loaded": model is not None
+        "model_loaded": model_registry.load_status(pipeline_key(model_source)).get("state") == "ready",
+        "models": model_registry.stats(),
+        "inference": inference_stats()
     })
 
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 while the model is still loading"""
+    readiness = model_registry.readiness()
+    return jsonify(readiness), 200 if readiness["ready"] else 503
+
 @app.route('/analyze', methods=['POST'])
 def analyze_code():
     """Simplified endpoint that uses cached model only"""
@@ -70,54 +96,99 @@ def analyze_code():
         if not code:
             return jsonify({"error": "No code provided"}), 400
         
-        # Step 1: Basic Analysis
-        analysis_results = static_analysis(code)
+        return jsonify(run_analysis(code))
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/analyze/stream', methods=['GET', 'POST'])
+def analyze_stream():
+    """Stream static analysis first, then the optimized code token by token, then a summary"""
+    data = (request.json if request.method == 'POST' else request.args) or {}
+    code = data.get("code", "")
+    
+    if not code:
+        return jsonify({"error": "No code provided"}), 400
+    
+    def produce(emit):
+        results = run_analysis(code, on_stage=emit, on_token=lambda text: emit("token", {"text": text}))
+        emit("summary", results)
+    
+    return Response(stream_with_context(stream_events(produce)), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+def run_analysis(code, on_stage=None, on_token=None):
+    """Analyze a snippet, reporting each stage to ``on_stage`` and generated text to ``on_token``"""
+    stage_start = [time.time()]
+    
+    def stage_done(name, result):
+        # Stages run one after another, so each one took the time since the previous
+        now = time.time()
+        observe_stage(name, now - stage_start[0])
+        stage_start[0] = now
+        if on_stage:
+            on_stage(name, result)
+    
+    # Parse once and share with every stage
+    source = parse_source(code)
+    observe_stage("parse", time.time() - stage_start[0])
+    stage_start[0] = time.time()
+    
+    # Step 1: Basic Analysis
+    analysis_results = static_analysis(source)
+    stage_done("static_analysis", analysis_results)
+    
+    # Step 2: Energy Estimation
+    energy_results = estimate_emissions(source)
+    stage_done("energy", energy_results)
+    
+    # Step 3: Code Optimization (using cached model or fallback)
+    model = get_model()
+    if model:
+        # Generate a prompt for the model
+        prompt = f"# Optimize this Python code for maximum energy efficiency:\n{code}\n\n# Energy-efficient optimized version:"
         
-        # Step 2: Code Optimization (using cached model or fallback)
-        if model:
-            # Generate a prompt for the model
-            prompt = f"# Optimize this Python code for maximum energy efficiency:\n{code}\n\n# Energy-efficient optimized version:"
-            
-            # Generate optimized code using the model
-            response = model(
-                prompt, 
-                max_length=1024,
-                do_sample=True,
-                temperature=0.2,
-                num_return_sequences=1
-            )
-            
-            # Extract the optimized code
-            generated_text = response[0]['generated_text']
-            optimized_code = generated_text.split("# Energy-efficient optimized version:")[1].strip()
+        # Generate optimized code using the model
+        generate_kwargs = {
+            "max_new_tokens": token_budget(model.tokenizer, code),
+            "do_sample": True,
+            "temperature": 0.2,
+            "num_return_sequences": 1,
+            "stop_on_code_end": True,
+            "deadline_seconds": GENERATION_DEADLINE_SECONDS
+        }
+        if on_token:
+            response = generate_with_streamer(model, prompt, on_token, **generate_kwargs)
         else:
-            # Simple fallback optimization
-            optimized_code = code.replace("for item in data:", "[item * 2 for item in data if item > 0]")
-            optimized_code = optimized_code.replace("total = 0\n    for r in result:\n        total += r", "total = sum(result)")
-        
-        # Step 3: Energy Estimation
-        energy_results = estimate_emissions(code)
+            response = model(prompt, **generate_kwargs)
         
-        # Calculate a simple green score
-        inefficiencies = len(analysis_results.get("inefficiencies", []))
-        green_score = max(75 - (inefficiencies * 5), 35)
-        optimized_score = green_score + min(35, green_score // 2)
-        
-        return jsonify({
-            "original_code": code,
-            "optimized_code": optimized_code,
-            "analysis": analysis_results,
-            "energy_saved": energy_results["energy_saved"],
-            "co2_saved": energy_results["co2_saved"],
-            "green_score": {
-                "original": green_score,
-                "optimized": optimized_score,
-                "improvement": optimized_score - green_score
-            }
-        })
+        # Extract the optimized code
+        generated_text = response[0]['generated_text']
+        optimized_code = generated_text.split("# Energy-efficient optimized version:")[1].strip()
+    else:
+        # Simple fallback optimization
+        optimized_code = code.replace("for item in data:", "[item * 2 for item in data if item > 0]")
+        optimized_code = optimized_code.replace("total = 0\n    for r in result:\n        total += r", "total = sum(result)")
+        if on_token:
+            on_token(optimized_code)
+    observe_stage("optimization", time.time() - stage_start[0])
     
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    # Calculate a simple green score
+    inefficiencies = len(analysis_results.get("inefficiencies", []))
+    green_score = max(75 - (inefficiencies * 5), 35)
+    optimized_score = green_score + min(35, green_score // 2)
+    
+    return {
+        "original_code": code,
+        "optimized_code": optimized_code,
+        "analysis": analysis_results,
+        "energy_saved": energy_results["energy_saved"],
+        "co2_saved": energy_results["co2_saved"],
+        "green_score": {
+            "original": green_score,
+            "optimized": optimized_score,
+            "improvement": optimized_score - green_score
+        }
+    }
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
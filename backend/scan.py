@@ -0,0 +1,319 @@
+"""
+Command-line scanner that analyzes every Python file in a project tree.
+
+Files are analyzed in parallel with the same static analysis and algorithm
+analysis used by the API. A per-file content-hash cache means a rescan only
+analyzes files that changed since the last run.
+
+Usage:
+python scan.py path/to/project --format sarif --output results.sarif
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the current directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.analysis import static_analysis
+from utils.algorithm_analyzer import analyze_algorithm
+from utils.detectors import default_detectors
+from utils.parsed_source import parse_source
+from utils.result_cache import RULES_VERSION
+
+DEFAULT_CACHE_FILE = ".greencode-scan-cache.json"
+DEFAULT_EXCLUDES = {".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv", ".tox", ".mypy_cache"}
+SARIF_LEVELS = {"high": "error", "medium": "warning", "low": "note"}
+# SARIF base id of the scan root; artifact URIs are relative to it
+SARIF_ROOT_ID = "SRCROOT"
+# Time complexities reported by the algorithm analyzer share one rule
+COMPLEXITY_RULE = "high_time_complexity"
+SARIF_RULE_DESCRIPTIONS = {
+    "syntax_error": "File is not valid Python",
+    COMPLEXITY_RULE: "Estimated time complexity is high",
+    "recursive_without_memoization": "Recursive function recomputes results without memoization",
+    "bubble_sort": "Hand-written bubble sort",
+    "repeated_list_traversal": "Membership tests traverse a list repeatedly",
+}
+SARIF_RULE_DESCRIPTIONS.update({detector.issue_type: detector.message for detector in default_detectors()})
+
+
+def find_python_files(paths, excludes=DEFAULT_EXCLUDES):
+    """Yield every ``.py`` file under the given paths, skipping excluded directories."""
+    for path in paths:
+        if os.path.isfile(path):
+            if path.endswith(".py"):
+                yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in excludes)
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    yield os.path.join(root, name)
+
+
+def analyze_file(code):
+    """Analyze one file's source. Runs in a worker process."""
+    source = parse_source(code)
+    return {
+        "analysis": static_analysis(source),
+        "algorithm_analysis": analyze_algorithm(source),
+    }
+
+
+def load_cache(cache_path):
+    """Load the per-file cache, discarding it if it was written by different rules."""
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("rules_version") != RULES_VERSION:
+        return {}
+    return cache.get("files", {})
+
+
+def save_cache(cache_path, files):
+    """Atomically write the per-file cache."""
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"rules_version": RULES_VERSION, "files": files}, f)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def scan(paths, jobs=None, cache_path=DEFAULT_CACHE_FILE, excludes=DEFAULT_EXCLUDES):
+    """
+    Scan a project tree, reusing cached results for unchanged files.
+
+    Args:
+        paths (list): Files or directories to scan
+        jobs (int, optional): Number of worker processes (defaults to the CPU count)
+        cache_path (str, optional): Location of the per-file cache. Disabled when None.
+        excludes (set): Directory names to skip
+
+    Returns:
+        tuple: (list of per-file records sorted by path, scan statistics). Record
+        paths are relative to the scan root, which is ``stats["root"]``.
+    """
+    start_time = time.time()
+    root = scan_root(paths)
+    cached_files = load_cache(cache_path) if cache_path else {}
+    new_cache = {}
+    records = []
+    to_analyze = []
+
+    for path in find_python_files(paths, excludes):
+        # Relative to the scan root, so cache keys and reports don't depend on the working directory
+        rel_path = os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = cached_files.get(rel_path)
+
+        # Fast path: size and mtime unchanged, don't even read the file
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            new_cache[rel_path] = entry
+            records.append(_record(rel_path, entry, cached=True))
+            continue
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        digest = hashlib.sha256(data).hexdigest()
+
+        if entry and entry["hash"] == digest:
+            # Touched but not modified
+            entry = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            new_cache[rel_path] = entry
+            records.append(_record(rel_path, entry, cached=True))
+            continue
+
+        to_analyze.append((rel_path, stat, digest, data.decode("utf-8", errors="replace")))
+
+    if to_analyze:
+        if jobs == 1 or len(to_analyze) == 1:
+            results = map(analyze_file, (item[3] for item in to_analyze))
+            _collect(to_analyze, results, new_cache, records)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                chunksize = max(1, len(to_analyze) // ((jobs or os.cpu_count() or 1) * 4))
+                results = executor.map(analyze_file, (item[3] for item in to_analyze), chunksize=chunksize)
+                _collect(to_analyze, results, new_cache, records)
+
+    if cache_path:
+        save_cache(cache_path, new_cache)
+
+    records.sort(key=lambda record: record["path"])
+    stats = {
+        "root": root,
+        "files": len(records),
+        "analyzed": len(to_analyze),
+        "cached": len(records) - len(to_analyze),
+        "elapsed": round(time.time() - start_time, 2),
+    }
+    return records, stats
+
+
+def scan_root(paths):
+    """Absolute directory containing every scanned path: the directory itself, or a file's directory."""
+    directories = [
+        os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path) or ".")
+        for path in paths
+    ]
+    return os.path.commonpath(directories) if directories else os.getcwd()
+
+
+def _collect(to_analyze, results, new_cache, records):
+    for (rel_path, stat, digest, _), result in zip(to_analyze, results):
+        entry = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "analysis": result["analysis"],
+            "algorithm_analysis": result["algorithm_analysis"],
+        }
+        new_cache[rel_path] = entry
+        records.append(_record(rel_path, entry, cached=False))
+
+
+def _record(rel_path, entry, cached):
+    return {
+        "path": rel_path,
+        "hash": entry["hash"],
+        "cached": cached,
+        "analysis": entry["analysis"],
+        "algorithm_analysis": entry["algorithm_analysis"],
+    }
+
+
+def write_jsonl(records, out):
+    """Write one JSON object per file."""
+    for record in records:
+        out.write(json.dumps(record) + "\n")
+
+
+def to_sarif(records, root=None):
+    """
+    Convert scan records into a SARIF 2.1.0 log.
+
+    Args:
+        records (list): Records returned by ``scan``
+        root (str, optional): Scan root the record paths are relative to
+
+    Returns:
+        dict: The SARIF log
+    """
+    rules = set()
+    results = []
+    for record in records:
+        artifact = {"uri": record["path"], "uriBaseId": SARIF_ROOT_ID}
+        for issue in record["analysis"].get("inefficiencies", []):
+            rules.add(issue["type"])
+            region = {"startLine": issue.get("line") or 1}
+            if "column" in issue:
+                region.update({
+                    "startColumn": issue["column"],
+                    "endLine": issue["end_line"],
+                    "endColumn": issue["end_column"],
+                })
+            results.append({
+                "ruleId": issue["type"],
+                "level": SARIF_LEVELS.get(issue.get("severity", "low"), "note"),
+                "message": {"text": issue["message"]},
+                "locations": [{"physicalLocation": {"artifactLocation": artifact, "region": region}}],
+            })
+        for suggestion in record["algorithm_analysis"].get("optimization_suggestions", []):
+            rule_id, message = suggestion["type"], suggestion["suggestion"]
+            if rule_id.startswith("O("):
+                rule_id, message = COMPLEXITY_RULE, f"Estimated time complexity {rule_id}. {message}"
+            rules.add(rule_id)
+            results.append({
+                "ruleId": rule_id,
+                "level": "warning",
+                "message": {"text": message},
+                "locations": [{"physicalLocation": {"artifactLocation": artifact}}],
+            })
+
+    run = {
+        "tool": {"driver": {
+            "name": "GreenCode AI",
+            "informationUri": "https://github.com/sambett/greencode-ai",
+            "rules": [
+                {
+                    "id": rule_id,
+                    "shortDescription": {
+                        "text": SARIF_RULE_DESCRIPTIONS.get(rule_id, rule_id.replace("_", " ").capitalize())
+                    },
+                }
+                for rule_id in sorted(rules)
+            ],
+        }},
+        "results": results,
+    }
+    if root:
+        run["originalUriBaseIds"] = {SARIF_ROOT_ID: {"uri": pathlib.Path(root).as_uri().rstrip("/") + "/"}}
+    return {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [run],
+    }
+
+
+def main(argv=None):
+    """Parse arguments, run the scan and write the report."""
+    parser = argparse.ArgumentParser(description="Scan a Python project for energy inefficiencies.")
+    parser.add_argument("paths", nargs="*", default=["."], help="Files or directories to scan")
+    parser.add_argument("-f", "--format", choices=["jsonl", "sarif"], default="jsonl", help="Output format")
+    parser.add_argument("-o", "--output", help="Output file (defaults to stdout)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (defaults to CPU count)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="Per-file cache location")
+    parser.add_argument("--no-cache", action="store_true", help="Analyze every file and don't write a cache")
+    parser.add_argument("--exclude", action="append", default=[], help="Directory name to skip (repeatable)")
+    args = parser.parse_args(argv)
+
+    records, stats = scan(
+        args.paths,
+        jobs=args.jobs,
+        cache_path=None if args.no_cache else args.cache,
+        excludes=DEFAULT_EXCLUDES | set(args.exclude),
+    )
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        if args.format == "sarif":
+            json.dump(to_sarif(records, stats["root"]), out, indent=2)
+            out.write("\n")
+        else:
+            write_jsonl(records, out)
+    finally:
+        if args.output:
+            out.close()
+
+    print(
+        f"Scanned {stats['files']} files ({stats['analyzed']} analyzed, {stats['cached']} from cache) "
+        f"in {stats['elapsed']}s",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
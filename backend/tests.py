@@ -2,11 +2,51 @@
 Unit tests for GreenCode AI backend
 """
 
+import ast
+import importlib.util
+import math
 import unittest
 import json
+import os
+import pathlib
+import re
+import tempfile
+import threading
+import time
+
+# Generate with the deterministic stub backend instead of loading model weights
+os.environ.setdefault("INFERENCE_BACKEND", "stub")
+
 from app import app
 from utils.algorithm_analyzer import analyze_algorithm
 from utils.ai_optimizer import ai_optimize
+from utils.model_registry import ModelRegistry, ModelLoadError, get_pipeline, model_registry, pipeline_key
+from utils.inference_backends import get_backend
+from utils.result_cache import ResultCache, make_cache_key, result_cache
+from utils.parsed_source import parse_source
+from utils.analysis import static_analysis
+from utils.detectors import DetectorEngine, Detector, default_detectors
+from scan import scan, to_sarif
+from utils.jobs import JobManager, JobQueueFull
+from utils.streaming import StreamClosed, generate_with_streamer, stream_events
+from utils.inference_worker import InferenceWorker, get_inference_worker
+from utils.prefix_cache import PrefixCache, _split_prompt_ids
+from utils.prompt_lookup import crop_past_key_values, find_draft
+from utils.generation_controller import GenerationController, code_end, token_budget
+from utils.semantic_cache import fingerprint_source, semantic_cache
+from utils.rewrite_engine import default_engine
+from utils.optimization import suggest_optimization
+from utils.optimization_variants import generate_optimization_variants
+from utils.ai_optimizer import AIOptimizer
+from utils.pipeline import Stage, StagePipeline
+from utils.sandbox import SandboxPool
+from utils.complexity_profiler import fit_complexity, profile_complexity
+from utils.differential import compare_implementations, default_calls
+from utils.metrics import GenerationTimer, install_metrics, metrics_text, observe_stage
+from utils.quantization import model_memory_bytes, model_quantization, parity_metrics, quantize_model
+from utils.input_generator import DatasetCache, argument_specs, build_call
+from utils.energy_meter import RaplMeter, CgroupCpuMeter, CpuTimeMeter, select_energy_meter
+from concurrent.futures import ThreadPoolExecutor
 
 class GreenCodeAITests(unittest.TestCase):
     
@@ -112,6 +152,58 @@ def calculate_sum(numbers):
         # Check that advanced analysis was performed
         self.assertIn('time_complexity', data['algorithm_analysis'])
         self.assertIn('space_complexity', data['algorithm_analysis'])
+        
+        # Check that per-stage timings are reported
+        self.assertEqual(
+            set(data['timings']['stages']),
+            {'static_analysis', 'algorithm_analysis', 'energy', 'variants', 'optimization', 'verification'}
+        )
+        self.assertIn('verification', data)
+    
+    def test_batch_endpoint_streams_ndjson(self):
+        """Test that batch results are streamed one line per item with duplicates analyzed once"""
+        response = self.app.post('/analyze/batch',
+                               json={'items': [
+                                   {'id': 'a.py', 'code': self.inefficient_code},
+                                   {'id': 'b.py', 'code': self.inefficient_code},
+                                   {'id': 'empty.py', 'code': ''}
+                               ], 'variants': False},
+                               content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        
+        results = {line['id']: line for line in lines if line['type'] == 'result'}
+        self.assertEqual(set(results), {'a.py', 'b.py', 'empty.py'})
+        self.assertEqual(results['a.py']['status'], 'ok')
+        self.assertEqual(results['a.py']['result'], results['b.py']['result'])
+        self.assertEqual(results['empty.py']['status'], 'error')
+        
+        summary = lines[-1]
+        self.assertEqual(summary['type'], 'summary')
+        self.assertEqual(summary['total'], 3)
+        self.assertEqual(summary['unique'], 1)
+        self.assertEqual(summary['errors'], 1)
+    
+    def test_job_endpoints(self):
+        """Test that a job is accepted immediately and can be polled to completion"""
+        response = self.app.post('/jobs',
+                               json={'code': self.inefficient_code, 'variants': False},
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        job = json.loads(response.data)
+        self.assertIn(job['status'], ('queued', 'running', 'completed'))
+        
+        for _ in range(200):
+            job = json.loads(self.app.get(job['status_url']).data)
+            if job['status'] in ('completed', 'failed'):
+                break
+            time.sleep(0.05)
+        
+        self.assertEqual(job['status'], 'completed')
+        self.assertIn('green_score', job['result'])
+        self.assertEqual(self.app.get('/jobs/unknown').status_code, 404)
     
     def test_different_optimization_contexts(self):
         """Test different optimization contexts"""
@@ -139,5 +231,1287 @@ def calculate_sum(numbers):
         self.assertEqual(data['optimization']['context'], 'readability')
 
 
+class ModelRegistryTests(unittest.TestCase):
+
+    def test_model_loaded_once(self):
+        """Test that concurrent requests share a single model load"""
+        registry = ModelRegistry()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return object()
+
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(registry.get("m", loader))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(m is models[0] for m in models))
+        stats = registry.stats()["models"]["m"]
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 7)
+        self.assertTrue(stats["loaded"])
+
+    def test_failed_load_not_retried_immediately(self):
+        """Test that a failing model is not reloaded on every request"""
+        registry = ModelRegistry(retry_seconds=60)
+
+        def loader():
+            raise OSError("weights missing")
+
+        with self.assertRaises(OSError):
+            registry.get("broken", loader)
+        with self.assertRaises(ModelLoadError):
+            registry.get("broken", loader)
+        self.assertEqual(registry.stats()["models"]["broken"]["failures"], 1)
+
+    def test_background_load_does_not_block(self):
+        """Test that get_nowait returns None until the model has loaded in the background"""
+        registry = ModelRegistry()
+        release = threading.Event()
+        model = object()
+        warmed = []
+
+        def loader():
+            release.wait(5)
+            return model
+
+        self.assertIsNone(registry.get_nowait("m", loader, on_loaded=warmed.append))
+        self.assertFalse(registry.readiness()["ready"])
+        self.assertEqual(registry.load_status("m")["state"], "loading")
+
+        release.set()
+        registry._background["m"].thread.join(5)
+        self.assertIs(registry.get_nowait("m", loader), model)
+        self.assertEqual(warmed, [model])
+        self.assertTrue(registry.readiness()["ready"])
+
+    def test_failed_background_load_is_degraded(self):
+        """Test that a failed background load reports ready but degraded"""
+        registry = ModelRegistry(retry_seconds=60)
+
+        def loader():
+            raise OSError("weights missing")
+
+        registry.preload("broken", loader).thread.join(5)
+        self.assertIsNone(registry.get_nowait("broken", loader))
+        readiness = registry.readiness()
+        self.assertTrue(readiness["ready"])
+        self.assertTrue(readiness["degraded"])
+        self.assertIn("weights missing", readiness["models"]["broken"]["error"])
+
+    def test_health_probes(self):
+        """Test the liveness and readiness endpoints"""
+        client = app.test_client()
+        self.assertEqual(client.get('/health/live').status_code, 200)
+        response = client.get('/health/ready')
+        self.assertIn(response.status_code, (200, 503))
+        self.assertIn("models", json.loads(response.data))
+
+
+class ResultCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        """Use a throwaway directory for the shared store"""
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+    def test_cache_key_covers_request_options(self):
+        """Test that every request option changes the cache key"""
+        key = make_cache_key("x = 1", "energy_efficiency", True, True, None)
+        self.assertEqual(key, make_cache_key("x = 1", "energy_efficiency", True, True, None))
+        self.assertNotEqual(key, make_cache_key("x = 2", "energy_efficiency", True, True, None))
+        self.assertNotEqual(key, make_cache_key("x = 1", "readability", True, True, None))
+        self.assertNotEqual(key, make_cache_key("x = 1", "energy_efficiency", False, True, None))
+        self.assertNotEqual(key, make_cache_key("x = 1", "energy_efficiency", True, True, "starcoder1b"))
+
+    def test_lru_eviction_and_ttl(self):
+        """Test that the memory tier is size bounded and entries expire"""
+        cache = ResultCache(max_entries=2, ttl=0.05, cache_dir=None)
+        cache.set("a", {"v": 1})
+        cache.set("b", {"v": 2})
+        cache.get("a")
+        cache.set("c", {"v": 3})
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), {"v": 1})
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_disk_store_shared_between_workers(self):
+        """Test that results and invalidations are visible across cache instances"""
+        worker_a = ResultCache(cache_dir=self.cache_dir.name)
+        worker_b = ResultCache(cache_dir=self.cache_dir.name)
+
+        worker_a.set("key", {"green_score": 80})
+        self.assertEqual(worker_b.get("key"), {"green_score": 80})
+        self.assertEqual(worker_b.stats()["disk_hits"], 1)
+
+        worker_a.invalidate()
+        self.assertIsNone(worker_b.get("key"))
+
+    def test_callers_get_their_own_copy(self):
+        """Test that changing a stored or returned result doesn't change later hits"""
+        cache = ResultCache(cache_dir=None)
+        result = {"timings": {"total": 1.0}}
+        cache.set("key", result)
+        result["timings"]["total"] = 2.0
+        cache.get("key")["timings"]["extra"] = 3.0
+        self.assertEqual(cache.get("key"), {"timings": {"total": 1.0}})
+
+    def test_fallback_while_the_model_loads_is_not_cached(self):
+        """Test that a result made while the model loads isn't served once the model is ready"""
+        result_cache.invalidate()
+        client = app.test_client()
+        code = "def loading_fallback(values):\n    total = 0\n    for v in values:\n        total += v\n    return total\n"
+        get_model = AIOptimizer.get_model
+        AIOptimizer.get_model = lambda self, wait=True: get_model(self, wait) if wait else None
+        try:
+            response = client.post('/analyze', json={'code': code, 'variants': False})
+        finally:
+            AIOptimizer.get_model = get_model
+        self.assertEqual(json.loads(response.data)["optimization"]["model_status"], "loading")
+
+        AIOptimizer().get_model(wait=True)
+        response = client.post('/analyze', json={'code': code, 'variants': False})
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        self.assertNotIn("model_status", json.loads(response.data)["optimization"])
+        self.assertEqual(client.post('/analyze', json={'code': code, 'variants': False}).headers["X-Cache"], "HIT")
+
+
+class ParsedSourceTests(unittest.TestCase):
+
+    def test_line_index_and_functions(self):
+        """Test that offsets map to lines and functions are indexed by qualified name"""
+        code = "class A:\n    def f(self):\n        return 1\n\ndef g():\n    pass\n"
+        source = parse_source(code)
+
+        self.assertTrue(source.is_valid)
+        self.assertEqual(source.line_of(0), 1)
+        self.assertEqual(source.line_of(code.index("def g")), 5)
+        self.assertEqual(list(source.functions), ["A.f", "g"])
+        self.assertEqual(source.segment(source.functions["g"]), "def g():\n    pass")
+        self.assertIs(parse_source(source), source)
+        with self.assertRaises(AttributeError):
+            source.code = "x = 1"
+
+    def test_stages_accept_parsed_source(self):
+        """Test that a syntax error is reported from the shared parse"""
+        source = parse_source("def broken(:\n    pass")
+        results = static_analysis(source)
+
+        self.assertEqual(results["severity"], "high")
+        self.assertEqual(results["inefficiencies"][0]["type"], "syntax_error")
+
+
+class DetectorEngineTests(unittest.TestCase):
+
+    def test_ignores_patterns_in_strings_and_comments(self):
+        """Test that code-like text inside strings and comments is not reported"""
+        code = (
+            "def f():\n"
+            "    text = 'for a in b:\\n    for c in d:'\n"
+            "    # for a in b:\n"
+            "    #     for c in d:\n"
+            "    return text\n"
+        )
+        self.assertEqual(DetectorEngine(default_detectors()).run(code), [])
+
+    def test_findings_have_exact_spans(self):
+        """Test detection of patterns regardless of layout, with line and column spans"""
+        code = (
+            "def f(items):\n"
+            "    result = []\n"
+            "\n"
+            "    for x in items:\n"
+            "        if x > 0:\n"
+            "            result.append(x * 2)\n"
+            "    total = 0\n"
+            "    for x in result: total += x\n"
+            "    for a in items:\n"
+            "        while a:\n"
+            "            a -= 1\n"
+            "    return result, total\n"
+        )
+        findings = {f["type"]: f for f in DetectorEngine(default_detectors()).run(code)}
+
+        comprehension = findings["list_comprehension_opportunity"]
+        self.assertEqual((comprehension["line"], comprehension["column"]), (2, 5))
+        self.assertEqual((comprehension["end_line"], comprehension["end_column"]), (6, 33))
+        self.assertEqual(findings["inefficient_builtin"]["line"], 7)
+        self.assertEqual(findings["nested_loops"]["line"], 10)
+
+    def test_custom_detector_registration(self):
+        """Test that registered detectors are dispatched by node type"""
+        class PrintDetector(Detector):
+            issue_type = "print_call"
+            message = "print call"
+            node_types = (ast.Call,)
+
+            def visit(self, node, context, source):
+                if isinstance(node.func, ast.Name) and node.func.id == "print":
+                    return self.finding(source, node)
+                return None
+
+        findings = DetectorEngine([PrintDetector()]).run("x = 1\nprint(x)\n")
+        self.assertEqual([(f["type"], f["line"], f["column"]) for f in findings], [("print_call", 2, 1)])
+
+
+class ScannerTests(unittest.TestCase):
+
+    def test_rescan_only_analyzes_changed_files(self):
+        """Test that the content-hash cache skips unchanged files and SARIF output is produced"""
+        with tempfile.TemporaryDirectory() as project:
+            for name in ("a.py", "b.py"):
+                with open(os.path.join(project, name), "w") as f:
+                    f.write("def f(items):\n    for x in items:\n        for y in items:\n            pass\n")
+            cache_path = os.path.join(project, "cache.json")
+
+            records, stats = scan([project], jobs=1, cache_path=cache_path)
+            self.assertEqual((stats["files"], stats["analyzed"]), (2, 2))
+
+            with open(os.path.join(project, "b.py"), "a") as f:
+                f.write("x = 1\n")
+            records, stats = scan([project], jobs=1, cache_path=cache_path)
+            self.assertEqual((stats["analyzed"], stats["cached"]), (1, 1))
+            self.assertEqual([r["cached"] for r in records], [True, False])
+
+            sarif = to_sarif(records, stats["root"])
+            result = sarif["runs"][0]["results"][0]
+            self.assertEqual(result["ruleId"], "nested_loops")
+            self.assertEqual(result["locations"][0]["physicalLocation"]["region"]["startLine"], 3)
+
+    def test_paths_are_relative_to_the_scan_root(self):
+        """Test that record paths, cache keys and SARIF URIs don't depend on the working directory"""
+        with tempfile.TemporaryDirectory() as project:
+            os.makedirs(os.path.join(project, "pkg"))
+            with open(os.path.join(project, "pkg", "a.py"), "w") as f:
+                f.write("def f(items):\n    for x in items:\n        for y in items:\n            pass\n")
+            with open(os.path.join(project, "broken.py"), "w") as f:
+                f.write("def broken(:\n")
+            cache_path = os.path.join(project, "cache.json")
+
+            records, stats = scan([project], jobs=1, cache_path=cache_path)
+            self.assertEqual([r["path"] for r in records], ["broken.py", "pkg/a.py"])
+            cwd = os.getcwd()
+            os.chdir(project)
+            try:
+                _, stats = scan([project], jobs=1, cache_path=cache_path)
+            finally:
+                os.chdir(cwd)
+            self.assertEqual(stats["cached"], 2)
+
+            run = to_sarif(records, stats["root"])["runs"][0]
+            self.assertEqual(run["originalUriBaseIds"]["SRCROOT"]["uri"], pathlib.Path(project).as_uri() + "/")
+            location = run["results"][0]["locations"][0]["physicalLocation"]["artifactLocation"]
+            self.assertEqual(location, {"uri": "broken.py", "uriBaseId": "SRCROOT"})
+            rules = {rule["id"]: rule["shortDescription"]["text"] for rule in run["tool"]["driver"]["rules"]}
+            self.assertEqual(rules["syntax_error"], "File is not valid Python")
+            self.assertNotIn("O(n^2)", rules)
+            self.assertIn("high_time_complexity", rules)
+
+
+class JobManagerTests(unittest.TestCase):
+
+    def test_partial_results_before_completion(self):
+        """Test that finished stages are visible while the job is still running"""
+        manager = JobManager(max_workers=1)
+        release = threading.Event()
+
+        def work(on_stage):
+            on_stage("static_analysis", {"inefficiencies": []})
+            release.wait(5)
+            return {"done": True}
+
+        job = manager.submit(work, total_stages=2)
+        for _ in range(100):
+            snapshot = manager.get(job["id"])
+            if snapshot["partial_results"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(snapshot["status"], "running")
+        self.assertEqual(snapshot["partial_results"], {"static_analysis": {"inefficiencies": []}})
+
+        release.set()
+        for _ in range(100):
+            snapshot = manager.get(job["id"])
+            if snapshot["status"] == "completed":
+                break
+            time.sleep(0.01)
+        self.assertEqual(snapshot["result"], {"done": True})
+
+    def test_bounded_queue_and_retention(self):
+        """Test that excess jobs are rejected and old finished jobs are dropped"""
+        manager = JobManager(max_workers=1, max_pending=1, max_retained=1)
+        release = threading.Event()
+        manager.submit(lambda on_stage: release.wait(5))
+        with self.assertRaises(JobQueueFull):
+            manager.submit(lambda on_stage: None)
+        release.set()
+
+        first = manager.complete({"n": 1})
+        second = manager.complete({"n": 2})
+        self.assertIsNone(manager.get(first["id"]))
+        self.assertIsNotNone(manager.get(second["id"]))
+
+
+class StreamingTests(unittest.TestCase):
+
+    def test_tokens_streamed_before_generation_returns(self):
+        """Test that generated text reaches the callback through the streamer"""
+        import numpy as np
+
+        class FakeTokenizer:
+            def decode(self, tokens, **kwargs):
+                return "".join(chr(t) for t in tokens)
+
+        class FakePipeline:
+            tokenizer = FakeTokenizer()
+
+            def __call__(self, prompt, streamer=None, **kwargs):
+                streamer.put(np.array([[0]]))  # prompt tokens are skipped
+                for char in "x = 1\n":
+                    streamer.put(np.array([ord(char)]))
+                streamer.end()
+                return [{"generated_text": prompt + "x = 1\n"}]
+
+        chunks = []
+        generated = generate_with_streamer(FakePipeline(), "# prompt\n", chunks.append, timeout=5)
+        self.assertEqual("".join(chunks), "x = 1\n")
+        self.assertEqual(generated[0]["generated_text"], "# prompt\nx = 1\n")
+
+    def test_stream_stops_at_code_end_and_on_disconnect(self):
+        """Test that prose after the code is not streamed and generation stops when the reader goes away"""
+        import numpy as np
+
+        class FakeTokenizer:
+            def decode(self, tokens, **kwargs):
+                return "".join(chr(t) for t in tokens)
+
+        class FakePipeline:
+            tokenizer = FakeTokenizer()
+
+            def __init__(self, text):
+                self.text = text
+                self.stopped = threading.Event()
+
+            def __call__(self, prompt, streamer=None, stopping_criteria=None, **kwargs):
+                streamer.put(np.array([[0]]))
+                for char in self.text:
+                    streamer.put(np.array([ord(char)]))
+                    time.sleep(0.001)
+                    if any(criterion(None, None) for criterion in stopping_criteria):
+                        self.stopped.set()
+                        break
+                streamer.end()
+                return [{"generated_text": prompt + self.text}]
+
+        chunks = []
+        pipeline = FakePipeline("x = 1\n```\nThis version is faster because...\n" * 20)
+        generate_with_streamer(pipeline, "```python\n", chunks.append, timeout=5, stop_on_code_end=True)
+        self.assertEqual("".join(chunks), "x = 1\n```")
+        self.assertTrue(pipeline.stopped.is_set())
+
+        def disconnected(text):
+            raise StreamClosed()
+
+        pipeline = FakePipeline("x = 1\n" * 1000)
+        with self.assertRaises(StreamClosed):
+            generate_with_streamer(pipeline, "# prompt\n", disconnected, timeout=5)
+        self.assertTrue(pipeline.stopped.wait(5))
+
+    def test_disconnect_ends_the_optimization_without_a_fallback(self):
+        """Test that a closed stream is not turned into a rule-based fallback result"""
+        def disconnected(text):
+            raise StreamClosed()
+
+        optimizer = AIOptimizer()
+        optimizer.get_model(wait=True)
+        code = "def disconnect_total(values):\n    total = 0\n    for v in values:\n        total += v\n    return total\n"
+        with self.assertRaises(StreamClosed):
+            optimizer.optimize(code, on_token=disconnected)
+
+    def test_emit_fails_once_the_stream_is_closed(self):
+        """Test that the producer is told to stop when the client stops reading"""
+        release = threading.Event()
+        done = threading.Event()
+        outcome = {}
+
+        def produce(emit):
+            emit("static_analysis", {})
+            release.wait(5)
+            try:
+                emit("token", {"text": "x"})
+            except StreamClosed:
+                outcome["closed"] = True
+            done.set()
+
+        events = stream_events(produce)
+        next(events)
+        events.close()
+        release.set()
+        self.assertTrue(done.wait(5))
+        self.assertTrue(outcome.get("closed"))
+
+    def test_stream_events_format(self):
+        """Test that emitted events are encoded as SSE and errors are reported"""
+        def produce(emit):
+            emit("static_analysis", {"severity": "low"})
+            raise RuntimeError("boom")
+
+        events = list(stream_events(produce))
+        self.assertEqual(events[0], 'event: static_analysis\ndata: {"severity": "low"}\n\n')
+        self.assertEqual(events[1], 'event: error\ndata: {"error": "boom"}\n\n')
+
+
+class InferenceWorkerTests(unittest.TestCase):
+
+    class FakeTokenizer:
+        pad_token = None
+        eos_token = "<eos>"
+
+        def __call__(self, text, **kwargs):
+            return {"input_ids": text.split()}
+
+    class FakePipeline:
+        def __init__(self):
+            self.tokenizer = InferenceWorkerTests.FakeTokenizer()
+            self.model = None
+            self.calls = []
+
+        def __call__(self, prompts, batch_size=None, **kwargs):
+            time.sleep(0.05)
+            if isinstance(prompts, str):
+                self.calls.append(1)
+                return [{"generated_text": prompts + " done"}]
+            self.calls.append(len(prompts))
+            return [[{"generated_text": prompt + " done"}] for prompt in prompts]
+
+    def test_concurrent_requests_are_batched(self):
+        """Test that prompts submitted together run as one batch and get their own outputs"""
+        pipeline = self.FakePipeline()
+        worker = InferenceWorker(pipeline, max_batch_size=4, max_wait_ms=200)
+        futures = [worker.submit(f"prompt {i}", max_length=64) for i in range(4)]
+        outputs = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(pipeline.calls, [4])
+        self.assertEqual(outputs[2], [{"generated_text": "prompt 2 done"}])
+        self.assertEqual(pipeline.tokenizer.padding_side, "left")
+        stats = worker.stats()
+        self.assertEqual(stats["batch_sizes"], {4: 1})
+        self.assertEqual(stats["generated_tokens"], 4)
+        self.assertGreater(stats["tokens_per_second"], 0)
+
+    def test_different_generation_arguments_are_not_mixed(self):
+        """Test that requests with different generation arguments run in separate batches"""
+        pipeline = self.FakePipeline()
+        worker = InferenceWorker(pipeline, max_batch_size=4, max_wait_ms=100)
+        first = worker.submit("a", temperature=0.2)
+        second = worker.submit("b", temperature=0.8)
+        self.assertEqual(first.result(timeout=5), [{"generated_text": "a done"}])
+        self.assertEqual(second.result(timeout=5), [{"generated_text": "b done"}])
+        self.assertEqual(pipeline.calls, [1, 1])
+
+    def test_prompt_without_its_prefix_falls_back_to_pipeline(self):
+        """Test that a prefix the prompt does not start with is ignored"""
+        pipeline = self.FakePipeline()
+        worker = InferenceWorker(pipeline, max_wait_ms=0)
+        output = worker.submit("code", prefix="# preamble\n", max_length=64).result(timeout=5)
+        self.assertEqual(output, [{"generated_text": "code done"}])
+        self.assertEqual(worker.stats()["prefix_cache"]["misses"], 0)
+
+
+def tiny_causal_lm(corpus):
+    """A small randomly initialized GPT-2 and a BPE tokenizer trained on ``corpus``, built offline."""
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=400, special_tokens=["<eos>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe, eos_token="<eos>", pad_token="<eos>")
+    torch.manual_seed(0)
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=len(tokenizer), n_positions=256, n_embd=32, n_layer=2, n_head=2))
+    model.eval()
+    return model, tokenizer
+
+
+class PrefixCacheTests(unittest.TestCase):
+
+    prefix = "# Optimize this Python code:\n"
+    code = "def f(items):\n    return [x * 2 for x in items]\n"
+
+    class MergingTokenizer:
+        """Character tokens, except that a blank line is one token, also across the preamble boundary."""
+
+        pad_token_id = 0
+
+        def __call__(self, text, **kwargs):
+            if isinstance(text, list):
+                return {"input_ids": [self(item)["input_ids"] for item in text]}
+            return {"input_ids": [ord(token[0]) + 1000 * (len(token) - 1) for token in re.findall(r"\n\n|.", text, re.S)]}
+
+    def test_preamble_split_by_a_merge_is_not_reused(self):
+        """Test that prompts whose tokens don't start with the preamble's tokens fall back to a full prefill"""
+        cache = PrefixCache(model=None, tokenizer=self.MergingTokenizer())
+        self.assertIsNone(cache.prepare([self.prefix + "\n" + self.code], self.prefix))
+        self.assertEqual(cache.stats()["boundary_mismatches"], 1)
+        self.assertEqual(cache.stats()["misses"], 0)
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "needs torch")
+    def test_cached_preamble_generates_the_same_tokens(self):
+        """Test that generating on the cached preamble gives the tokens of a full prefill"""
+        import torch
+
+        prompt = self.prefix + self.code + "# Faster version:\n"
+        model, tokenizer = tiny_causal_lm([prompt] * 20)
+        cache = PrefixCache(model, tokenizer)
+        inputs = cache.prepare([prompt], self.prefix)
+        self.assertIsNotNone(inputs)
+
+        full_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+        self.assertEqual(inputs["input_ids"].tolist(), full_ids.tolist())
+        with torch.no_grad():
+            cached = model.generate(**inputs, max_new_tokens=8, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+            full = model.generate(full_ids, attention_mask=torch.ones_like(full_ids), max_new_tokens=8,
+                                  do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        self.assertEqual(cached[0, full_ids.shape[1]:].tolist(), full[0, full_ids.shape[1]:].tolist())
+        self.assertEqual(cache.stats()["reused_tokens"], len(tokenizer(self.prefix)["input_ids"]))
+
+    def test_prompts_sharing_the_code_split_at_the_first_different_token(self):
+        """Test that the code every prompt shares is the stem and only the task lines are per prompt"""
+        tokenizer = self.MergingTokenizer()
+        prompts = [self.prefix + self.code + "# Task: energy\n", self.prefix + self.code + "# Task: speed\n"]
+        prefix_ids, stem, rests = _split_prompt_ids(tokenizer, prompts, self.prefix)
+
+        self.assertEqual(prefix_ids, tokenizer(self.prefix)["input_ids"])
+        self.assertEqual(stem, tokenizer(self.code + "# Task: ")["input_ids"])
+        self.assertEqual(rests, [tokenizer("energy\n")["input_ids"], tokenizer("speed\n")["input_ids"]])
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "needs torch")
+    def test_shared_stem_generates_the_same_tokens_per_prompt(self):
+        """Test that a batch prefilled on a shared stem generates each prompt's full-prefill tokens"""
+        import torch
+
+        prompts = [self.prefix + self.code + "# Task: energy\n", self.prefix + self.code + "# Task: speed\n"]
+        model, tokenizer = tiny_causal_lm(prompts * 10)
+        cache = PrefixCache(model, tokenizer)
+        inputs = cache.prepare(prompts, self.prefix)
+        self.assertIsNotNone(inputs)
+        self.assertGreater(cache.stats()["shared_tokens"], len(tokenizer(self.code)["input_ids"]) // 2)
+
+        width = inputs["input_ids"].shape[1]
+        with torch.no_grad():
+            batched = model.generate(**inputs, max_new_tokens=8, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+            for row, prompt in enumerate(prompts):
+                full_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+                full = model.generate(full_ids, attention_mask=torch.ones_like(full_ids), max_new_tokens=8,
+                                      do_sample=False, pad_token_id=tokenizer.pad_token_id)
+                self.assertEqual(batched[row, width:].tolist(), full[0, full_ids.shape[1]:].tolist())
+
+
+class StagePipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_independent_stages_run_concurrently(self):
+        """Test that independent stages overlap and dependents get their inputs"""
+        def slow(value):
+            def run(inputs):
+                time.sleep(0.2)
+                return value
+            return run
+
+        pipeline = StagePipeline([
+            Stage("a", slow(1)),
+            Stage("b", slow(2)),
+            Stage("c", slow(3)),
+            Stage("total", lambda inputs: inputs["a"] + inputs["b"], depends_on=("a", "b")),
+        ])
+        finished = []
+        start_time = time.time()
+        results, timings = pipeline.run(self.executor, on_stage=lambda name, result: finished.append(name))
+
+        self.assertLess(time.time() - start_time, 0.5)
+        self.assertEqual(results["total"], 3)
+        self.assertGreater(finished.index("total"), max(finished.index("a"), finished.index("b")))
+        self.assertEqual(set(timings), {"a", "b", "c", "total"})
+        self.assertGreaterEqual(timings["a"], 0.2)
+
+    def test_stage_failure_is_raised(self):
+        """Test that a failing stage stops its dependents and re-raises"""
+        def fail(inputs):
+            raise RuntimeError("boom")
+
+        called = []
+        pipeline = StagePipeline([
+            Stage("fail", fail),
+            Stage("after", lambda inputs: called.append(True), depends_on=("fail",)),
+        ])
+        with self.assertRaises(RuntimeError):
+            pipeline.run(self.executor)
+        self.assertEqual(called, [])
+
+    def test_invalid_graphs_are_rejected(self):
+        """Test that unknown dependencies and cycles are rejected"""
+        with self.assertRaises(ValueError):
+            StagePipeline([Stage("a", None, depends_on=("missing",))])
+        with self.assertRaises(ValueError):
+            StagePipeline([Stage("a", None, depends_on=("b",)), Stage("b", None, depends_on=("a",))])
+
+
+class SandboxPoolTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SandboxPool(size=1, timeout=4, cpu_seconds=1, memory_mb=512, max_runs=2).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def test_runs_code_with_restricted_builtins(self):
+        """Test that code runs in a worker with only the allowed builtins"""
+        result = self.pool.run("print(sum(range(4)))", allowed_builtins=("print", "range", "sum"))
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(result["stdout"], "6\n")
+
+        result = self.pool.run("import os", allowed_builtins=("print",))
+        self.assertEqual(result["status"], "error")
+
+    def test_runaway_code_is_stopped_and_worker_replaced(self):
+        """Test that CPU, memory and wall-clock limits stop a run without breaking the pool"""
+        self.assertEqual(self.pool.run("while True: pass")["status"], "cpu_limit")
+        self.assertEqual(self.pool.run("import time\ntime.sleep(10)")["status"], "timeout")
+        self.assertEqual(self.pool.run("x = ' ' * (2 * 1024 ** 3)")["status"], "memory_limit")
+        self.assertEqual(self.pool.run("x = 1")["status"], "ok")
+        stats = self.pool.stats()
+        self.assertGreaterEqual(stats["recycled"], 1)
+        self.assertEqual(stats["idle"], 1)
+
+    def test_worker_results_are_never_unpickled(self):
+        """Test that results come back as plain JSON data and forged pickles are rejected"""
+        marker = os.path.join(tempfile.mkdtemp(), "unpickled")
+        payload = (
+            "class Payload:\n"
+            "    def __reduce__(self):\n"
+            f"        return (open, ({marker!r}, 'w'))\n"
+        )
+        result = self.pool.run(payload + "class Text(str):\n    pass\n__result__ = [Text('x'), Payload()]")
+        self.assertEqual(result["status"], "ok")
+        self.assertIs(type(result["result"]), str)
+
+        result = self.pool.run("__result__ = {'items': [Text('x') for Text in [type('Text', (str,), {})]]}")
+        self.assertEqual(result["result"], {"items": ["x"]})
+        self.assertIs(type(result["result"]["items"][0]), str)
+
+        # Code with full builtins can write its own message to the pipe
+        forged = payload + (
+            "import os, pickle, struct, sys\n"
+            "data = pickle.dumps(Payload())\n"
+            "os.write(int(sys.argv[2]), struct.pack('!i', len(data)) + data)\n"
+        )
+        self.assertEqual(self.pool.run(forged)["status"], "crashed")
+        self.assertFalse(os.path.exists(marker))
+        self.assertEqual(self.pool.run("x = 1")["status"], "ok")
+
+    def test_energy_excludes_waiting_for_a_worker(self):
+        """Test that the meter is read once a worker is free and CPU time covers the code only"""
+        class ClockMeter:
+            def read(self):
+                return time.perf_counter()
+
+            def joules(self, start, end):
+                return end - start
+
+        busy = threading.Thread(target=self.pool.run, args=("import time\ntime.sleep(0.5)",))
+        busy.start()
+        time.sleep(0.1)
+        result = self.pool.run("x = sum(range(1000))", meter=ClockMeter())
+        busy.join()
+
+        self.assertEqual(result["status"], "ok")
+        self.assertLess(result["energy_joules"], 0.3)
+        self.assertLess(result["cpu_time"], 0.1)
+        self.assertIsNone(self.pool.run("x = 1")["energy_joules"])
+
+
+class EnergyMeterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def write(self, path, content):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_rapl_reads_package_zones_and_handles_wraparound(self):
+        """Test that RAPL sums top-level package zones and survives counter wraparound"""
+        self.write("powercap/intel-rapl:0/name", "package-0\n")
+        self.write("powercap/intel-rapl:0/energy_uj", "999000000\n")
+        self.write("powercap/intel-rapl:0/max_energy_range_uj", "1000000000\n")
+        self.write("powercap/intel-rapl:0:0/name", "core\n")
+        self.write("powercap/intel-rapl:0:0/energy_uj", "5\n")
+        meter = RaplMeter(os.path.join(self.root, "powercap"))
+        start = meter.read()
+        self.write("powercap/intel-rapl:0/energy_uj", "1000000\n")
+        self.assertAlmostEqual(meter.joules(start, meter.read()), 2.0)
+        self.assertEqual(meter.describe()["zones"], ["intel-rapl:0"])
+        meter.close()
+
+    def test_cgroup_and_cpu_time_models(self):
+        """Test that CPU-time based meters convert usage with the per-core power"""
+        self.write("cgroup/cpu.stat", "usage_usec 1000000\nuser_usec 900000\n")
+        meter = CgroupCpuMeter(os.path.join(self.root, "cgroup"), watts_per_core=10)
+        start = meter.read()
+        self.write("cgroup/cpu.stat", "usage_usec 1500000\nuser_usec 1300000\n")
+        self.assertAlmostEqual(meter.joules(start, meter.read()), 5.0)
+        meter.close()
+
+        self.write("stat", "cpu  100 0 50 1000 0 0 0 0 0 0\ncpu0 100 0 50 1000 0 0 0 0 0 0\n")
+        meter = CpuTimeMeter(os.path.join(self.root, "stat"), watts_per_core=10)
+        start = meter.read()
+        self.write("stat", "cpu  200 0 50 1000 0 0 0 0 0 0\ncpu0 200 0 50 1000 0 0 0 0 0 0\n")
+        self.assertAlmostEqual(meter.joules(start, meter.read()), 100 / os.sysconf("SC_CLK_TCK") * 10)
+        meter.close()
+
+    def test_selection_falls_back_to_available_meter(self):
+        """Test that the first working meter is chosen, honouring the preferred one"""
+        self.write("cgroup/cpu.stat", "usage_usec 1\n")
+        meters = {
+            "rapl": lambda: RaplMeter(os.path.join(self.root, "missing")),
+            "cgroup": lambda: CgroupCpuMeter(os.path.join(self.root, "cgroup")),
+        }
+        self.assertEqual(select_energy_meter(meters=meters).name, "cgroup")
+        self.assertIsNone(select_energy_meter(meters={"rapl": meters["rapl"]}))
+
+
+
+class DifferentialRunnerTests(unittest.TestCase):
+
+    ORIGINAL = """
+def total(data):
+    result = 0
+    for x in data:
+        result += x
+    return result
+"""
+
+    def test_default_calls_follow_signatures(self):
+        """Test that each top-level function gets generated data for every required argument"""
+        calls, datasets = default_calls(parse_source("def f(a, b, c=1):\n    pass\n\ndef g():\n    pass\n"), size=3)
+        self.assertEqual([name for name, _ in calls], ["f", "g"])
+        self.assertEqual([kind for kind, _ in calls[0][1]], ["dataset", "dataset"])
+        self.assertEqual(calls[1][1], [])
+        self.assertEqual(len(datasets), 2)
+
+    def test_candidates_are_checked_for_equivalence(self):
+        """Test that equivalent, wrong and broken candidates get the right verdicts"""
+        comparison = compare_implementations(self.ORIGINAL, {
+            "optimized": "def total(data):\n    return sum(data)\n",
+            "wrong": "def total(data):\n    return sum(data) + 1\n",
+            "broken": "import os\ndef total(data):\n    return 0\n",
+            "same": self.ORIGINAL,
+        }, rounds=1)
+        candidates = comparison["candidates"]
+        self.assertTrue(candidates["optimized"]["equivalent"])
+        self.assertIn(candidates["optimized"]["verdict"], ("verified", "slower"))
+        self.assertIsNotNone(candidates["optimized"]["time_ratio"])
+        self.assertEqual(candidates["wrong"]["verdict"], "not_equivalent")
+        self.assertEqual(candidates["wrong"]["mismatches"], ["total"])
+        self.assertEqual(candidates["broken"]["verdict"], "error")
+        self.assertEqual(candidates["same"]["verdict"], "unchanged")
+
+    def test_mutated_arguments_and_printed_output_must_match(self):
+        """Test that candidates that stop mutating their argument or print differently are not equivalent"""
+        original = "def scale(data):\n    for i in range(len(data)):\n        data[i] *= 2\n    print(len(data))\n"
+        comparison = compare_implementations(original, {
+            "optimized": "def scale(data):\n    data[:] = [x * 2 for x in data]\n    print(len(data))\n",
+            "copy": "def scale(data):\n    data = [x * 2 for x in data]\n    print(len(data))\n",
+            "silent": "def scale(data):\n    data[:] = [x * 2 for x in data]\n",
+        }, rounds=1)
+        candidates = comparison["candidates"]
+        self.assertTrue(candidates["optimized"]["equivalent"])
+        self.assertEqual(candidates["copy"]["verdict"], "not_equivalent")
+        self.assertEqual(candidates["silent"]["verdict"], "not_equivalent")
+
+    def test_uncomparable_original_reports_error(self):
+        """Test that code without functions or with syntax errors is not compared"""
+        self.assertIn("error", compare_implementations("x = 1", {"optimized": "x = 2"}))
+        self.assertIn("error", compare_implementations("def f(:", {"optimized": "x = 2"}))
+
+
+
+class InputGeneratorTests(unittest.TestCase):
+
+    CODE = """
+def find_pairs(data, target):
+    pairs = []
+    for i in range(len(data)):
+        for j in range(i + 1, len(data)):
+            if data[i] + data[j] == target:
+                pairs.append((data[i], data[j]))
+    return pairs
+
+def count_words(text):
+    return len(text.split())
+
+def shout(words):
+    return [w.upper() for w in words]
+
+def fibonacci(n):
+    return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)
+
+def hinted(values: List[float], lookup: Dict[str, int], scale=2):
+    return values
+"""
+
+    def test_specs_from_usage_hints_and_names(self):
+        """Test that argument types are inferred from usage, type hints and names"""
+        specs = {node.name: argument_specs(node) for node in ast.parse(self.CODE).body}
+        self.assertEqual(specs["find_pairs"], [("data", ("list", "int")), ("target", ("int", "constant"))])
+        self.assertEqual(specs["count_words"], [("text", ("str",))])
+        self.assertEqual(specs["shout"], [("words", ("list", "str"))])
+        self.assertEqual(specs["fibonacci"], [("n", ("int", "size"))])
+        self.assertEqual(specs["hinted"], [("values", ("list", "float")), ("lookup", ("dict", "int"))])
+
+    def test_datasets_are_cached_and_read_by_workers(self):
+        """Test that generated data is written once and reaches the sandbox without pickling"""
+        cache = DatasetCache(tempfile.mkdtemp(), max_entries=2)
+        node = ast.parse(self.CODE).body[0]
+        args, datasets = build_call(node, 500, cache)
+        self.assertEqual(args[1], ("value", 10))
+        self.assertEqual(build_call(node, 500, cache)[1], datasets)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+        pool = SandboxPool(size=1, timeout=4)
+        try:
+            result = pool.run("__result__ = (type(__data_find_pairs_data__).__name__, len(__data_find_pairs_data__))",
+                              datasets=datasets)
+        finally:
+            pool.shutdown()
+        self.assertEqual(result["result"], ["array", 500])
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_metrics_endpoint_reports_requests_and_stages(self):
+        """Test that requests, stage latencies and token counts are exported"""
+        self.app.get('/health')
+        observe_stage("parse", 0.002)
+        GenerationTimer().observe(generated_tokens=3)
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.data.decode()
+        self.assertIn('greencode_requests_total{endpoint="/health",method="GET",status="200"}', body)
+        self.assertIn('greencode_requests_in_flight{endpoint="/health"} 0.0', body)
+        self.assertIn('greencode_stage_duration_seconds_count{stage="parse"}', body)
+        self.assertIn('greencode_generated_tokens_total', body)
+
+    def test_failing_request_is_counted_once(self):
+        """Test that a view raising an exception counts one request with status 500"""
+        from flask import Flask
+
+        failing_app = Flask("failing")
+        install_metrics(failing_app)
+
+        @failing_app.route('/metrics-test-failure')
+        def fail():
+            raise RuntimeError("boom")
+
+        self.assertEqual(failing_app.test_client().get('/metrics-test-failure').status_code, 500)
+        self.assertIn('greencode_requests_total{endpoint="/metrics-test-failure",method="GET",status="500"} 1.0',
+                      metrics_text().decode())
+
+
+class InferenceBackendTests(unittest.TestCase):
+
+    code = "def total(numbers):\n    return sum(numbers)"
+
+    def test_stub_backend_is_deterministic(self):
+        """Test that the stub answers with the prompt's code, alone and batched"""
+        pipeline = get_backend("stub").load("bigcode/starcoderbase-1b")
+        prompt = f"# Optimize this code:\n{self.code}\n\n# Optimized version:"
+        output = pipeline(prompt, max_length=1024)
+        self.assertEqual(output[0]["generated_text"], prompt + "\n" + self.code + "\n")
+        self.assertEqual(pipeline([prompt, prompt], batch_size=2), [output, output])
+
+        fenced = f"Rewrite it.\n```python\n{self.code}\n```\n\n```python\n"
+        self.assertEqual(pipeline(fenced)[0]["generated_text"], fenced + self.code + "\n```\n")
+
+    def test_stub_pipeline_through_registry_and_worker(self):
+        """Test that stages get the stub through get_pipeline and the batching worker"""
+        pipeline = get_pipeline("tiny-model", backend="stub")
+        self.assertIs(get_pipeline("tiny-model", backend="stub"), pipeline)
+        self.assertTrue(model_registry.is_loaded(pipeline_key("tiny-model", "stub")))
+
+        worker = get_inference_worker(pipeline)
+        prompt = f"# Code:\n{self.code}\n# Faster:"
+        output = worker(prompt, prefix="# Code:\n", max_new_tokens=200)
+        self.assertTrue(output[0]["generated_text"].endswith(self.code + "\n"))
+        self.assertEqual(worker.stats()["prefix_cache"]["hits"], 0)
+
+        chunks = []
+        generate_with_streamer(worker, prompt, chunks.append, timeout=5)
+        self.assertEqual("".join(chunks).strip(), self.code)
+
+    def test_unknown_backend(self):
+        """Test that an unknown backend name is rejected"""
+        with self.assertRaises(ValueError):
+            get_backend("tpu")
+
+
+class PromptLookupTests(unittest.TestCase):
+
+    def test_find_draft(self):
+        """Test that drafts follow the latest, longest match of the sequence's suffix"""
+        tokens = [1, 2, 3, 4, 5, 9, 2, 3, 7, 8, 2, 3]
+        self.assertEqual(find_draft(tokens, max_ngram=2, max_tokens=3), [7, 8, 2])
+        self.assertEqual(find_draft(tokens, max_ngram=2, max_tokens=1), [7])
+        self.assertEqual(find_draft([1, 2, 3, 1, 2], max_ngram=3, max_tokens=5), [3, 1, 2])
+        self.assertEqual(find_draft([1, 2, 3], max_ngram=3, max_tokens=5), [])
+        self.assertEqual(find_draft([1], max_ngram=3, max_tokens=5), [])
+
+    def test_crop_past_key_values(self):
+        """Test that every cached tensor keeps only the first positions"""
+        import numpy as np
+
+        layer = (np.zeros((1, 2, 6, 4)), np.zeros((1, 2, 6, 4)))
+        cropped = crop_past_key_values((layer, layer), 4)
+        self.assertIsInstance(cropped, tuple)
+        self.assertEqual([tensor.shape for pair in cropped for tensor in pair], [(1, 2, 4, 4)] * 4)
+
+    def test_stub_ignores_prompt_lookup(self):
+        """Test that backends without step-by-step models fall back to plain generation"""
+        pipeline = get_pipeline("tiny-model", backend="stub")
+        worker = get_inference_worker(pipeline)
+        output = worker("def f():\n    return 1\n", prompt_lookup=True, max_new_tokens=50)
+        self.assertTrue(output[0]["generated_text"].endswith("return 1\n"))
+        self.assertEqual(worker.stats()["prompt_lookup"]["requests"], 0)
+
+
+class GenerationControllerTests(unittest.TestCase):
+
+    def test_code_end(self):
+        """Test that code ends at its closing fence or at an unrelated top-level definition"""
+        completion = "\ndef f(x):\n    return helper(x)\n\ndef helper(x):\n    return x\n\n\ndef test_f():\n"
+        self.assertEqual(completion[:code_end(completion, {"f"})], completion.split("def test_f")[0])
+        self.assertIsNone(code_end("\ndef f(x):\n    return x\n", {"f"}))
+
+        fenced = "def f(x):\n    return x\n```\nThis version is faster"
+        self.assertEqual(fenced[:code_end(fenced, in_fence=True)], "def f(x):\n    return x\n```")
+        # Without an open fence, a fence after the code ends it
+        self.assertEqual(fenced[:code_end(fenced)], "def f(x):\n    return x\n")
+        self.assertIsNone(code_end("def f(x):\n    return x\n``", in_fence=True))
+
+    def test_controller_stops_when_code_is_complete(self):
+        """Test that the controller stops at the end of the code and reports the tokens saved"""
+        import numpy as np
+
+        tokenizer = get_backend("stub").load("tiny-model").tokenizer
+        prompt = "# Code:\ndef f(x):\n    return x\n# Faster:"
+        completion = "\ndef f(x):\n    return x\n\ndef main():\n    print(f(1))\n"
+        tokens = tokenizer.encode(prompt + completion)
+        controller = GenerationController(tokenizer, [prompt], max_new_tokens=100)
+        stopped = next(
+            length for length in range(len(prompt) + 1, len(tokens) + 1)
+            if controller(np.array([tokens[:length]]), None)
+        )
+        self.assertEqual(tokenizer.decode(tokens[len(prompt):stopped]), "\ndef f(x):\n    return x\n\ndef main():\n")
+
+        text, report = controller.finish(0, completion)
+        self.assertEqual(text, "\ndef f(x):\n    return x\n\n")
+        self.assertEqual(report["stop_reason"], "code_end")
+        self.assertEqual(report["saved_tokens"], 100 - report["new_tokens"])
+
+    def test_deadline(self):
+        """Test that every unfinished sequence stops once the deadline has passed"""
+        import numpy as np
+
+        tokenizer = get_backend("stub").load("tiny-model").tokenizer
+        controller = GenerationController(tokenizer, ["a", "b"], deadline=time.time() - 1)
+        self.assertTrue(controller(np.array([[97, 120], [98, 121]]), None))
+        self.assertEqual(controller.finish(1, "y")[1]["stop_reason"], "deadline")
+
+    def test_token_budget(self):
+        """Test that budgets grow with the code, in steps, within their bounds"""
+        tokenizer = get_backend("stub").load("tiny-model").tokenizer
+        self.assertEqual(token_budget(tokenizer, "x" * 10, minimum=64, maximum=512), 64)
+        self.assertEqual(token_budget(tokenizer, "x" * 100, ratio=1.5, minimum=64, maximum=512), 160)
+        self.assertEqual(token_budget(tokenizer, "x" * 1000, minimum=64, maximum=512), 512)
+
+    def test_worker_cuts_output_at_code_end(self):
+        """Test that the worker returns only the code and counts how generation stopped"""
+        worker = get_inference_worker(get_pipeline("tiny-model", backend="stub"))
+        prompt = "Rewrite it.\n```python\nx = 1\n```\n\n```python\n"
+        output = worker(prompt, max_new_tokens=64, stop_on_code_end=True, deadline_seconds=30)
+        self.assertEqual(output[0]["generated_text"], prompt + "x = 1\n```")
+        self.assertEqual(output[0]["generation"]["stop_reason"], "code_end")
+        self.assertGreaterEqual(worker.stats()["stop_reasons"]["code_end"], 1)
+
+
+class SemanticCacheTests(unittest.TestCase):
+
+    code = (
+        "def total(numbers):\n"
+        "    \"\"\"Add up the numbers.\"\"\"\n"
+        "    result = 0\n"
+        "    for n in numbers:  # every number\n"
+        "        result += n\n"
+        "    return result\n"
+    )
+    renamed = "def total(values):\n    acc = 0\n\n    for v in values:\n        acc += v\n    return acc\n"
+
+    def test_fingerprint_ignores_layout_comments_docstrings_and_locals(self):
+        """Test that only changes to the code's meaning change the fingerprint"""
+        fingerprint = fingerprint_source(self.code)
+        self.assertEqual(fingerprint.digest, fingerprint_source(self.renamed).digest)
+        self.assertEqual(fingerprint.names, {"numbers": "__v0", "result": "__v1", "n": "__v2"})
+        self.assertNotEqual(fingerprint.digest, fingerprint_source(self.renamed.replace("acc += v", "acc -= v")).digest)
+        # Function names and globals are part of the code's meaning
+        self.assertNotEqual(fingerprint.digest, fingerprint_source(self.code.replace("total", "add")).digest)
+        self.assertIsNone(fingerprint_source("def broken(:"))
+
+    def test_optimization_maps_back_to_caller_names(self):
+        """Test that an optimization stored with canonical names comes back with each caller's names"""
+        canonical = fingerprint_source(self.code).to_canonical("def total(numbers):\n    return sum(numbers)\n")
+        self.assertEqual(canonical, "def total(__v0):\n    return sum(__v0)\n")
+        self.assertEqual(
+            fingerprint_source(self.renamed).from_canonical(canonical), "def total(values):\n    return sum(values)\n"
+        )
+
+    def test_unsafe_renames_are_refused(self):
+        """Test that code a token rename could break is not cached"""
+        fingerprint = fingerprint_source(self.code)
+        self.assertIsNone(fingerprint.to_canonical('def total(numbers):\n    return f"{numbers}"\n'))
+        self.assertIsNone(fingerprint.to_canonical("def total(numbers):\n    return add(numbers=numbers)\n"))
+        # The caller already uses one of the names for something else
+        self.assertIsNone(fingerprint_source(self.renamed).from_canonical("def total(__v0):\n    acc = 1\n"))
+
+    def test_locals_shadowing_builtins_are_not_renamed(self):
+        """Test that an optimization calling a builtin the snippet shadowed keeps the builtin"""
+        code = (
+            "def largest(arr):\n"
+            "    max = arr[0]\n"
+            "    for x in arr:\n"
+            "        if x > max:\n"
+            "            max = x\n"
+            "    return max\n"
+        )
+        fingerprint = fingerprint_source(code)
+        self.assertNotIn("max", fingerprint.names)
+        self.assertNotEqual(fingerprint.digest, fingerprint_source(code.replace("max", "best")).digest)
+
+        canonical = fingerprint.to_canonical("def largest(arr):\n    return max(arr)\n")
+        self.assertEqual(canonical, "def largest(__v0):\n    return max(__v0)\n")
+        renamed = fingerprint_source(code.replace("arr", "items"))
+        self.assertEqual(renamed.digest, fingerprint.digest)
+        self.assertEqual(renamed.from_canonical(canonical), "def largest(items):\n    return max(items)\n")
+
+    def test_optimizer_serves_renamed_snippet_from_cache(self):
+        """Test that a renamed snippet gets the cached optimization without running the model"""
+        semantic_cache.invalidate()
+        optimizer = AIOptimizer()
+        optimizer.get_model(wait=True)
+        first = optimizer.optimize(self.code)
+        self.assertEqual(first["semantic_cache"], "miss")
+        second = optimizer.optimize(self.renamed)
+        self.assertEqual(second["semantic_cache"], "hit")
+        self.assertNotIn("generation", second)
+        self.assertIn("acc += v", second["optimized_code"])
+        self.assertNotIn("result", second["optimized_code"])
+
+
+class RewriteEngineTests(unittest.TestCase):
+
+    code = (
+        "def process(data):\n"
+        "    first = data[0]  # keep this comment\n"
+        "    values = []\n"
+        "    for item in data:\n"
+        "        if item > 0:\n"
+        "            values.append(item * 2)\n"
+        "    total = 0\n"
+        "    for value in values:\n"
+        "        total += value\n"
+        "    text = ''\n"
+        "    for value in values:\n"
+        "        text += str(value)\n"
+        "    return first, total, text\n"
+    )
+
+    def test_rewrites_keep_the_rest_of_the_code(self):
+        """Test that appends, sums and string concatenation are rewritten and nothing else changes"""
+        optimized, changes = default_engine.run(self.code)
+        self.assertEqual(optimized, (
+            "def process(data):\n"
+            "    first = data[0]  # keep this comment\n"
+            "    values = [item * 2 for item in data if item > 0]\n"
+            "    total = sum(values)\n"
+            "    text = ''.join([str(value) for value in values])\n"
+            "    return first, total, text\n"
+        ))
+        self.assertEqual([change["type"] for change in changes], ["list_comprehension", "builtin_function", "string_join"])
+
+        namespace = {}
+        exec(optimized, namespace)
+        self.assertEqual(namespace["process"]([3, -1, 2]), (3, 10, "64"))
+
+    def test_unsafe_loops_are_left_alone(self):
+        """Test that loops whose rewrite would change behavior are not rewritten"""
+        unsafe = [
+            # The loop variable is read after the loop
+            "def f(data):\n    out = []\n    for x in data:\n        out.append(x)\n    return out, x\n",
+            # The accumulator is read inside the loop
+            "def f(data):\n    out = []\n    for x in data:\n        out.append(len(out))\n    return out\n",
+            # The loop has an else clause
+            "def f(data):\n    t = 0\n    for x in data:\n        t += x\n    else:\n        t = -1\n    return t\n",
+        ]
+        for code in unsafe:
+            self.assertEqual(default_engine.run(code), (code, []))
+
+    def test_loop_variables_read_by_nested_scopes_are_kept(self):
+        """Test that a loop isn't removed while a closure, lambda or module function reads its variable"""
+        unsafe = [
+            "def f(xs):\n    def g():\n        return x\n    total = 0\n    for x in xs:\n        total += x\n"
+            "    return total, g()\n",
+            "def f(xs):\n    g = lambda: x\n    out = []\n    for x in xs:\n        out.append(x * 2)\n    return out, g()\n",
+            "def g():\n    return x\n\ntotal = 0\nfor x in [1, 2, 3]:\n    total += x\nresult = total, g()\n",
+        ]
+        for code in unsafe:
+            self.assertEqual(default_engine.run(code), (code, []))
+        namespace = {}
+        exec(unsafe[0], namespace)
+        self.assertEqual(namespace["f"]([1, 2, 3]), (6, 3))
+
+        # A nested function with its own x doesn't read the loop's
+        code = "def f(xs):\n    def g(x):\n        return x\n    total = 0\n    for x in xs:\n        total += x\n    return total\n"
+        self.assertIn("total = sum(xs)", default_engine.run(code)[0])
+
+    def test_shadowed_builtins_and_class_bodies_are_left_alone(self):
+        """Test that rewrites calling a rebound builtin or reading class-level names are not made"""
+        unsafe = [
+            # sum = sum(data) would read the local before it is assigned
+            "def f(data):\n    sum = 0\n    for x in data:\n        sum += x\n    return sum\n",
+            # The rewrite would call the module's own sum
+            "def sum(data):\n    return 0\n\ndef f(data):\n    t = 0\n    for x in data:\n        t += x\n    return t\n",
+            # A comprehension in a class body can't see the class's names
+            "class Config:\n    scale = 2\n    values = []\n    for x in range(3):\n        values.append(x * scale)\n",
+        ]
+        for code in unsafe:
+            self.assertEqual(default_engine.run(code), (code, []))
+            exec(code, {})
+
+        # Methods are still rewritten
+        code = "class Config:\n    def f(self, data):\n        t = 0\n        for x in data:\n            t += x\n        return t\n"
+        optimized, changes = default_engine.run(code)
+        self.assertIn("t = sum(data)", optimized)
+        self.assertEqual([change["type"] for change in changes], ["builtin_function"])
+
+    def test_rule_based_optimization_skips_the_model(self):
+        """Test that suggest_optimization answers from the rewrite rules when they apply"""
+        result = suggest_optimization(self.code)
+        self.assertTrue(result["explanation"].startswith("Code optimized using sustainable programming patterns"))
+        self.assertIn("total = sum(values)", result["optimized_code"])
+        self.assertEqual(len(result["changes"]), 3)
+
+    def test_green_version_keeps_indexing(self):
+        """Test that generators for large data don't turn subscripts into calls"""
+        code = (
+            "def process_large(data):\n"
+            "    first = data[0]\n"
+            "    return first, sum([x * 2 for x in data[1:]])\n"
+        )
+        green = generate_optimization_variants(code)["green_version"]["code"]
+        self.assertIn("first = data[0]", green)
+        self.assertIn("sum((x * 2 for x in data[1:]))", green)
+        ast.parse(green)
+
+
+class QuantizationTests(unittest.TestCase):
+
+    def test_parity_metrics(self):
+        """Test exact match, prefix and token agreement between generations"""
+        metrics = parity_metrics([[1, 2, 3, 4], [5, 6]], [[1, 2, 3, 4], [5, 7]])
+        self.assertEqual(metrics["prompts"], 2)
+        self.assertEqual(metrics["exact_match"], 0.5)
+        self.assertEqual(metrics["prefix_agreement"], 0.75)
+        self.assertEqual(metrics["token_agreement"], 0.75)
+
+    def test_quantization_modes(self):
+        """Test that "none" leaves the model alone and unknown modes are rejected"""
+        model = object()
+        self.assertIs(quantize_model(model, "none"), model)
+        self.assertEqual(model_quantization(model), "none")
+        self.assertIsNone(model_memory_bytes(model))
+        with self.assertRaises(ValueError):
+            quantize_model(model, "int4")
+
+
+class ComplexityProfilerTests(unittest.TestCase):
+
+    SIZES = [100, 316, 1000, 3162, 10000, 31623, 100000]
+
+    def test_fit_picks_generating_model(self):
+        """Test that synthetic timings are fitted to the model that produced them"""
+        models = {
+            "O(n)": lambda n: 1e-6 + 2e-8 * n,
+            "O(n*log(n))": lambda n: 1e-6 + 2e-8 * n * math.log(n),
+            "O(n^2)": lambda n: 1e-6 + 1e-9 * n * n,
+        }
+        for expected, model in models.items():
+            fit = fit_complexity(self.SIZES, [model(n) for n in self.SIZES])
+            self.assertEqual(fit["complexity"], expected)
+            self.assertGreater(fit["confidence"], 0.5)
+
+        # Flat timings are constant, exponential growth is detected on a small ladder
+        self.assertEqual(fit_complexity(self.SIZES, [3e-7] * len(self.SIZES))["complexity"], "O(1)")
+        sizes = [4, 8, 12, 16, 20]
+        self.assertEqual(fit_complexity(sizes, [1e-7 * 1.6 ** n for n in sizes])["complexity"], "O(2^n)")
+
+    def test_profiler_stops_early_on_exponential_growth(self):
+        """Test that measured functions get a fit and runaway recursion stops early"""
+        code = """
+def quadratic(items):
+    count = 0
+    for a in items:
+        for b in items:
+            count += 1
+    return count
+
+def fibonacci(n):
+    if n <= 1:
+        return n
+    return fibonacci(n - 1) + fibonacci(n - 2)
+"""
+        result = profile_complexity(code, budget=30)
+        self.assertEqual(result["functions"]["quadratic"]["complexity"], "O(n^2)")
+        fibonacci = result["functions"]["fibonacci"]
+        self.assertEqual(fibonacci["stopped"], "super_polynomial")
+        self.assertEqual(fibonacci["complexity"], "O(2^n)")
+        self.assertEqual(result["time_complexity"], "O(2^n)")
+
+
 if __name__ == '__main__':
     unittest.main()
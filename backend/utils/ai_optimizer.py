@@ -6,12 +6,23 @@ import re
 import time
 import os
 from dotenv import load_dotenv
-from transformers import pipeline
 import importlib.util
 
+from .generation_controller import GENERATION_DEADLINE_SECONDS, token_budget
+from .inference_worker import get_inference_worker
+from .model_registry import get_pipeline, model_registry, pipeline_key
+from .parsed_source import ParsedSource
+from .semantic_cache import SEMANTIC_CACHE_ENABLED, fingerprint_source, make_semantic_key, semantic_cache
+from .streaming import StreamClosed, generate_with_streamer
+
 # Load environment variables including Hugging Face token
 load_dotenv()
 
+# "greedy" (default), "prompt_lookup" (greedy, copying spans of the original code as
+# drafts that are verified in one forward pass) or "sampling". The deterministic modes
+# share optimizations between snippets through the semantic cache.
+DECODING_MODE = os.getenv("DECODING_MODE", "greedy").lower()
+
 class AIOptimizer:
     """Uses AI models to suggest context-aware optimizations for code."""
     
@@ -51,64 +62,71 @@ class AIOptimizer:
     
     @property
     def model(self):
-        """Lazy-load the model on first use."""
+        """Load the model on first use, sharing it through the model registry."""
         if self._model is None:
-            try:
-                # Use the token if available, otherwise use the saved token
-                if self.hf_token:
-                    print("Using token from environment variables")
-                    # Try to use locally cached model first
+            self._model = self.get_model(wait=True)
+        return self._model
+
+    def get_model(self, wait=True):
+        """
+        Get the shared pipeline, falling back to the smaller model if the larger one fails to load.
+
+        Args:
+            wait (bool): Block until the model is loaded. Otherwise return None while
+                it loads on a background thread, so callers can use the rule-based path.
+
+        Returns:
+            Pipeline: The shared pipeline, or None while it is loading
+        """
+        candidates = self._model_sources()
+        for index, (model, kwargs) in enumerate(candidates):
+            last = index == len(candidates) - 1
+            if wait:
                 try:
-                    local_model_path = "./models/models--bigcode--starcoderbase-3b"
-                    if os.path.exists(local_model_path):
-                        print("Using locally cached model")
-                        self._model = pipeline("text-generation", model=local_model_path)
-                    else:
-                        print("Downloading model from Hugging Face")
-                        self._model = pipeline("text-generation", model=self.model_name, use_auth_token=self.hf_token)
+                    return get_pipeline(model, **kwargs)
                 except Exception as e:
-                    print(f"Error loading model: {e}")
-                    # Fall back to smaller model if available
-                    smaller_model_path = "./models/models--bigcode--starcoderbase-1b"
-                    if os.path.exists(smaller_model_path):
-                        print("Falling back to smaller local model")
-                        self._model = pipeline("text-generation", model=smaller_model_path)
-                    else:
-                        # Last resort - download the smaller model
-                        print("Falling back to smaller remote model")
-                        self._model = pipeline("text-generation", model="bigcode/starcoderbase-1b", use_auth_token=self.hf_token)
-                else:
-                    print("Using saved Hugging Face token")
-                    self._model = pipeline("text-generation", model=self.model_name, use_auth_token=True)
-            except Exception as e:
-                print(f"Error loading model: {e}")
-                # Try one more time with explicit token if we have one
-                if self.hf_token:
-                    try:
-                        print("Retrying with explicit token...")
-                        self._model = pipeline("text-generation", model=self.model_name, token=self.hf_token)
-                    except Exception as e2:
-                        print(f"Second attempt failed: {e2}")
+                    print(f"Error loading model {model}: {e}")
+                    if last:
                         raise
-                else:
-                    raise
-        return self._model
+                    continue
+
+            # The inference worker is started on the loading thread, before the model is reported ready
+            pipeline = get_pipeline(model, wait=False, on_loaded=get_inference_worker, **kwargs)
+            if pipeline is not None:
+                return pipeline
+            if last or model_registry.load_status(pipeline_key(model)).get("state") != "failed":
+                return None
+        return None
+
+    def _model_sources(self):
+        """Models to try in order: the configured one, then the smaller one, preferring local copies."""
+        auth = {"use_auth_token": self.hf_token if self.hf_token else True}
+        local_model_path = "./models/models--bigcode--starcoderbase-3b"
+        smaller_model_path = "./models/models--bigcode--starcoderbase-1b"
+        return [
+            (local_model_path, {}) if os.path.exists(local_model_path) else (self.model_name, auth),
+            (smaller_model_path, {}) if os.path.exists(smaller_model_path) else ("bigcode/starcoderbase-1b", auth),
+        ]
     
-    def optimize(self, code, context="energy_efficiency", analysis_results=None, max_length=1024, temperature=0.2):
+    def optimize(self, code, context="energy_efficiency", analysis_results=None, max_length=1024, temperature=0.2, on_token=None):
         """
         Generate optimized code using the AI model.
         
         Args:
-            code (str): Original code to optimize
+            code (str or ParsedSource): Original code to optimize
             context (str): Optimization context (energy_efficiency, readability, etc.)
             analysis_results (dict, optional): Results from algorithm analysis to improve context
-            max_length (int): Maximum length of generated text
-            temperature (float): Sampling temperature for text generation
+            max_length (int): Maximum length of prompt and generated text; the new-token
+                budget is sized from the code within this limit
+            temperature (float): Sampling temperature, used with ``DECODING_MODE=sampling``
+            on_token (callable, optional): Called with each chunk of generated text as it is produced
             
         Returns:
             dict: Optimization results
         """
         start_time = time.time()
+        source = ParsedSource.ensure(code)
+        code = source.code
         
         # Initialize results structure
         results = {
@@ -129,14 +147,61 @@ class AIOptimizer:
             # Build the prompt with context awareness
             prompt = self._build_context_aware_prompt(code, context_info, analysis_results)
             
-            # Generate optimized code
-            generated = self.model(
-                prompt, 
-                max_length=max_length,
-                do_sample=True,
-                temperature=temperature,
-                num_return_sequences=1
-            )
+            # Never wait for the model to load: until it is ready, use the rule-based path
+            pipeline = self.get_model(wait=False)
+            if pipeline is None:
+                from .optimization import suggest_optimization
+                fallback = suggest_optimization(source)
+                results["optimized_code"] = fallback.get("optimized_code", code)
+                results["explanation"] = "AI model is still loading. Using rule-based optimization instead."
+                results["changes"] = fallback.get("changes", [])
+                results["model_status"] = "loading"
+                results["optimization_time"] = round(time.time() - start_time, 2)
+                return results
+
+            # Deterministic decoding gives snippets that only differ in layout, comments,
+            # docstrings or local names the same optimization, so it is generated once
+            fingerprint = None
+            if DECODING_MODE != "sampling" and SEMANTIC_CACHE_ENABLED:
+                fingerprint = fingerprint_source(source)
+            if fingerprint is not None:
+                cache_key = make_semantic_key(
+                    fingerprint, context, getattr(pipeline.model, "name_or_path", self.model_name), analysis_results
+                )
+                cached = semantic_cache.get(cache_key)
+                optimized_code = fingerprint.from_canonical(cached["optimized_code"]) if cached else None
+                if optimized_code is not None:
+                    if on_token:
+                        on_token(optimized_code)
+                    results["optimized_code"] = optimized_code
+                    results["explanation"] = self._generate_explanation(optimized_code, code, context, analysis_results)
+                    results["changes"] = self._identify_changes(code, optimized_code)
+                    results["semantic_cache"] = "hit"
+                    results["optimization_time"] = round(time.time() - start_time, 2)
+                    return results
+
+            # All calls go through the batching worker that owns the shared pipeline;
+            # the context's fixed preamble is only prefilled once
+            generator = get_inference_worker(pipeline)
+            # Generate optimized code, streaming tokens out if requested. Generation stops
+            # once the rewritten code is complete, within a budget sized from the code
+            prompt_tokens = len(pipeline.tokenizer(prompt, add_special_tokens=False)["input_ids"])
+            generate_kwargs = {
+                "max_new_tokens": max(1, min(token_budget(pipeline.tokenizer, code), max_length - prompt_tokens)),
+                "do_sample": DECODING_MODE == "sampling",
+                "num_return_sequences": 1,
+                "stop_on_code_end": True,
+                "deadline_seconds": GENERATION_DEADLINE_SECONDS,
+            }
+            if generate_kwargs["do_sample"]:
+                generate_kwargs["temperature"] = temperature
+            generate_kwargs["prefix"] = context_info["prompt_prefix"]
+            if DECODING_MODE == "prompt_lookup":
+                generate_kwargs["prompt_lookup"] = True
+            if on_token:
+                generated = generate_with_streamer(generator, prompt, on_token, **generate_kwargs)
+            else:
+                generated = generator(prompt, **generate_kwargs)
             
             # Extract the optimized code and explanation
             generated_text = generated[0]['generated_text']
@@ -149,12 +214,22 @@ class AIOptimizer:
             results["optimized_code"] = optimized_code.strip()
             results["explanation"] = self._generate_explanation(optimized_code, code, context, analysis_results)
             results["changes"] = self._identify_changes(code, optimized_code)
+            if "generation" in generated[0]:
+                results["generation"] = generated[0]["generation"]
+            if fingerprint is not None:
+                canonical_code = fingerprint.to_canonical(results["optimized_code"])
+                if canonical_code is not None:
+                    semantic_cache.set(cache_key, {"optimized_code": canonical_code})
+                results["semantic_cache"] = "miss"
             
+        except StreamClosed:
+            # The client disconnected: there is nobody to give a fallback to
+            raise
         except Exception as e:
             results["error"] = str(e)
             # Still provide a basic optimization using rule-based approach as fallback
             from .optimization import suggest_optimization
-            fallback = suggest_optimization(code)
+            fallback = suggest_optimization(source)
             results["optimized_code"] = fallback.get("optimized_code", code)
             results["explanation"] = f"AI optimization failed: {str(e)}. Using rule-based optimization instead."
             results["changes"] = fallback.get("changes", [])
@@ -281,21 +356,22 @@ class AIOptimizer:
         return changes
 
 
-def ai_optimize(code, context="energy_efficiency", analysis_results=None):
+def ai_optimize(code, context="energy_efficiency", analysis_results=None, on_token=None):
     """
     Wrapper function for AI-powered code optimization.
     
     Args:
-        code (str): Python code to optimize
+        code (str or ParsedSource): Python code to optimize
         context (str): Optimization context
         analysis_results (dict, optional): Results from algorithm analysis
+        on_token (callable, optional): Called with each chunk of generated text as it is produced
         
     Returns:
         dict: Optimization results
     """
     optimizer = AIOptimizer()
     try:
-        return optimizer.optimize(code, context, analysis_results)
+        return optimizer.optimize(code, context, analysis_results, on_token=on_token)
     except Exception as e:
         # Fallback to the original optimization logic
         from .optimization import suggest_optimization
@@ -7,6 +7,8 @@ import re
 from collections import defaultdict
 import time
 
+from .parsed_source import ParsedSource
+
 class AlgorithmAnalyzer:
     """Performs deep analysis of algorithms to detect complexity and suggest optimizations."""
     
@@ -61,11 +63,14 @@ class AlgorithmAnalyzer:
         Perform a deep analysis of the code to detect algorithm patterns and complexity.
         
         Args:
-            code (str): Python code as a string
+            code (str or ParsedSource): Python code as a string or already parsed
             
         Returns:
             dict: Analysis results including complexity, inefficient patterns, and optimization suggestions
         """
+        source = ParsedSource.ensure(code)
+        code = source.code
+
         results = {
             "time_complexity": "Unknown",
             "space_complexity": "Unknown",
@@ -173,7 +178,7 @@ def analyze_algorithm(code):
     Wrapper function to analyze algorithms in code.
     
     Args:
-        code (str): Python code as a string
+        code (str or ParsedSource): Python code as a string or already parsed
         
     Returns:
         dict: Analysis results
@@ -0,0 +1,277 @@
+"""
+Empirical complexity profiler: times each function at growing input sizes in the sandbox
+and fits the timings against common growth models
+"""
+
+import ast
+import math
+import os
+import time
+
+from .differential import SAFE_BUILTINS
+from .input_generator import MATERIALIZE_SOURCE, build_call, dataset_cache, has_size_argument
+from .parsed_source import ParsedSource
+from .sandbox import sandbox_pool
+
+# Input sizes for functions taking data, and for functions taking a size argument
+PROFILE_SIZES = tuple(int(size) for size in os.getenv("PROFILE_SIZES", "100,316,1000,3162,10000,31623,100000").split(","))
+PROFILE_SCALAR_SIZES = tuple(
+    int(size) for size in os.getenv("PROFILE_SCALAR_SIZES", "4,8,16,32,64,128,256,512,1024,2048,4096,8192,16384").split(",")
+)
+# Stop growing the input once a single call takes this long
+PROFILE_SIZE_BUDGET = float(os.getenv("PROFILE_SIZE_BUDGET", "0.5"))
+# Total time spent profiling one snippet
+PROFILE_BUDGET = float(os.getenv("PROFILE_BUDGET", "15"))
+PROFILE_MIN_TIME = float(os.getenv("PROFILE_MIN_TIME", "0.02"))
+# Growth faster than n^k between two sizes is treated as super-polynomial
+SUPERPOLYNOMIAL_EXPONENT = float(os.getenv("PROFILE_SUPERPOLYNOMIAL_EXPONENT", "4"))
+# Timings below this are too noisy to decide on super-polynomial growth
+NOISE_FLOOR = 1e-4
+# Timings within this factor of the fastest one are dominated by call overhead
+OVERHEAD_FACTOR = 4
+# A slower-growing model within this much relative error of the best fit is preferred,
+# since cache effects make large inputs look slightly super-linear
+FIT_TOLERANCE = float(os.getenv("PROFILE_FIT_TOLERANCE", "0.05"))
+
+# Growth models from slowest to fastest; the exponential one is fitted in log space
+MODELS = (
+    ("O(1)", lambda n: 0.0),
+    ("O(log(n))", lambda n: math.log(n)),
+    ("O(n)", lambda n: float(n)),
+    ("O(n*log(n))", lambda n: n * math.log(n)),
+    ("O(n^2)", lambda n: float(n) * n),
+    ("O(2^n)", None),
+)
+
+# Runs inside a sandbox worker; inputs come from cached dataset files
+HARNESS = MATERIALIZE_SOURCE + r'''
+import builtins as _builtins
+import time as _time
+
+_namespace = {
+    "__builtins__": {name: getattr(_builtins, name) for name in __safe_builtins__ if hasattr(_builtins, name)},
+    "__name__": "__profile__",
+}
+exec(compile(__code__, "<profile>", "exec"), _namespace)
+_func = _namespace[__function__]
+
+_best = None
+_elapsed = 0.0
+_count = 0
+_loop_start = _time.perf_counter()
+while _count == 0 or (
+    _elapsed < __min_time__ and _count < 1000 and _time.perf_counter() - _loop_start < 10 * __min_time__
+):
+    # Fresh copies in case the function mutates its arguments
+    _args = [_materialize(arg) for arg in __args__]
+    _start = _time.perf_counter()
+    _func(*_args)
+    _duration = _time.perf_counter() - _start
+    _elapsed += _duration
+    _count += 1
+    _best = _duration if _best is None else min(_best, _duration)
+
+__result__ = {"time": _best, "repeats": _count}
+'''
+
+
+def profile_complexity(code, budget=PROFILE_BUDGET):
+    """
+    Estimate the time complexity of each top-level function from measured timings.
+
+    Args:
+        code (str or ParsedSource): Python code
+        budget (float): Seconds to spend on the whole snippet
+
+    Returns:
+        dict: ``functions`` mapping each function to its fit, and the worst
+        ``time_complexity`` among them
+    """
+    source = ParsedSource.ensure(code)
+    if not source.is_valid:
+        return {"error": "Code has syntax errors", "functions": {}, "time_complexity": "Unknown"}
+
+    deadline = time.time() + budget
+    functions = {}
+    for node in source.tree.body:
+        if isinstance(node, ast.FunctionDef):
+            if time.time() >= deadline:
+                functions[node.name] = {"complexity": "Unknown", "confidence": 0.0, "stopped": "budget"}
+                continue
+            functions[node.name] = profile_function(source.code, node, deadline)
+
+    ranks = [name for name, _ in MODELS]
+    known = [result["complexity"] for result in functions.values() if result["complexity"] in ranks]
+    return {
+        "functions": functions,
+        "time_complexity": max(known, key=ranks.index) if known else "Unknown",
+    }
+
+
+def profile_function(code, node, deadline):
+    """
+    Time one function at growing sizes and fit the growth models.
+
+    Args:
+        code (str): Source defining the function
+        node (ast.FunctionDef): The function's definition
+        deadline (float): ``time.time()`` after which no more sizes are tried
+
+    Returns:
+        dict: Best ``complexity``, its ``confidence`` (0-1), the measured ``sizes`` and
+        ``timings``, the relative error of each model and why profiling ``stopped``
+    """
+    sizes = PROFILE_SCALAR_SIZES if has_size_argument(node) else PROFILE_SIZES
+    measured, timings = [], []
+    stopped = None
+    error = None
+
+    for size in sizes:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            stopped = "budget"
+            break
+        args, datasets = build_call(node, size, dataset_cache)
+        execution = sandbox_pool.run(HARNESS, inputs={
+            "__code__": code,
+            "__function__": node.name,
+            "__args__": args,
+            "__min_time__": PROFILE_MIN_TIME,
+            "__safe_builtins__": SAFE_BUILTINS,
+        }, timeout=min(remaining, sandbox_pool.timeout), datasets=datasets)
+        if execution["status"] in ("timeout", "cpu_limit"):
+            stopped = "timeout"
+            break
+        if execution["status"] != "ok" or not isinstance(execution["result"], dict):
+            error = execution["error"]
+            stopped = "error"
+            break
+
+        measured.append(size)
+        timings.append(execution["result"]["time"])
+        if len(timings) >= 2 and _superpolynomial(measured[-2:], timings[-2:]):
+            stopped = "super_polynomial"
+            break
+        if timings[-1] >= PROFILE_SIZE_BUDGET:
+            stopped = "size_budget"
+            break
+
+    result = {"sizes": measured, "timings": timings, "stopped": stopped}
+    if error:
+        result["error"] = error
+    result.update(fit_complexity(measured, timings, superpolynomial=stopped == "super_polynomial"))
+    return result
+
+
+def fit_complexity(sizes, timings, superpolynomial=False):
+    """
+    Fit timings against the growth models.
+
+    Each polynomial model ``a + b * f(n)`` is fitted by least squares weighted by the
+    inverse timing, so small and large inputs count equally. The exponential model
+    is fitted as a line through ``log(t)``. The slowest-growing model within
+    ``FIT_TOLERANCE`` of the lowest error wins. Sizes where the call overhead
+    dominates are left out of the fit, and a function whose time never rises
+    clearly above that overhead is constant.
+
+    Args:
+        sizes (list): Input sizes
+        timings (list): Seconds per call at each size
+        superpolynomial (bool): Whether profiling stopped on super-polynomial growth
+
+    Returns:
+        dict: ``complexity``, ``confidence`` and the relative RMS error of each model in ``fits``
+    """
+    if len(sizes) < 3:
+        # Too few points to fit; a blow-up between the first sizes still tells us something
+        return {
+            "complexity": "O(2^n)" if superpolynomial else "Unknown",
+            "confidence": 0.5 if superpolynomial else 0.0,
+            "fits": {},
+        }
+
+    floor = min(timings)
+    if max(timings) < OVERHEAD_FACTOR * floor:
+        spread = math.log(max(timings) / floor) / math.log(OVERHEAD_FACTOR) if floor > 0 else 1.0
+        return {
+            "complexity": "O(1)",
+            "confidence": round((1.0 - spread) * min(1.0, (len(sizes) - 2) / 3), 2),
+            "fits": {},
+        }
+    signal = [(n, t) for n, t in zip(sizes, timings) if t >= OVERHEAD_FACTOR * floor]
+    if len(signal) >= 3:
+        sizes, timings = [n for n, _ in signal], [t for _, t in signal]
+
+    fits = {}
+    for name, model in MODELS:
+        try:
+            predictions = _fit_exponential(sizes, timings) if model is None else _fit_linear(sizes, timings, model)
+        except (OverflowError, ValueError, ZeroDivisionError):
+            continue
+        if predictions is not None:
+            fits[name] = math.sqrt(
+                sum(((p - t) / t) ** 2 for p, t in zip(predictions, timings)) / len(timings)
+            )
+
+    ranked = sorted(fits, key=fits.get)
+    order = [name for name, _ in MODELS]
+    best = min(
+        (name for name in ranked if fits[name] <= fits[ranked[0]] + FIT_TOLERANCE),
+        key=order.index
+    )
+    ranked.remove(best)
+    ranked.insert(0, best)
+    # Confidence is the margin over the runner-up, scaled down when few sizes were measured
+    margin = 1.0 - fits[best] / fits[ranked[1]] if len(ranked) > 1 and fits[ranked[1]] > 0 else 1.0
+    confidence = max(0.0, min(1.0, margin)) * min(1.0, (len(sizes) - 2) / 3)
+    return {
+        "complexity": best,
+        "confidence": round(confidence, 2),
+        "fits": {name: round(value, 4) for name, value in fits.items()},
+    }
+
+
+def _superpolynomial(sizes, timings):
+    """Whether the time grew faster than ``n^SUPERPOLYNOMIAL_EXPONENT`` between two sizes."""
+    (n1, n2), (t1, t2) = sizes, timings
+    if t2 < NOISE_FLOOR or t1 <= 0:
+        return False
+    return math.log(t2 / t1) / math.log(n2 / n1) > SUPERPOLYNOMIAL_EXPONENT
+
+
+def _fit_linear(sizes, timings, model):
+    """Weighted least squares for ``a + b * f(n)`` with non-negative coefficients."""
+    features = [model(n) for n in sizes]
+    weights = [1.0 / (t * t) for t in timings]
+    s = sum(weights)
+    sf = sum(w * f for w, f in zip(weights, features))
+    st = sum(w * t for w, t in zip(weights, timings))
+    sff = sum(w * f * f for w, f in zip(weights, features))
+    sft = sum(w * f * t for w, f, t in zip(weights, features, timings))
+
+    det = s * sff - sf * sf
+    if det <= 0:
+        a, b = st / s, 0.0
+    else:
+        b = (s * sft - sf * st) / det
+        a = (st - b * sf) / s
+        if b < 0:
+            a, b = st / s, 0.0
+        elif a < 0:
+            a, b = 0.0, sft / sff
+    return [a + b * f for f in features]
+
+
+def _fit_exponential(sizes, timings):
+    """Least squares line through ``log(t)`` against ``n``; None if the time doesn't grow."""
+    logs = [math.log(t) for t in timings]
+    mean_n = sum(sizes) / len(sizes)
+    mean_log = sum(logs) / len(logs)
+    slope = (
+        sum((n - mean_n) * (y - mean_log) for n, y in zip(sizes, logs))
+        / sum((n - mean_n) ** 2 for n in sizes)
+    )
+    if slope <= 0:
+        return None
+    intercept = mean_log - slope * mean_n
+    return [math.exp(intercept + slope * n) for n in sizes]
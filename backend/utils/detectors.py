@@ -0,0 +1,269 @@
+"""
+Single-pass AST detector engine for static inefficiency checks
+"""
+
+import ast
+
+from .parsed_source import ParsedSource
+
+LOOP_NODES = (ast.For, ast.AsyncFor, ast.While)
+SCOPE_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+
+
+class VisitContext:
+    """Where a node sits in the tree, as seen by the detectors."""
+
+    __slots__ = ("parent", "previous", "loop_depth")
+
+    def __init__(self, parent, previous, loop_depth):
+        self.parent = parent
+        # Previous statement in the same block, for patterns spanning sibling statements
+        self.previous = previous
+        # Number of enclosing loops within the current function or class
+        self.loop_depth = loop_depth
+
+
+class Detector:
+    """
+    Base class for a static check.
+
+    Subclasses list the AST node types they care about in ``node_types`` and
+    implement ``visit``, returning a finding dict (see ``finding``) or None.
+    """
+
+    issue_type = ""
+    message = ""
+    severity = "low"
+    node_types = ()
+
+    def visit(self, node, context, source):
+        raise NotImplementedError
+
+    def finding(self, source, node, start_node=None):
+        """
+        Build a finding spanning ``start_node`` (defaults to ``node``) to the end of ``node``.
+
+        Lines and columns are 1-based, columns count characters.
+        """
+        start_node = start_node or node
+        line = start_node.lineno
+        end_line = node.end_lineno
+        return {
+            "type": self.issue_type,
+            "message": self.message,
+            "line": line,
+            "column": source.offset_of(line, start_node.col_offset) - source.line_offsets[line - 1] + 1,
+            "end_line": end_line,
+            "end_column": source.offset_of(end_line, node.end_col_offset) - source.line_offsets[end_line - 1] + 1,
+            "severity": self.severity,
+        }
+
+
+class NestedLoopDetector(Detector):
+    """Loops nested inside other loops of the same function."""
+
+    issue_type = "nested_loops"
+    message = "Nested loops can be inefficient and energy-intensive"
+    severity = "medium"
+    node_types = LOOP_NODES
+
+    def visit(self, node, context, source):
+        if context.loop_depth > 0:
+            return self.finding(source, node)
+        return None
+
+
+class StringConcatenationDetector(Detector):
+    """``s += "..."`` and ``s = t + "..."`` string building."""
+
+    issue_type = "string_concatenation"
+    message = "Using + operator for string concatenation is less efficient than join() or f-strings"
+    severity = "low"
+    node_types = (ast.AugAssign, ast.Assign)
+
+    def visit(self, node, context, source):
+        if isinstance(node, ast.AugAssign):
+            if isinstance(node.op, ast.Add) and _is_string_literal(node.value):
+                return self.finding(source, node)
+        elif (isinstance(node.value, ast.BinOp) and isinstance(node.value.op, ast.Add)
+                and isinstance(node.value.left, ast.Name) and _is_string_literal(node.value.right)):
+            return self.finding(source, node)
+        return None
+
+
+class ListComprehensionDetector(Detector):
+    """``result = []`` followed by a loop that only appends to ``result``."""
+
+    issue_type = "list_comprehension_opportunity"
+    message = "This for-loop could be replaced with a more efficient list comprehension"
+    severity = "medium"
+    node_types = (ast.For,)
+
+    def visit(self, node, context, source):
+        target = _empty_list_target(context.previous)
+        if target is None or node.orelse:
+            return None
+        statement = _single_statement(node.body)
+        if isinstance(statement, ast.If) and not statement.orelse:
+            statement = _single_statement(statement.body)
+        if _is_append_to(statement, target):
+            return self.finding(source, node, start_node=context.previous)
+        return None
+
+
+class ManualSumDetector(Detector):
+    """``total = 0`` followed by a loop that only does ``total += item``."""
+
+    issue_type = "inefficient_builtin"
+    message = "Manual summation can be replaced with built-in sum() function"
+    severity = "medium"
+    node_types = (ast.For,)
+
+    def visit(self, node, context, source):
+        target = _zero_target(context.previous)
+        if target is None or node.orelse:
+            return None
+        statement = _single_statement(node.body)
+        if (isinstance(statement, ast.AugAssign) and isinstance(statement.op, ast.Add)
+                and isinstance(statement.target, ast.Name) and statement.target.id == target
+                and not _references(statement.value, target)):
+            return self.finding(source, node, start_node=context.previous)
+        return None
+
+
+class DetectorEngine:
+    """Walks the AST once and dispatches every node to the detectors registered for its type."""
+
+    def __init__(self, detectors=None):
+        """
+        Initialize the engine.
+
+        Args:
+            detectors (list, optional): Detector instances to register
+        """
+        self.detectors = []
+        self._dispatch = {}
+        for detector in detectors or []:
+            self.register(detector)
+
+    def register(self, detector):
+        """Register a detector for the node types it declares."""
+        self.detectors.append(detector)
+        for node_type in detector.node_types:
+            self._dispatch.setdefault(node_type, []).append(detector)
+        return detector
+
+    def run(self, code):
+        """
+        Run every registered detector in a single traversal.
+
+        Args:
+            code (str or ParsedSource): Code to check
+
+        Returns:
+            list: Findings ordered by position
+        """
+        source = ParsedSource.ensure(code)
+        if not source.is_valid:
+            return []
+
+        dispatch = self._dispatch
+        findings = []
+        # Iterative walk so deeply nested code cannot hit the recursion limit
+        stack = [(source.tree, VisitContext(None, None, 0))]
+        while stack:
+            node, context = stack.pop()
+            handlers = dispatch.get(type(node))
+            if handlers:
+                for detector in handlers:
+                    finding = detector.visit(node, context, source)
+                    if finding:
+                        findings.append(finding)
+
+            children = []
+            for field, value in ast.iter_fields(node):
+                depth = _child_loop_depth(node, field, context.loop_depth)
+                if isinstance(value, list):
+                    previous = None
+                    for item in value:
+                        if isinstance(item, ast.AST):
+                            children.append((item, VisitContext(node, previous, depth)))
+                            if isinstance(item, ast.stmt):
+                                previous = item
+                elif isinstance(value, ast.AST):
+                    children.append((value, VisitContext(node, None, depth)))
+            stack.extend(reversed(children))
+
+        findings.sort(key=lambda f: (f["line"], f["column"]))
+        return findings
+
+
+def default_detectors():
+    """Return fresh instances of the built-in detectors."""
+    return [
+        NestedLoopDetector(),
+        StringConcatenationDetector(),
+        ListComprehensionDetector(),
+        ManualSumDetector(),
+    ]
+
+
+def _child_loop_depth(node, field, depth):
+    """Loop depth for children in ``field``; only a loop's body is inside the loop."""
+    if isinstance(node, SCOPE_NODES):
+        return 0
+    if isinstance(node, LOOP_NODES) and field == "body":
+        return depth + 1
+    return depth
+
+
+def _is_string_literal(node):
+    return isinstance(node, ast.JoinedStr) or (isinstance(node, ast.Constant) and isinstance(node.value, str))
+
+
+def _single_statement(body):
+    return body[0] if len(body) == 1 else None
+
+
+def _single_name_target(node):
+    if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+        return node.targets[0].id
+    return None
+
+
+def _empty_list_target(node):
+    target = _single_name_target(node)
+    if target is None:
+        return None
+    value = node.value
+    if isinstance(value, ast.List) and not value.elts:
+        return target
+    if (isinstance(value, ast.Call) and isinstance(value.func, ast.Name) and value.func.id == "list"
+            and not value.args and not value.keywords):
+        return target
+    return None
+
+
+def _zero_target(node):
+    target = _single_name_target(node)
+    if target is not None and isinstance(node.value, ast.Constant) and node.value.value == 0 \
+            and not isinstance(node.value.value, bool):
+        return target
+    return None
+
+
+def _references(node, name):
+    return any(isinstance(child, ast.Name) and child.id == name for child in ast.walk(node))
+
+
+def _is_append_to(statement, target):
+    if not isinstance(statement, ast.Expr) or not isinstance(statement.value, ast.Call):
+        return False
+    call = statement.value
+    return (isinstance(call.func, ast.Attribute) and call.func.attr == "append"
+            and isinstance(call.func.value, ast.Name) and call.func.value.id == target
+            and len(call.args) == 1 and not call.keywords)
+
+
+# Shared engine with the built-in detectors
+default_engine = DetectorEngine(default_detectors())
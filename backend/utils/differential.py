@@ -0,0 +1,322 @@
+"""
+Differential runner: executes the original code and optimized candidates side by side
+on identical inputs, checks that they agree and measures time, energy and memory
+"""
+
+import ast
+import math
+import os
+import statistics
+
+from .energy_meter import cpu_seconds_to_joules, energy_meter
+from .input_generator import MATERIALIZE_SOURCE, build_call, dataset_cache
+from .parsed_source import ParsedSource
+from .sandbox import sandbox_pool
+
+DIFF_ROUNDS = int(os.getenv("DIFF_ROUNDS", "3"))
+DIFF_MIN_TIME = float(os.getenv("DIFF_MIN_TIME", "0.05"))
+DIFF_INPUT_SIZE = int(os.getenv("DIFF_INPUT_SIZE", "1000"))
+# A candidate more than this much slower than the original is flagged
+SLOWER_TOLERANCE = float(os.getenv("DIFF_SLOWER_TOLERANCE", "0.05"))
+
+# Builtins available to the code under test: no imports, file or eval access
+SAFE_BUILTINS = (
+    "abs", "all", "any", "bool", "bytes", "callable", "chr", "dict", "divmod", "enumerate", "filter",
+    "float", "format", "frozenset", "hash", "int", "isinstance", "issubclass", "iter", "len", "list",
+    "map", "max", "min", "next", "object", "ord", "pow", "print", "range", "repr", "reversed", "round",
+    "set", "slice", "sorted", "str", "sum", "tuple", "zip", "super", "property", "staticmethod",
+    "classmethod", "__build_class__", "Exception", "ValueError", "TypeError", "KeyError", "IndexError",
+    "ZeroDivisionError", "AttributeError", "RuntimeError", "StopIteration", "ArithmeticError",
+    "NotImplementedError",
+)
+
+# Runs inside a sandbox worker with full builtins; the code under test gets SAFE_BUILTINS only
+HARNESS = MATERIALIZE_SOURCE + r'''
+import builtins as _builtins
+import io as _io
+import json as _json
+import resource as _resource
+import sys as _sys
+import time as _time
+import tracemalloc as _tracemalloc
+
+
+def _sort_key(value):
+    return _json.dumps(value, sort_keys=True)
+
+
+def _plain(value, depth=0):
+    """
+    Turn a return value into JSON data that can be compared across runs.
+
+    Containers are tagged with their type and unordered ones are sorted, so values
+    that compare equal in Python encode the same way.
+    """
+    if depth > 50:
+        return ["repr", str.__str__(repr(value))]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return str.__str__(value)
+    if isinstance(value, complex):
+        return ["complex", [value.real, value.imag]]
+    if isinstance(value, bytes):
+        return ["bytes", bytes.hex(value)]
+    if isinstance(value, list):
+        return ["list", [_plain(item, depth + 1) for item in value]]
+    if isinstance(value, tuple):
+        return ["tuple", [_plain(item, depth + 1) for item in value]]
+    if isinstance(value, (set, frozenset)):
+        return ["set", sorted((_plain(item, depth + 1) for item in value), key=_sort_key)]
+    if isinstance(value, dict):
+        items = [[_plain(key, depth + 1), _plain(item, depth + 1)] for key, item in value.items()]
+        return ["dict", sorted(items, key=lambda item: _sort_key(item[0]))]
+    if hasattr(value, "__next__"):
+        return ["iterator", [_plain(item, depth + 1) for item in value]]
+    return ["repr", str.__str__(repr(value))]
+
+
+_namespace = {
+    "__builtins__": {name: getattr(_builtins, name) for name in __safe_builtins__ if hasattr(_builtins, name)},
+    "__name__": "__candidate__",
+}
+exec(compile(__code__, "<candidate>", "exec"), _namespace)
+
+_report = {}
+for _name, _args in __calls__:
+    _func = _namespace.get(_name)
+    if not callable(_func):
+        _report[_name] = {"error": "missing"}
+        continue
+    # What the call prints and does to its arguments is part of its behavior too
+    _call_args = [_materialize(arg) for arg in _args]
+    _printed = _io.StringIO()
+    _stdout, _sys.stdout = _sys.stdout, _printed
+    try:
+        _output = _plain(_func(*_call_args))
+    except Exception as _e:
+        _report[_name] = {"error": type(_e).__name__}
+        continue
+    finally:
+        _sys.stdout = _stdout
+    _arguments = _plain(_call_args)
+
+    # Fixed repeat counts keep energy readings comparable between implementations
+    _repeats = __repeats__.get(_name)
+    _elapsed = 0.0
+    _cpu = 0.0
+    _count = 0
+    while (_count < _repeats) if _repeats else (_elapsed < __min_time__ and _count < 100000):
+        _call_args = [_materialize(arg) for arg in _args]
+        _usage = _resource.getrusage(_resource.RUSAGE_SELF)
+        _start = _time.perf_counter()
+        _func(*_call_args)
+        _elapsed += _time.perf_counter() - _start
+        _end = _resource.getrusage(_resource.RUSAGE_SELF)
+        _cpu += _end.ru_utime + _end.ru_stime - _usage.ru_utime - _usage.ru_stime
+        _count += 1
+
+    _call_args = [_materialize(arg) for arg in _args]
+    _tracemalloc.start()
+    _func(*_call_args)
+    _peak = _tracemalloc.get_traced_memory()[1]
+    _tracemalloc.stop()
+
+    _report[_name] = {
+        "output": _output, "arguments": _arguments, "stdout": _printed.getvalue(),
+        "time": _elapsed, "cpu_time": _cpu, "repeats": _count, "memory": _peak,
+    }
+
+__result__ = _report
+'''
+
+
+def default_calls(source, size=DIFF_INPUT_SIZE):
+    """
+    Build the calls to compare: every top-level function with inputs generated from its signature.
+
+    Args:
+        source (ParsedSource): Original code
+        size (int): Input size for the generated arguments
+
+    Returns:
+        tuple: ``(calls, datasets)``; calls are (function name, argument list) pairs as
+        built by ``build_call``, datasets the files they refer to
+    """
+    calls, datasets = [], {}
+    for node in source.tree.body if source.is_valid else []:
+        if isinstance(node, ast.FunctionDef):
+            args, files = build_call(node, size, dataset_cache)
+            calls.append((node.name, args))
+            datasets.update(files)
+    return calls, datasets
+
+
+def compare_implementations(original, candidates, calls=None, datasets=None, rounds=DIFF_ROUNDS):
+    """
+    Run the original and each candidate on identical inputs and compare them.
+
+    The original runs first to calibrate how many times each function is called, then
+    all implementations run interleaved for ``rounds`` rounds with those repeat counts.
+    Medians are reported.
+
+    Args:
+        original (str or ParsedSource): Original code
+        candidates (dict): Candidate name to code
+        calls (list, optional): (function name, arguments) pairs, each argument either
+            ``("value", v)`` or ``("dataset", name)``; built from the original's signatures
+            when omitted
+        datasets (dict, optional): Dataset files referred to by ``calls``
+        rounds (int): Measurement rounds
+
+    Returns:
+        dict: Per-candidate equivalence, ratios and verdicts, or an ``error``
+    """
+    source = ParsedSource.ensure(original)
+    if not source.is_valid:
+        return {"error": "Original code has syntax errors"}
+    if calls is None:
+        calls, datasets = default_calls(source)
+    if not calls:
+        return {"error": "No top-level functions to compare"}
+
+    calibration = _run(source.code, calls, {}, datasets)
+    if "error" in calibration:
+        return {"error": f"Original code failed: {calibration['error']}"}
+    errors = {name: report["error"] for name, report in calibration["report"].items() if "error" in report}
+    repeats = {name: report["repeats"] for name, report in calibration["report"].items() if "repeats" in report}
+    if not repeats:
+        return {"error": "Every function failed on the generated inputs", "function_errors": errors}
+
+    # Identical candidates are only measured once
+    implementations = {"original": source.code}
+    for name, code in candidates.items():
+        if code and code.strip() and code not in implementations.values():
+            implementations[name] = code
+    aliases = {
+        name: next(key for key, value in implementations.items() if value == code)
+        for name, code in candidates.items() if code and code.strip()
+    }
+
+    measurements = {name: [] for name in implementations}
+    for _ in range(rounds):
+        for name, code in implementations.items():
+            measurements[name].append(_run(code, calls, repeats, datasets))
+
+    baseline = _summarize(measurements["original"])
+    results = {}
+    for name in candidates:
+        if name not in aliases:
+            results[name] = {"verdict": "error", "error": "No code"}
+            continue
+        target = aliases[name]
+        if target == "original":
+            results[name] = {"verdict": "unchanged", "equivalent": True}
+            continue
+        results[name] = _compare(baseline, _summarize(measurements[target]))
+
+    return {
+        "functions": [name for name, _ in calls],
+        "function_errors": errors,
+        "rounds": rounds,
+        "meter": energy_meter.describe() if energy_meter else None,
+        "original": {
+            key: baseline[key] for key in ("time", "energy_joules", "energy_upper_bound_joules", "memory_bytes")
+        },
+        "candidates": results,
+    }
+
+
+def _run(code, calls, repeats, datasets):
+    """
+    Run the harness once for one implementation.
+
+    Energy comes from the CPU time the worker spent in the timed calls. The meter's
+    machine-wide reading also covers the harness, the pipes and concurrent work, so
+    it is kept as an upper bound.
+    """
+    execution = sandbox_pool.run(HARNESS, inputs={
+        "__code__": code,
+        "__calls__": calls,
+        "__repeats__": repeats,
+        "__min_time__": DIFF_MIN_TIME,
+        "__safe_builtins__": SAFE_BUILTINS,
+    }, datasets=datasets, meter=energy_meter)
+    if execution["status"] != "ok":
+        return {"error": execution["error"]}
+    if not isinstance(execution["result"], dict):
+        return {"error": "Harness returned no results"}
+    cpu_time = sum(item.get("cpu_time", 0.0) for item in execution["result"].values())
+    return {"report": execution["result"], "energy": cpu_seconds_to_joules(cpu_time),
+            "energy_upper_bound": execution["energy_joules"]}
+
+
+def _summarize(runs):
+    """Median time, energy and memory over the successful runs of one implementation."""
+    successful = [run for run in runs if "error" not in run]
+    if not successful:
+        return {"error": runs[0]["error"] if runs else "Not run"}
+    report = successful[0]["report"]
+    energies = [run["energy"] for run in successful]
+    upper_bounds = [run["energy_upper_bound"] for run in successful if run["energy_upper_bound"] is not None]
+    return {
+        "outputs": {
+            name: {key: item[key] for key in ("output", "arguments", "stdout")} if "output" in item
+            else ("<error>", item.get("error"))
+            for name, item in report.items()
+        },
+        "time": statistics.median(
+            sum(item.get("time", 0.0) for item in run["report"].values()) for run in successful
+        ),
+        "energy_joules": statistics.median(energies),
+        "energy_upper_bound_joules": statistics.median(upper_bounds) if upper_bounds else None,
+        "memory_bytes": max(item.get("memory", 0) for item in report.values()),
+    }
+
+
+def _compare(baseline, candidate):
+    """Check equivalence and compute ratios of a candidate against the original."""
+    if "error" in candidate:
+        return {"verdict": "error", "equivalent": False, "error": candidate["error"]}
+
+    mismatches = [
+        name for name, output in baseline["outputs"].items()
+        if not _equivalent(output, candidate["outputs"].get(name))
+    ]
+    result = {
+        "equivalent": not mismatches,
+        "mismatches": mismatches,
+        "time": candidate["time"],
+        "energy_joules": candidate["energy_joules"],
+        "energy_upper_bound_joules": candidate["energy_upper_bound_joules"],
+        "memory_bytes": candidate["memory_bytes"],
+        "time_ratio": _ratio(candidate["time"], baseline["time"]),
+        "energy_ratio": _ratio(candidate["energy_joules"], baseline["energy_joules"]),
+        "memory_ratio": _ratio(candidate["memory_bytes"], baseline["memory_bytes"]),
+    }
+    if mismatches:
+        result["verdict"] = "not_equivalent"
+    elif result["time_ratio"] is not None and result["time_ratio"] > 1 + SLOWER_TOLERANCE:
+        result["verdict"] = "slower"
+    else:
+        result["verdict"] = "verified"
+    return result
+
+
+def _ratio(value, reference):
+    if value is None or not reference:
+        return None
+    return round(value / reference, 3)
+
+
+def _equivalent(a, b):
+    """Compare plain outputs, allowing for floating point rounding differences."""
+    if isinstance(a, float) and isinstance(b, (int, float)) or isinstance(b, float) and isinstance(a, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12) or (a != a and b != b)
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(_equivalent(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_equivalent(a[key], b[key]) for key in a)
+    return a == b
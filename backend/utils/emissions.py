@@ -1,49 +1,60 @@
-import time
-import ast
 import re
 
-# For CodeCarbon integration
-from codecarbon import EmissionsTracker
+from .differential import compare_implementations
+from .energy_meter import WATTS_PER_CORE, cpu_seconds_to_joules, energy_meter, joules_to_co2_grams
+from .parsed_source import ParsedSource
+from .sandbox import sandbox_pool
+
+# Builtins available to the measured code
+SANDBOX_BUILTINS = ("print", "range")
 
 def estimate_emissions(code):
     """
     Estimates the energy consumption and CO2 emissions of the given code.
-    Uses heuristics if CodeCarbon isn't available.
+    Accepts raw code or a ParsedSource shared with the other stages.
+    Energy is derived from the CPU time the sandboxed run itself used; the energy
+    meter's machine-wide reading is reported as an upper bound.
+    Uses heuristics if the code can't be run.
     """
     try:
+        source = ParsedSource.ensure(code)
+        code = source.code
+
         # Check if code is valid Python
-        try:
-            ast.parse(code)
-        except SyntaxError:
+        if not source.is_valid:
             return {
                 "energy_saved": "0.0",
                 "co2_saved": "0.0", 
                 "explanation": "Could not estimate emissions due to syntax errors."
             }
             
-        # Real measurement with CodeCarbon
+        # Real measurement of the code's own CPU time, taken inside the worker
         try:
-            # Setup safe execution environment
-            tracker_original = EmissionsTracker()
-            tracker_original.start()
-            
-            # Execute the original code in a controlled environment
-            # This is a simplified approach and would need proper sandboxing for production
-            start_time = time.time()
-            exec(code, {"__builtins__": {"print": print, "range": range}})
-            execution_time_original = time.time() - start_time
-            emissions_original = tracker_original.stop()
-            
-            # Estimate optimized emissions (simplified approximation)
-            # In a real app, you would execute the optimized code and measure actual emissions
-            emissions_optimized = emissions_original * 0.7  # Assume 30% reduction
-            
-            energy_saved = emissions_original - emissions_optimized
-            
+            # Execute the original code in a sandboxed worker process with
+            # CPU, memory and wall-clock limits
+            execution = sandbox_pool.run(code, allowed_builtins=SANDBOX_BUILTINS, meter=energy_meter)
+            if execution["status"] != "ok":
+                raise RuntimeError(execution["error"])
+            energy_original = cpu_seconds_to_joules(execution["cpu_time"])
+
+            # The machine-wide meter also counts other requests and the model, so it
+            # only bounds the energy from above
+            explanation = f"Measured from the CPU time of the run at {WATTS_PER_CORE} W per core."
+            if execution["energy_joules"] is not None:
+                explanation += f" The {energy_meter.name} meter reading of the whole machine is an upper bound."
+
+            # Savings need the optimized code; they come from measure_savings
             return {
-                "energy_saved": str(round(energy_saved, 2)),
-                "co2_saved": str(round(energy_saved * 0.5, 2)),  # Simple conversion factor
-                "explanation": "Measured using CodeCarbon emissions tracking."
+                "energy_saved": "0.0",
+                "co2_saved": "0.0",
+                "explanation": explanation,
+                "measurement": dict(
+                    energy_meter.describe() if energy_meter else {},
+                    energy_joules=energy_original,
+                    energy_upper_bound_joules=execution["energy_joules"],
+                    wall_time=execution["wall_time"],
+                    cpu_time=execution["cpu_time"]
+                )
             }
         
         except Exception as measurement_error:
@@ -51,7 +62,7 @@ def estimate_emissions(code):
             # Fall back to heuristic estimation
         
         # Use heuristic estimation for now
-        return heuristic_emission_estimation(code)
+        return heuristic_emission_estimation(source)
         
     except Exception as e:
         # If any error occurs, return zeros
@@ -61,11 +72,58 @@ def estimate_emissions(code):
             "explanation": f"Could not estimate emissions due to an error: {str(e)}"
         }
 
-def heuristic_emission_estimation(code):
+def measure_savings(code, candidates):
+    """
+    Run the original code and the optimized candidates side by side on the same inputs.
+
+    Args:
+        code (str or ParsedSource): Original code
+        candidates (dict): Candidate name ("optimized", "fast", "green") to code
+
+    Returns:
+        dict: Comparison from ``compare_implementations``
+    """
+    try:
+        return compare_implementations(ParsedSource.ensure(code), candidates)
+    except Exception as e:
+        print(f"Error verifying optimized code: {e}")
+        return {"error": str(e)}
+
+def verified_savings(verification, candidate):
+    """
+    Turn the measured comparison of one candidate into energy and CO2 savings.
+
+    Args:
+        verification (dict): Result of ``measure_savings``
+        candidate (str): Name of the candidate that is shown to the user
+
+    Returns:
+        dict or None: ``energy_saved``, ``co2_saved`` and ``explanation``, or None if the
+        candidate was not verified as equivalent or its energy couldn't be measured
+    """
+    result = (verification or {}).get("candidates", {}).get(candidate)
+    if not result or result["verdict"] not in ("verified", "slower") or result["energy_joules"] is None:
+        return None
+    energy_original = verification["original"]["energy_joules"]
+    if energy_original is None:
+        return None
+    energy_saved = energy_original - result["energy_joules"]
+    return {
+        "energy_saved": str(round(energy_saved, 2)),
+        "co2_saved": str(round(joules_to_co2_grams(energy_saved), 2)),
+        "explanation": (
+            f"Measured by running the original and optimized code on the same inputs "
+            f"({result['time_ratio']}x time, {result['energy_ratio']}x energy)."
+        )
+    }
+
+def heuristic_emission_estimation(source):
     """
     Use heuristics to estimate energy consumption and CO2 savings.
     This is a simplified approach for demonstration purposes.
     """
+    code = source.code if isinstance(source, ParsedSource) else source
+
     # Initialize base energy values
     base_energy = 1.0  # base energy in joules
     energy_factor = 1.0
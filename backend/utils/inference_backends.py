@@ -0,0 +1,230 @@
+"""
+Inference backends: turn a model id into a text-generation pipeline
+
+Every stage gets its model through ``get_pipeline``, which asks the backend selected
+with ``INFERENCE_BACKEND`` to build it. All backends return an object that behaves like
+a transformers text-generation pipeline: it is called with a prompt (or a list of
+prompts) and generation arguments, and has ``tokenizer`` and ``model`` attributes.
+"""
+
+import os
+import time
+
+from .quantization import MODEL_QUANTIZATION, quantize_model
+
+# transformers (default), onnx or stub
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "transformers").lower()
+# Exported ONNX graphs are kept here, one directory per model
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", "./models/onnx")
+# Optional delay per generated token, so the stub can stand in for a real model in load tests
+STUB_TOKEN_DELAY_MS = float(os.getenv("STUB_TOKEN_DELAY_MS", "0"))
+
+
+class InferenceBackend:
+    """Base class: builds pipelines for one inference engine."""
+
+    name = None
+    # Whether the inference worker may feed cached preamble keys and values to ``model.generate``
+    supports_prefix_cache = True
+    # Whether the model can be run step by step for prompt-lookup decoding
+    supports_prompt_lookup = True
+
+    def load(self, model, task="text-generation", **kwargs):
+        """
+        Build a pipeline for a model.
+
+        Args:
+            model (str): Hugging Face model id or local model path
+            task (str): Pipeline task
+            **kwargs: Engine-specific loading arguments
+
+        Returns:
+            A pipeline-like callable with ``tokenizer`` and ``model`` attributes
+        """
+        raise NotImplementedError
+
+    def registry_key(self, model):
+        """Key of a model in the model registry; the default backend keeps the plain model id."""
+        return model if self.name == "transformers" else f"{self.name}:{model}"
+
+
+class TransformersBackend(InferenceBackend):
+    """PyTorch models through ``transformers.pipeline``, optionally quantized to int8."""
+
+    name = "transformers"
+
+    def load(self, model, task="text-generation", **kwargs):
+        from transformers import pipeline
+
+        loaded = pipeline(task, model=model, **kwargs)
+        if MODEL_QUANTIZATION != "none":
+            print(f"Quantizing {model} to {MODEL_QUANTIZATION}...")
+            loaded.model = quantize_model(loaded.model, MODEL_QUANTIZATION)
+        return loaded
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    ONNX Runtime on CPU, through ``optimum.onnxruntime``.
+
+    A model is exported to ONNX the first time it is loaded and the graphs are saved
+    under ``ONNX_EXPORT_DIR``; later loads read the exported graphs directly.
+    """
+
+    name = "onnx"
+    # The exported decoder takes its past keys and values in its own layout
+    supports_prefix_cache = False
+    supports_prompt_lookup = False
+
+    def __init__(self, export_dir=ONNX_EXPORT_DIR):
+        self.export_dir = export_dir
+
+    def load(self, model, task="text-generation", **kwargs):
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError:
+            raise RuntimeError("The onnx backend needs optimum with ONNX Runtime: pip install optimum[onnxruntime]")
+        from transformers import AutoTokenizer, pipeline
+
+        export_path = self.export_path(model)
+        if os.path.exists(os.path.join(export_path, "config.json")):
+            print(f"Using exported ONNX graphs from {export_path}")
+            ort_model = ORTModelForCausalLM.from_pretrained(export_path, provider="CPUExecutionProvider")
+            tokenizer = AutoTokenizer.from_pretrained(export_path)
+        else:
+            print(f"Exporting {model} to ONNX (first load only)...")
+            ort_model = ORTModelForCausalLM.from_pretrained(
+                model, export=True, provider="CPUExecutionProvider", **kwargs
+            )
+            tokenizer = AutoTokenizer.from_pretrained(model, **kwargs)
+            ort_model.save_pretrained(export_path)
+            tokenizer.save_pretrained(export_path)
+
+        loaded = pipeline(task, model=ort_model, tokenizer=tokenizer)
+        loaded.supports_prefix_cache = self.supports_prefix_cache
+        loaded.supports_prompt_lookup = self.supports_prompt_lookup
+        return loaded
+
+    def export_path(self, model):
+        """Directory holding the exported graphs of a model."""
+        return os.path.join(self.export_dir, model.strip("./").replace("/", "--"))
+
+
+class StubBackend(InferenceBackend):
+    """Deterministic local stand-in that needs no weights, for tests and load tests."""
+
+    name = "stub"
+    supports_prefix_cache = False
+    supports_prompt_lookup = False
+
+    def load(self, model, task="text-generation", **kwargs):
+        return StubPipeline(model)
+
+
+class StubTokenizer:
+    """One token per character."""
+
+    pad_token = "\0"
+    eos_token = "\0"
+    pad_token_id = 0
+    eos_token_id = 0
+    padding_side = "left"
+    model_max_length = 8192
+
+    def __call__(self, text, add_special_tokens=True, **kwargs):
+        if isinstance(text, str):
+            return {"input_ids": self.encode(text)}
+        return {"input_ids": [self.encode(item) for item in text]}
+
+    def encode(self, text, **kwargs):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens, skip_special_tokens=False, **kwargs):
+        if hasattr(tokens, "tolist"):
+            tokens = tokens.tolist()
+        return "".join(chr(token) for token in tokens if token or not skip_special_tokens)
+
+
+class StubModel:
+    """Carries the model name, like ``pipeline.model`` does."""
+
+    def __init__(self, name_or_path):
+        self.name_or_path = name_or_path
+
+
+class StubPipeline:
+    """
+    Answers every prompt with the code it contains.
+
+    The completion is the last non-empty fenced code block of the prompt (for
+    prompts that end by opening a fence), or else the prompt without its comment
+    lines, so downstream parsing and verification see the original code as an
+    unchanged optimization.
+    """
+
+    supports_prefix_cache = False
+    supports_prompt_lookup = False
+
+    def __init__(self, model):
+        self.tokenizer = StubTokenizer()
+        self.model = StubModel(f"stub:{model}")
+
+    def __call__(self, prompts, max_new_tokens=None, max_length=None, num_return_sequences=1,
+                 streamer=None, batch_size=None, **kwargs):
+        single = isinstance(prompts, str)
+        outputs = []
+        for prompt in [prompts] if single else prompts:
+            completion = self.complete(prompt)
+            if max_new_tokens is not None:
+                completion = completion[:max_new_tokens]
+            elif max_length is not None:
+                completion = completion[:max(0, max_length - len(prompt))]
+            if streamer is not None:
+                self._stream(streamer, prompt, completion)
+            elif STUB_TOKEN_DELAY_MS:
+                time.sleep(len(completion) * STUB_TOKEN_DELAY_MS / 1000.0)
+            outputs.append([{"generated_text": prompt + completion} for _ in range(num_return_sequences)])
+        return outputs[0] if single else outputs
+
+    @staticmethod
+    def complete(prompt):
+        """Deterministic completion for a prompt."""
+        blocks = [block.split("```")[0].strip("\n") for block in prompt.split("```python")[1:]]
+        blocks = [block for block in blocks if block.strip()]
+        if blocks:
+            return blocks[-1] + "\n```\n"
+        lines = [line for line in prompt.splitlines() if not line.lstrip().startswith(("#", "```"))]
+        return "\n" + "\n".join(lines).strip("\n") + "\n"
+
+    def _stream(self, streamer, prompt, completion):
+        import numpy as np
+
+        streamer.put(np.array([self.tokenizer.encode(prompt)]))
+        for token in self.tokenizer.encode(completion):
+            if STUB_TOKEN_DELAY_MS:
+                time.sleep(STUB_TOKEN_DELAY_MS / 1000.0)
+            streamer.put(np.array([token]))
+        streamer.end()
+
+
+BACKENDS = {
+    "transformers": TransformersBackend,
+    "onnx": OnnxBackend,
+    "stub": StubBackend,
+}
+
+
+def get_backend(name=None):
+    """
+    Get an inference backend by name.
+
+    Args:
+        name (str, optional): ``transformers``, ``onnx`` or ``stub``; ``INFERENCE_BACKEND`` when omitted
+
+    Returns:
+        InferenceBackend: The backend
+    """
+    name = (name or INFERENCE_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
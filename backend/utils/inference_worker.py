@@ -0,0 +1,328 @@
+"""
+Dynamic request batching for text-generation pipelines
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from .generation_controller import GenerationController
+from .metrics import GenerationTimer, record_generation_stop
+from .prefix_cache import PrefixCache
+from .prompt_lookup import prompt_lookup_generate
+from .quantization import model_memory_bytes, model_quantization
+
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "25"))
+
+
+class InferenceWorker:
+    """
+    Owns a text-generation pipeline and runs all generation on a single thread.
+
+    Callers use the worker like the pipeline itself (``worker(prompt, **kwargs)``).
+    Prompts arriving within ``max_wait_ms`` of each other with the same generation
+    arguments are run as one padded batch, and each caller gets back its own output.
+    Prompts submitted with a ``prefix`` reuse the cached keys and values of that
+    preamble instead of prefilling it again. With ``stop_on_code_end`` or
+    ``deadline_seconds``, a ``GenerationController`` ends generation once the code is
+    complete or the deadline has passed, and each output reports how it stopped.
+    """
+
+    def __init__(self, pipeline, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        """
+        Initialize the worker.
+
+        Args:
+            pipeline: transformers text-generation pipeline
+            max_batch_size (int): Most prompts run in one batch
+            max_wait_ms (float): How long the first prompt of a batch waits for others
+        """
+        self.pipeline = pipeline
+        self.tokenizer = pipeline.tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._pending = []
+        self._lock = threading.Lock()
+        self.prefix_cache = PrefixCache(pipeline.model, self.tokenizer)
+        # Backends whose models can't take cached keys and values prefill every prompt in full,
+        # and decode one token at a time
+        self.supports_prefix_cache = getattr(pipeline, "supports_prefix_cache", True)
+        self.supports_prompt_lookup = getattr(pipeline, "supports_prompt_lookup", True)
+        # Weight footprint, reported with the throughput in /health
+        self.memory_bytes = model_memory_bytes(pipeline.model)
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "generated_tokens": 0,
+            "generate_seconds": 0.0,
+            "queue_wait_seconds": 0.0,
+            "batch_sizes": {},
+            "prompt_lookup": {"requests": 0, "steps": 0, "generated_tokens": 0, "draft_tokens": 0,
+                              "accepted_draft_tokens": 0},
+            "stop_reasons": {},
+            "saved_tokens": 0,
+        }
+
+        # Decoder-only models must be left-padded for batched generation
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self._thread = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+        self._thread.start()
+
+    def __call__(self, prompt, **generate_kwargs):
+        """Generate from ``prompt``, returning the same output as calling the pipeline directly."""
+        return self.submit(prompt, **generate_kwargs).result()
+
+    def submit(self, prompt, prefix=None, **generate_kwargs):
+        """
+        Queue a prompt.
+
+        Args:
+            prompt (str): Prompt to complete
+            prefix (str, optional): Fixed preamble ``prompt`` starts with, whose key/value cache is reused
+            **generate_kwargs: Generation arguments for the pipeline
+
+        Returns:
+            Future: Resolves to the pipeline output for this prompt
+        """
+        future = Future()
+        self._queue.put({
+            "prompt": prompt,
+            "prefix": prefix,
+            "kwargs": generate_kwargs,
+            # Requests with a streamer have their own output channel and always run alone
+            "batch_key": None if "streamer" in generate_kwargs else repr((prefix, sorted(generate_kwargs.items()))),
+            "future": future,
+            "enqueued_at": time.time(),
+        })
+        return future
+
+    def stats(self):
+        """Return throughput and batch-size statistics."""
+        with self._lock:
+            stats = dict(self._stats, batch_sizes=dict(self._stats["batch_sizes"]),
+                         prompt_lookup=dict(self._stats["prompt_lookup"]),
+                         stop_reasons=dict(self._stats["stop_reasons"]))
+        lookup = stats["prompt_lookup"]
+        lookup["tokens_per_step"] = round(lookup["generated_tokens"] / lookup["steps"], 2) if lookup["steps"] else 0.0
+        stats["tokens_per_second"] = (
+            round(stats["generated_tokens"] / stats["generate_seconds"], 2) if stats["generate_seconds"] else 0.0
+        )
+        stats["average_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize() + len(self._pending)
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000
+        stats["prefix_cache"] = self.prefix_cache.stats()
+        return stats
+
+    def _next_request(self, timeout=None):
+        if self._pending:
+            return self._pending.pop(0)
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _collect_batch(self):
+        """Block for one request, then gather compatible ones until the batch is full or the window closes."""
+        first = self._next_request()
+        batch = [first]
+        if first["batch_key"] is None:
+            return batch
+
+        deadline = time.time() + self.max_wait
+        deferred = []
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next_request(timeout=remaining)
+            except queue.Empty:
+                break
+            if request["batch_key"] == first["batch_key"]:
+                batch.append(request)
+            else:
+                deferred.append(request)
+        # Incompatible requests keep their place at the front of the line
+        self._pending = deferred + self._pending
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [r for r in self._collect_batch() if r["future"].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self._generate_batch(batch)
+            except Exception as e:
+                print(f"Error in batched generation: {e}")
+                for request in batch:
+                    request["future"].set_exception(e)
+                continue
+            for request, output in zip(batch, outputs):
+                request["future"].set_result(output)
+
+    def _generate_batch(self, batch):
+        start_time = time.time()
+        prompts = [request["prompt"] for request in batch]
+        # The timer rides along as a logits processor to separate prefill from decode
+        timer = GenerationTimer()
+        kwargs = dict(batch[0]["kwargs"])
+        kwargs["logits_processor"] = list(kwargs.get("logits_processor") or []) + [timer]
+        control = {
+            "stop_on_code_end": kwargs.pop("stop_on_code_end", False),
+            "deadline_seconds": kwargs.pop("deadline_seconds", None),
+        }
+        controller = None
+        if control["stop_on_code_end"] or control["deadline_seconds"]:
+            controller = self._controller(batch, prompts, kwargs, control)
+            kwargs["stopping_criteria"] = list(kwargs.get("stopping_criteria") or []) + [controller]
+        # Prompt lookup drafts from the whole prompt, so it doesn't use the preamble cache
+        single_sequence = kwargs.get("num_return_sequences", 1) == 1
+        prompt_lookup = kwargs.pop("prompt_lookup", False) and self.supports_prompt_lookup and single_sequence
+        inputs = None
+        if batch[0]["prefix"] and single_sequence and self.supports_prefix_cache and not prompt_lookup:
+            inputs = self.prefix_cache.prepare(prompts, batch[0]["prefix"])
+        if prompt_lookup:
+            outputs = self._generate_with_prompt_lookup(batch, prompts, kwargs, control if controller else None)
+        elif inputs is not None:
+            outputs = self._generate_from_inputs(prompts, inputs, kwargs)
+        elif len(batch) == 1:
+            outputs = [self.pipeline(prompts[0], **kwargs)]
+        else:
+            outputs = self.pipeline(prompts, batch_size=len(batch), **kwargs)
+        elapsed = time.time() - start_time
+
+        generated_tokens = 0
+        for row, (prompt, output) in enumerate(zip(prompts, outputs)):
+            for sequence in output:
+                text = sequence.get("generated_text", "")
+                if text.startswith(prompt):
+                    text = text[len(prompt):]
+                generated_tokens += len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+                if controller is not None and "generation" not in sequence:
+                    text, sequence["generation"] = controller.finish(row, text)
+                    sequence["generated_text"] = prompt + text
+                if "generation" in sequence:
+                    self._record_stop(sequence["generation"])
+        timer.observe(generated_tokens)
+
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["generated_tokens"] += generated_tokens
+            self._stats["generate_seconds"] += elapsed
+            self._stats["queue_wait_seconds"] += sum(start_time - r["enqueued_at"] for r in batch)
+            self._stats["batch_sizes"][len(batch)] = self._stats["batch_sizes"].get(len(batch), 0) + 1
+        return outputs
+
+    def _generate_with_prompt_lookup(self, batch, prompts, kwargs, control=None):
+        """Generate each prompt with prompt-lookup drafts and shape the result like pipeline output."""
+        model = self.pipeline.model
+        outputs = []
+        for request, prompt in zip(batch, prompts):
+            input_ids = self.tokenizer(prompt, return_tensors="pt")["input_ids"].to(model.device)
+            max_new_tokens = kwargs.get("max_new_tokens") or max(1, kwargs.get("max_length", 20) - input_ids.shape[1])
+            # Each prompt is generated on its own, so it gets its own controller
+            controller = None
+            if control is not None:
+                controller = self._controller([request], [prompt], kwargs, control, prompt_length=input_ids.shape[1])
+            # The caller's criteria, e.g. a stream's stop signal, without the batch's controller
+            stopping_criteria = [
+                criterion for criterion in kwargs.get("stopping_criteria") or []
+                if not isinstance(criterion, GenerationController)
+            ] + ([controller] if controller is not None else [])
+            sequence, stats = prompt_lookup_generate(
+                model, input_ids, max_new_tokens,
+                eos_token_id=self.tokenizer.eos_token_id,
+                do_sample=kwargs.get("do_sample", False),
+                temperature=kwargs.get("temperature", 1.0),
+                logits_processor=kwargs.get("logits_processor"),
+                stopping_criteria=stopping_criteria or None,
+                streamer=kwargs.get("streamer"),
+            )
+            with self._lock:
+                totals = self._stats["prompt_lookup"]
+                totals["requests"] += 1
+                for key, value in stats.items():
+                    totals[key] += value
+            text = self.tokenizer.decode(sequence[0, input_ids.shape[1]:], skip_special_tokens=True)
+            output = {"generated_text": prompt + text}
+            if controller is not None:
+                text, output["generation"] = controller.finish(0, text)
+                output["generated_text"] = prompt + text
+            outputs.append([output])
+        return outputs
+
+    def _controller(self, batch, prompts, kwargs, control, prompt_length=None):
+        """Build the generation controller of a batch; its deadline is the earliest request's."""
+        deadline = None
+        if control["deadline_seconds"]:
+            deadline = min(request["enqueued_at"] for request in batch) + control["deadline_seconds"]
+        return GenerationController(
+            self.tokenizer, prompts,
+            max_new_tokens=kwargs.get("max_new_tokens"),
+            stop_on_code_end=control["stop_on_code_end"],
+            deadline=deadline,
+            prompt_length=prompt_length,
+        )
+
+    def _record_stop(self, report):
+        record_generation_stop(report["stop_reason"], report["saved_tokens"])
+        with self._lock:
+            reasons = self._stats["stop_reasons"]
+            reasons[report["stop_reason"]] = reasons.get(report["stop_reason"], 0) + 1
+            self._stats["saved_tokens"] += report["saved_tokens"]
+
+    def _generate_from_inputs(self, prompts, inputs, kwargs):
+        """Call ``generate`` on prepared inputs and shape the result like pipeline output."""
+        import torch
+
+        with torch.no_grad():
+            sequences = self.pipeline.model.generate(**inputs, pad_token_id=self.tokenizer.pad_token_id, **kwargs)
+        input_length = inputs["input_ids"].shape[1]
+        return [
+            [{"generated_text": prompt + self.tokenizer.decode(row[input_length:], skip_special_tokens=True)}]
+            for prompt, row in zip(prompts, sequences)
+        ]
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_inference_worker(pipeline):
+    """
+    Get the batching worker for a pipeline, starting it the first time.
+
+    Args:
+        pipeline: Shared pipeline, e.g. from ``get_pipeline``
+
+    Returns:
+        InferenceWorker: The worker owning ``pipeline``
+    """
+    with _workers_lock:
+        worker = _workers.get(id(pipeline))
+        if worker is None or worker.pipeline is not pipeline:
+            worker = InferenceWorker(pipeline)
+            _workers[id(pipeline)] = worker
+        return worker
+
+
+def inference_stats():
+    """Return statistics for every running worker."""
+    with _workers_lock:
+        workers = list(_workers.values())
+    return [
+        dict(
+            worker.stats(),
+            model=getattr(worker.pipeline.model, "name_or_path", None),
+            quantization=model_quantization(worker.pipeline.model),
+            memory_bytes=worker.memory_bytes,
+        )
+        for worker in workers
+    ]
@@ -0,0 +1,453 @@
+"""
+Synthetic inputs for measuring arbitrary functions: argument types are inferred from
+signatures, type hints, defaults and usage, and generated datasets are cached as files
+"""
+
+import ast
+import hashlib
+import math
+import os
+import pickle
+import random
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+
+# /dev/shm keeps dataset files in memory where it exists
+DATASET_DIR = os.getenv(
+    "DATASET_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "greencode-ai-datasets")
+)
+DATASET_CACHE_SIZE = int(os.getenv("DATASET_CACHE_SIZE", "64"))
+# Value given to integer arguments that are not sizes (thresholds, targets, ...)
+CONSTANT_INT = 10
+
+SIZE_NAMES = ("n", "k", "m", "num", "number", "count", "size", "limit", "depth", "steps", "length", "times")
+STRING_NAMES = ("s", "text", "string", "message", "msg", "word", "sentence", "line", "name", "prefix",
+                "suffix", "pattern", "content")
+STRING_LIST_NAMES = ("words", "names", "lines", "strings", "sentences", "tokens", "messages")
+MATRIX_NAMES = ("matrix", "grid", "board", "table")
+LIST_NAMES = ("data", "items", "values", "nums", "numbers", "arr", "array", "lst", "elements", "seq", "sequence")
+STRING_METHODS = ("split", "lower", "upper", "strip", "lstrip", "rstrip", "replace", "startswith", "endswith",
+                  "find", "isdigit", "isalpha", "encode", "title", "capitalize")
+LIST_METHODS = ("append", "extend", "insert", "pop", "sort", "reverse", "remove")
+DICT_METHODS = ("items", "keys", "values", "get", "setdefault")
+SEQUENCE_FUNCTIONS = ("len", "sorted", "sum", "min", "max", "enumerate", "reversed", "set", "list", "tuple",
+                      "any", "all", "zip", "map", "filter")
+
+ANNOTATION_TYPES = {
+    "int": ("int",), "float": ("float",), "str": ("str",), "bool": ("bool",),
+    "list": ("list", "int"), "List": ("list", "int"), "Sequence": ("list", "int"), "Iterable": ("list", "int"),
+    "tuple": ("tuple", "int"), "Tuple": ("tuple", "int"),
+    "set": ("set", "int"), "Set": ("set", "int"), "frozenset": ("set", "int"),
+    "dict": ("dict", "int"), "Dict": ("dict", "int"), "Mapping": ("dict", "int"),
+}
+ITEM_TYPES = {"int": "int", "float": "float", "str": "str", "bool": "int"}
+
+
+def argument_specs(node):
+    """
+    Infer a type spec for each argument that has to be generated for a function.
+
+    Type hints win, then the type of the default value, then how the argument is used
+    in the body, then its name. Arguments with a scalar or None default keep their default.
+
+    Args:
+        node (ast.FunctionDef): Function definition
+
+    Returns:
+        list: ``(name, spec)`` pairs in call order. A spec is a tuple such as
+        ``("list", "int")``, ``("list", "str")``, ``("matrix", "int")``, ``("dict", "int")``,
+        ``("str",)``, ``("float",)`` or ``("int", "size")`` / ``("int", "constant")``
+    """
+    arguments = node.args.posonlyargs + node.args.args
+    defaults = [None] * (len(arguments) - len(node.args.defaults)) + list(node.args.defaults)
+    usage = _collect_usage(node)
+    specs = []
+    for arg, default in zip(arguments, defaults):
+        if arg.arg in ("self", "cls"):
+            continue
+        if default is not None and not isinstance(default, (ast.List, ast.Dict, ast.Set, ast.Tuple)) and not (
+            isinstance(default, ast.Constant) and isinstance(default.value, str)
+        ):
+            # Scalars and None: the function's own default is the realistic value
+            break
+        spec = _spec_from_annotation(arg.annotation) or _spec_from_default(default)
+        if spec is None:
+            spec = _spec_from_usage(arg.arg, usage)
+            # Arithmetic alone doesn't make "data" a number
+            if spec is None or spec[0] in ("int", "float") and arg.arg.lower() in LIST_NAMES:
+                spec = _spec_from_name(arg.arg)
+        if spec[0] == "int" and len(spec) == 1:
+            spec = ("int", "size" if _is_size(arg.arg, usage) else "constant")
+        specs.append((arg.arg, spec))
+    return specs
+
+
+def generate_value(spec, size, seed=0):
+    """
+    Build a value of the given spec.
+
+    Args:
+        spec (tuple): Spec from ``argument_specs``
+        size (int): Length of collections and strings, or the value of size arguments
+        seed (int): Random seed, so the same spec and size always give the same data
+
+    Returns:
+        object: The generated value
+    """
+    rng = random.Random(f"{spec}:{size}:{seed}")
+    kind = spec[0]
+    item = spec[1] if len(spec) > 1 else "int"
+    if kind == "int":
+        return size if item == "size" else CONSTANT_INT
+    if kind == "float":
+        return 0.5
+    if kind == "bool":
+        return True
+    if kind == "str":
+        return _random_text(rng, size)
+    if kind == "matrix":
+        side = max(1, int(math.isqrt(size)))
+        return [[_random_item(rng, item, size) for _ in range(side)] for _ in range(side)]
+    if kind == "dict":
+        return {f"key{i}": _random_item(rng, item, size) for i in range(size)}
+    values = [_random_item(rng, item, size) for _ in range(size)]
+    if kind == "set":
+        return set(values)
+    if kind == "tuple":
+        return tuple(values)
+    return values
+
+
+def encode_value(value):
+    """
+    Pack a value into its most compact file format.
+
+    Returns:
+        tuple: ``(format, bytes)``; formats are read back by the sandbox workers
+    """
+    if isinstance(value, list) and value and all(type(item) is int for item in value):
+        if all(-2 ** 63 <= item < 2 ** 63 for item in value):
+            return "q", array("q", value).tobytes()
+    if isinstance(value, list) and value and all(type(item) is float for item in value):
+        return "d", array("d", value).tobytes()
+    if isinstance(value, str):
+        return "str", value.encode("utf-8")
+    if isinstance(value, list) and value and all(type(item) is str and "\n" not in item for item in value):
+        return "lines", "\n".join(value).encode("utf-8")
+    return "pickle", pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class DatasetCache:
+    """
+    Generated datasets stored once as files and handed to sandbox workers by path.
+
+    Files are content-addressed by spec, size and seed, so every process generating
+    the same dataset shares one file. Each process keeps an LRU of the files it uses
+    and deletes the least recently used ones beyond ``max_entries``.
+    """
+
+    def __init__(self, directory=DATASET_DIR, max_entries=DATASET_CACHE_SIZE):
+        """
+        Initialize the cache.
+
+        Args:
+            directory (str): Directory for the dataset files
+            max_entries (int): Files kept by this process
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bytes_written": 0}
+
+    def dataset(self, spec, size, seed=0):
+        """
+        Return the file holding a generated value, generating it on first use.
+
+        Args:
+            spec (tuple): Spec from ``argument_specs``
+            size (int): Input size
+            seed (int): Random seed
+
+        Returns:
+            tuple: ``(path, format)`` as accepted by ``SandboxPool.run(datasets=...)``
+        """
+        key = hashlib.sha256(repr((spec, size, seed)).encode("utf-8")).hexdigest()[:32]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and os.path.exists(entry[0]):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+
+        fmt, payload = encode_value(generate_value(spec, size, seed))
+        path = os.path.join(self.directory, f"{key}.{fmt}")
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename so workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["bytes_written"] += len(payload)
+            self._entries[key] = (path, fmt)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_path, _ = self._entries.popitem(last=False)[1]
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            return path, fmt
+
+    def stats(self):
+        """Return hit, miss and size counters."""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+def build_call(node, size, cache, seed=0):
+    """
+    Build the arguments for calling a function at an input size.
+
+    Args:
+        node (ast.FunctionDef): Function definition
+        size (int): Input size
+        cache (DatasetCache): Where collection and string inputs are stored
+        seed (int): Random seed
+
+    Returns:
+        tuple: ``(args, datasets)``. ``args`` holds ``("value", v)`` for scalars and
+        ``("dataset", global_name)`` for cached data; ``datasets`` maps those global
+        names to dataset files for the sandbox.
+    """
+    args, datasets = [], {}
+    for position, (name, spec) in enumerate(argument_specs(node)):
+        if spec[0] in ("int", "float", "bool"):
+            args.append(("value", generate_value(spec, size, seed)))
+            continue
+        global_name = f"__data_{node.name}_{name}__"
+        # Different data for each argument of the same type
+        datasets[global_name] = cache.dataset(spec, size, seed + position)
+        args.append(("dataset", global_name))
+    return args, datasets
+
+
+def has_size_argument(node):
+    """Whether one of the function's generated arguments is a size rather than data."""
+    return any(spec == ("int", "size") for _, spec in argument_specs(node))
+
+
+# Prepended to sandbox harnesses: turns call arguments back into fresh Python values
+MATERIALIZE_SOURCE = r'''
+import copy as _copy
+from array import array as _array
+
+
+def _materialize(arg):
+    """Fresh value for one call argument, so mutations don't leak into the next call."""
+    kind, value = arg
+    if kind == "dataset":
+        value = globals()[value]
+    if isinstance(value, _array):
+        return value.tolist()
+    if isinstance(value, (list, dict, set)):
+        return _copy.deepcopy(value)
+    return value
+'''
+
+
+def _spec_from_annotation(annotation):
+    if annotation is None:
+        return None
+    if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+        try:
+            annotation = ast.parse(annotation.value, mode="eval").body
+        except SyntaxError:
+            return None
+    if isinstance(annotation, ast.Name):
+        return ANNOTATION_TYPES.get(annotation.id)
+    if isinstance(annotation, ast.Attribute):
+        return ANNOTATION_TYPES.get(annotation.attr)
+    if isinstance(annotation, ast.Subscript):
+        outer = _spec_from_annotation(annotation.value)
+        inner = annotation.slice
+        if isinstance(annotation.value, ast.Name) and annotation.value.id == "Optional":
+            return _spec_from_annotation(inner)
+        if outer is None or len(outer) < 2:
+            return outer
+        if isinstance(inner, ast.Tuple) and inner.elts:
+            # Dict[key, value] and Tuple[item, ...]: the value / first item decides
+            inner = inner.elts[-1] if outer[0] == "dict" else inner.elts[0]
+        inner_spec = _spec_from_annotation(inner)
+        if inner_spec is None:
+            return outer
+        if inner_spec[0] == "list" and outer[0] == "list":
+            return ("matrix", inner_spec[1])
+        return (outer[0], ITEM_TYPES.get(inner_spec[0], "int"))
+    return None
+
+
+def _spec_from_default(default):
+    if default is None:
+        return None
+    if isinstance(default, ast.Constant) and isinstance(default.value, str):
+        return ("str",)
+    kind = {ast.List: "list", ast.Dict: "dict", ast.Set: "set", ast.Tuple: "tuple"}[type(default)]
+    items = default.values if isinstance(default, ast.Dict) else default.elts
+    item = "int"
+    if items and isinstance(items[0], ast.Constant):
+        item = ITEM_TYPES.get(type(items[0].value).__name__, "int")
+    return (kind, item)
+
+
+def _collect_usage(node):
+    """Record how each name is used in the function body."""
+    usage = {}
+
+    def mark(name, flag):
+        usage.setdefault(name, set()).add(flag)
+
+    # Loop variables, so the element type of an iterated argument can be inferred
+    loop_items = {}
+    for child in ast.walk(node):
+        if isinstance(child, (ast.For, ast.comprehension)) and isinstance(child.iter, ast.Name):
+            mark(child.iter.id, "sequence")
+            if isinstance(child.target, ast.Name):
+                loop_items[child.target.id] = child.iter.id
+        elif isinstance(child, ast.Call):
+            func = child.func
+            if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+                name = func.value.id
+                if func.attr in STRING_METHODS:
+                    mark(name, "str")
+                elif func.attr in DICT_METHODS:
+                    mark(name, "dict")
+                elif func.attr in LIST_METHODS:
+                    mark(name, "sequence")
+                elif func.attr == "add":
+                    mark(name, "set")
+            elif isinstance(func, ast.Name):
+                for arg in child.args:
+                    if isinstance(arg, ast.Name):
+                        if func.id == "range":
+                            mark(arg.id, "size")
+                        elif func.id in SEQUENCE_FUNCTIONS:
+                            mark(arg.id, "sequence")
+                        elif func.id == "float":
+                            mark(arg.id, "number")
+        elif isinstance(child, ast.Subscript) and isinstance(child.value, ast.Name):
+            mark(child.value.id, "sequence")
+            if isinstance(child.slice, ast.Constant) and isinstance(child.slice.value, str):
+                mark(child.value.id, "dict")
+        elif isinstance(child, ast.Subscript) and isinstance(child.value, ast.Subscript):
+            if isinstance(child.value.value, ast.Name):
+                mark(child.value.value.id, "nested")
+        elif isinstance(child, (ast.BinOp, ast.Compare, ast.AugAssign)):
+            operands = (
+                [child.left, child.right] if isinstance(child, ast.BinOp)
+                else [child.left] + child.comparators if isinstance(child, ast.Compare)
+                else [child.target, child.value]
+            )
+            names = [operand.id for operand in operands if isinstance(operand, ast.Name)]
+            constants = [operand.value for operand in operands if isinstance(operand, ast.Constant)]
+            membership = isinstance(child, ast.Compare) and any(isinstance(op, (ast.In, ast.NotIn)) for op in child.ops)
+            # Combined with an element or an arithmetic result, a name is a number too
+            arithmetic = not membership and (
+                any(isinstance(operand, (ast.Subscript, ast.BinOp)) for operand in operands)
+                # Only + also works on sequences; usage as a sequence elsewhere still wins
+                or isinstance(child, ast.BinOp) and not isinstance(child.op, ast.Add)
+            )
+            for name in names:
+                if any(isinstance(value, str) for value in constants):
+                    mark(name, "str")
+                elif any(isinstance(value, float) for value in constants):
+                    mark(name, "float")
+                elif arithmetic or any(isinstance(value, int) and not isinstance(value, bool) for value in constants):
+                    mark(name, "number")
+            if membership:
+                if isinstance(child.left, ast.Name):
+                    mark(child.left.id, "number")
+                for comparator in child.comparators:
+                    if isinstance(comparator, ast.Name):
+                        mark(comparator.id, "sequence")
+
+    # Carry what is known about loop variables over to the iterated argument
+    for item, container in loop_items.items():
+        flags = usage.get(item, set())
+        if "str" in flags:
+            mark(container, "items_str")
+        elif "float" in flags:
+            mark(container, "items_float")
+        elif "sequence" in flags:
+            mark(container, "nested")
+    return usage
+
+
+def _spec_from_usage(name, usage):
+    flags = usage.get(name, set())
+    if not flags:
+        return None
+    if "dict" in flags:
+        return ("dict", "int")
+    if "set" in flags:
+        return ("set", "int")
+    if "str" in flags and "items_str" not in flags:
+        return ("str",)
+    if "nested" in flags:
+        return ("matrix", "int")
+    if "sequence" in flags or "items_str" in flags or "items_float" in flags:
+        item = "str" if "items_str" in flags else "float" if "items_float" in flags else "int"
+        return ("list", item)
+    if "float" in flags:
+        return ("float",)
+    if "size" in flags or "number" in flags:
+        return ("int",)
+    return None
+
+
+def _spec_from_name(name):
+    lowered = name.lower()
+    if lowered in SIZE_NAMES:
+        return ("int",)
+    if lowered in STRING_NAMES:
+        return ("str",)
+    if lowered in STRING_LIST_NAMES:
+        return ("list", "str")
+    if lowered in MATRIX_NAMES:
+        return ("matrix", "int")
+    return ("list", "int")
+
+
+def _is_size(name, usage):
+    """Whether an integer argument scales the work (``range(n)``, a size-like name)."""
+    return "size" in usage.get(name, set()) or name.lower() in SIZE_NAMES
+
+
+def _random_item(rng, item, size):
+    if item == "str":
+        return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8)))
+    if item == "float":
+        return rng.uniform(-size, size)
+    # Mixed signs and repeats, like typical data
+    return rng.randint(-size, size)
+
+
+def _random_text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = _random_item(rng, "str", size)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+# Shared by all requests in this process
+dataset_cache = DatasetCache()
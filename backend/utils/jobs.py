@@ -0,0 +1,165 @@
+"""
+Background job manager for slow analysis requests
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "32"))
+MAX_RETAINED_JOBS = int(os.getenv("MAX_RETAINED_JOBS", "200"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "900"))
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when too many jobs are already waiting to run."""
+
+
+class JobManager:
+    """Runs analysis jobs on a bounded executor and keeps their progress and results."""
+
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=MAX_PENDING_JOBS,
+                 max_retained=MAX_RETAINED_JOBS, retention_seconds=JOB_RETENTION_SECONDS):
+        """
+        Initialize the job manager.
+
+        Args:
+            max_workers (int): Jobs running at the same time
+            max_pending (int): Jobs allowed to be queued or running before new ones are rejected
+            max_retained (int): Finished jobs kept for polling
+            retention_seconds (float): How long a finished job is kept
+        """
+        self.max_pending = max_pending
+        self.max_retained = max_retained
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, total_stages=None, **kwargs):
+        """
+        Queue a job.
+
+        ``func`` is called with the given arguments plus an ``on_stage(name, result)``
+        callback that it should invoke as each stage finishes, so pollers see
+        partial results before the whole job is done.
+
+        Args:
+            func (callable): Function doing the work and returning the final result
+            total_stages (int, optional): Number of stages, used to report progress
+
+        Returns:
+            dict: Snapshot of the new job
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": {"completed_stages": [], "total_stages": total_stages},
+            "partial_results": {},
+            "result": None,
+            "error": None,
+        }
+
+        with self._lock:
+            self._prune()
+            active = sum(1 for j in self._jobs.values() if j["status"] in ("queued", "running"))
+            if active >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({active})")
+            self._jobs[job_id] = job
+
+        def on_stage(name, result):
+            with self._lock:
+                job["progress"]["completed_stages"].append(name)
+                job["partial_results"][name] = result
+
+        def run():
+            with self._lock:
+                job["status"] = "running"
+                job["started_at"] = time.time()
+            try:
+                result = func(*args, on_stage=on_stage, **kwargs)
+                update = {"result": result, "status": "completed"}
+            except Exception as e:
+                update = {"error": str(e), "status": "failed"}
+            # Status and finish time change together, so pollers never see a finished job without one
+            with self._lock:
+                job.update(update, finished_at=time.time())
+
+        self._executor.submit(run)
+        return self.get(job_id)
+
+    def complete(self, result):
+        """Record a job that is already finished, e.g. served from the result cache."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "completed",
+                "created_at": now,
+                "started_at": now,
+                "finished_at": now,
+                "progress": {"completed_stages": [], "total_stages": 0},
+                "partial_results": {},
+                "result": result,
+                "error": None,
+            }
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """
+        Return a snapshot of a job.
+
+        Args:
+            job_id (str): Job id returned by ``submit``
+
+        Returns:
+            dict or None: Job status, progress and (partial) results, or None if unknown or expired
+        """
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job)
+            snapshot["progress"] = dict(job["progress"], completed_stages=list(job["progress"]["completed_stages"]))
+            snapshot["partial_results"] = dict(job["partial_results"])
+        if snapshot["status"] == "completed":
+            # The full result supersedes the partial ones
+            snapshot["partial_results"] = {}
+        return snapshot
+
+    def stats(self):
+        """Return job counts by status."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+    def _prune(self):
+        """Drop finished jobs past their retention time or beyond the retention limit."""
+        now = time.time()
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None
+        ]
+        expired = [job_id for job_id in finished if now - self._jobs[job_id]["finished_at"] > self.retention_seconds]
+        overflow = max(0, len(finished) - len(expired) - self.max_retained)
+        for job_id in expired:
+            del self._jobs[job_id]
+        for job_id in [j for j in finished if j in self._jobs][:overflow]:
+            del self._jobs[job_id]
+
+
+# Shared job manager for the whole process
+job_manager = JobManager()
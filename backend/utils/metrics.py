@@ -0,0 +1,145 @@
+"""
+Prometheus metrics: request counters, per-stage latency histograms, model and cache state
+"""
+
+import os
+import time
+
+from flask import Response, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+# When set (e.g. by gunicorn.conf.py), every process writes its values to files in this
+# directory and /metrics aggregates them, so pre-forked workers report correct totals
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Stages range from sub-millisecond parsing to minute-long generation on CPU
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUESTS = Counter("greencode_requests_total", "HTTP requests handled", ["endpoint", "method", "status"])
+IN_FLIGHT = Gauge(
+    "greencode_requests_in_flight", "HTTP requests being handled", ["endpoint"], multiprocess_mode="livesum"
+)
+REQUEST_LATENCY = Histogram(
+    "greencode_request_duration_seconds", "Time to produce an HTTP response", ["endpoint"], buckets=STAGE_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "greencode_stage_duration_seconds",
+    "Duration of each analysis stage (parse, static_analysis, algorithm_analysis, energy, variants, "
+    "optimization, verification, llm_prefill, llm_decode, ...)",
+    ["stage"], buckets=STAGE_BUCKETS
+)
+MODEL_LOADED = Gauge("greencode_model_loaded", "1 while a model is loaded", ["model"], multiprocess_mode="livemax")
+MODEL_LOAD_SECONDS = Histogram("greencode_model_load_seconds", "Time to load a model", ["model"], buckets=STAGE_BUCKETS)
+MODEL_MEMORY = Gauge(
+    "greencode_model_memory_bytes", "Bytes held by a model's weights", ["model", "quantization"], multiprocess_mode="livemax"
+)
+CACHE_LOOKUPS = Counter("greencode_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+GENERATED_TOKENS = Counter("greencode_generated_tokens_total", "Tokens generated by the model")
+GENERATION_STOPS = Counter(
+    "greencode_generation_stops_total", "Generated sequences by how they stopped (code_end, eos, budget, deadline)",
+    ["reason"]
+)
+SAVED_TOKENS = Counter("greencode_generation_saved_tokens_total", "Budgeted tokens not generated because the code was complete")
+
+
+def observe_stage(stage, seconds):
+    """Record the duration of one stage."""
+    STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
+
+def record_cache_lookup(cache, hit):
+    """Count a hit or miss of a cache (``result``, ``semantic``, ``model``, ``prefix``)."""
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_model_loaded(model, seconds=None, loaded=True):
+    """Mark a model as loaded (with its load time) or unloaded."""
+    MODEL_LOADED.labels(model=model).set(1 if loaded else 0)
+    if seconds is not None:
+        MODEL_LOAD_SECONDS.labels(model=model).observe(seconds)
+
+
+def record_model_memory(model, memory_bytes, quantization="none"):
+    """Record the weight footprint of a loaded model."""
+    if memory_bytes is not None:
+        MODEL_MEMORY.labels(model=model, quantization=quantization).set(memory_bytes)
+
+
+def record_generation_stop(reason, saved_tokens=0):
+    """Count how a generated sequence stopped and the budgeted tokens it did not need."""
+    GENERATION_STOPS.labels(reason=reason).inc()
+    SAVED_TOKENS.inc(saved_tokens)
+
+
+class GenerationTimer:
+    """
+    Splits a ``generate`` call into prefill and decode time.
+
+    Passed to ``generate`` as a logits processor: it is first called once the prompt
+    has been processed and the first token's logits are ready, then once per token.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        return scores
+
+    def observe(self, generated_tokens=0):
+        """Record prefill, decode and token counts once generation has finished."""
+        end = time.perf_counter()
+        if self.first_token is not None:
+            observe_stage("llm_prefill", self.first_token - self.start)
+            observe_stage("llm_decode", end - self.first_token)
+        GENERATED_TOKENS.inc(generated_tokens)
+
+
+def install_metrics(app):
+    """
+    Count and time every request of a Flask app and serve ``/metrics``.
+
+    Args:
+        app (Flask): Application to instrument
+    """
+
+    def endpoint():
+        # The route pattern keeps label values bounded
+        return request.url_rule.rule if request.url_rule else "unmatched"
+
+    @app.before_request
+    def start_request():
+        request.metrics_start = time.perf_counter()
+        IN_FLIGHT.labels(endpoint=endpoint()).inc()
+
+    # Unhandled exceptions also reach after_request, with the 500 response Flask
+    # builds for them, so requests are only counted here
+    @app.after_request
+    def count_request(response):
+        REQUESTS.labels(endpoint=endpoint(), method=request.method, status=response.status_code).inc()
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        start = getattr(request, "metrics_start", None)
+        if start is None:
+            return
+        IN_FLIGHT.labels(endpoint=endpoint()).dec()
+        REQUEST_LATENCY.labels(endpoint=endpoint()).observe(time.perf_counter() - start)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(metrics_text(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def metrics_text():
+    """Render all metrics, aggregated over worker processes in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
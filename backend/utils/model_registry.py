@@ -0,0 +1,300 @@
+"""
+Process-wide registry of loaded models so each one is only constructed once
+"""
+
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from .metrics import record_cache_lookup, record_model_loaded, record_model_memory
+from .inference_backends import get_backend
+from .quantization import model_memory_bytes, model_quantization
+
+# Load environment variables including Hugging Face token
+load_dotenv()
+
+# Seconds to wait before retrying a model that failed to load
+FAILURE_RETRY_SECONDS = float(os.getenv("MODEL_LOAD_RETRY_SECONDS", "60"))
+
+
+class ModelLoadError(RuntimeError):
+    """Raised when a model failed to load recently and is not retried yet."""
+
+
+class BackgroundLoad:
+    """Progress of one model being loaded on a background thread."""
+
+    def __init__(self, key):
+        self.key = key
+        self.state = "loading"
+        self.phase = "loading"
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.thread = None
+
+    def status(self):
+        """Return the state, current phase and elapsed seconds of the load."""
+        end = self.finished_at or time.time()
+        status = {
+            "state": self.state,
+            "phase": self.phase,
+            "elapsed_seconds": round(end - self.started_at, 2),
+        }
+        if self.error:
+            status["error"] = self.error
+        return status
+
+
+class ModelRegistry:
+    """Thread-safe cache of loaded models keyed by model id or local path."""
+
+    def __init__(self, retry_seconds=FAILURE_RETRY_SECONDS):
+        """
+        Initialize the registry.
+
+        Args:
+            retry_seconds (float): How long a failed load is remembered before retrying
+        """
+        self.retry_seconds = retry_seconds
+        self._models = {}
+        self._failures = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._background = {}
+
+    def get(self, key, loader):
+        """
+        Return the model registered under ``key``, loading it with ``loader`` on first use.
+
+        Concurrent callers asking for the same key wait for a single load instead
+        of each constructing their own copy.
+
+        Args:
+            key (str): Model id or local path identifying the model
+            loader (callable): Zero-argument function that builds the model
+
+        Returns:
+            object: The shared model instance
+        """
+        model = self._models.get(key)
+        if model is not None:
+            self._record(key, "hits")
+            record_cache_lookup("model", hit=True)
+            return model
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have finished loading while we waited
+            model = self._models.get(key)
+            if model is not None:
+                self._record(key, "hits")
+                return model
+
+            failure = self._failures.get(key)
+            if failure and time.time() - failure["time"] < self.retry_seconds:
+                raise ModelLoadError(f"Model {key} failed to load recently: {failure['error']}")
+
+            self._record(key, "misses")
+            record_cache_lookup("model", hit=False)
+            start_time = time.time()
+            try:
+                model = loader()
+            except Exception as e:
+                self._failures[key] = {"time": time.time(), "error": str(e)}
+                self._record(key, "failures")
+                raise
+            load_time = round(time.time() - start_time, 2)
+
+            with self._lock:
+                self._models[key] = model
+                self._failures.pop(key, None)
+                stats = self._stats.setdefault(key, {})
+                stats["load_time"] = load_time
+                stats["loaded_at"] = time.time()
+            record_model_loaded(key, load_time)
+            return model
+
+    def is_loaded(self, key):
+        """Check whether a model is already in memory."""
+        return key in self._models
+
+    def get_nowait(self, key, loader, on_loaded=None):
+        """
+        Return the model if it is loaded, otherwise start loading it in the background.
+
+        Callers never block on a load: they get None and can fall back to a cheaper
+        path until the model is ready. A failed load is retried once ``retry_seconds``
+        have passed.
+
+        Args:
+            key (str): Model id or local path identifying the model
+            loader (callable): Zero-argument function that builds the model
+            on_loaded (callable, optional): Called with the model on the loading thread
+                before it is reported ready, e.g. to start its inference worker
+
+        Returns:
+            object: The shared model instance, or None while it is loading
+        """
+        background = self._background.get(key)
+        model = self._models.get(key)
+        if model is not None and (background is None or background.state == "ready"):
+            self._record(key, "hits")
+            record_cache_lookup("model", hit=True)
+            return model
+        self.preload(key, loader, on_loaded)
+        return None
+
+    def preload(self, key, loader, on_loaded=None):
+        """
+        Load a model on a daemon thread unless it is loaded or already loading.
+
+        Args:
+            key (str): Model id or local path identifying the model
+            loader (callable): Zero-argument function that builds the model
+            on_loaded (callable, optional): Called with the model once it is built
+
+        Returns:
+            BackgroundLoad: Progress of the load
+        """
+        with self._lock:
+            background = self._background.get(key)
+            if background is not None and (
+                background.state in ("loading", "ready")
+                or time.time() - background.finished_at < self.retry_seconds
+            ):
+                return background
+            background = self._background[key] = BackgroundLoad(key)
+
+        def load():
+            try:
+                model = self.get(key, loader)
+                if on_loaded is not None:
+                    background.phase = "warming_up"
+                    on_loaded(model)
+                background.finished_at = time.time()
+                background.state = background.phase = "ready"
+            except Exception as e:
+                print(f"Background load of {key} failed: {e}")
+                background.error = str(e)
+                background.finished_at = time.time()
+                background.state = background.phase = "failed"
+
+        background.thread = threading.Thread(target=load, name=f"load-{key}", daemon=True)
+        background.thread.start()
+        return background
+
+    def load_status(self, key):
+        """Return the progress of a model's background load, or an empty dict if it was never started."""
+        background = self._background.get(key)
+        return background.status() if background is not None else {}
+
+    def readiness(self):
+        """
+        Summarize the background loads for readiness probes.
+
+        Returns:
+            dict: ``ready`` once no model is still loading, ``degraded`` if a load
+            failed, and the progress of each model
+        """
+        with self._lock:
+            loads = {key: background.status() for key, background in self._background.items()}
+        states = [status["state"] for status in loads.values()]
+        return {
+            "ready": "loading" not in states,
+            "degraded": "failed" in states,
+            "models": loads,
+        }
+
+    def unload(self, key=None):
+        """
+        Drop one model (or all models) from the registry.
+
+        Args:
+            key (str, optional): Model to unload. Unloads everything when omitted.
+        """
+        with self._lock:
+            for unloaded in (list(self._models) if key is None else [key]):
+                if unloaded in self._models:
+                    record_model_loaded(unloaded, loaded=False)
+            if key is None:
+                self._models.clear()
+                self._failures.clear()
+                self._background = {k: b for k, b in self._background.items() if b.state == "loading"}
+            else:
+                self._models.pop(key, None)
+                self._failures.pop(key, None)
+                if key in self._background and self._background[key].state != "loading":
+                    del self._background[key]
+
+    def stats(self):
+        """Return load times and hit/miss counters for every model seen so far."""
+        with self._lock:
+            models = {}
+            for key, stats in self._stats.items():
+                models[key] = {
+                    "loaded": key in self._models,
+                    "hits": stats.get("hits", 0),
+                    "misses": stats.get("misses", 0),
+                    "failures": stats.get("failures", 0),
+                    "load_time": stats.get("load_time"),
+                }
+                if key in self._failures:
+                    models[key]["last_error"] = self._failures[key]["error"]
+            return {
+                "loaded_models": len(self._models),
+                "hits": sum(m["hits"] for m in models.values()),
+                "misses": sum(m["misses"] for m in models.values()),
+                "models": models,
+            }
+
+    def _record(self, key, counter):
+        with self._lock:
+            stats = self._stats.setdefault(key, {})
+            stats[counter] = stats.get(counter, 0) + 1
+
+
+# Shared registry for the whole process
+model_registry = ModelRegistry()
+
+
+def get_pipeline(model, task="text-generation", wait=True, on_loaded=None, backend=None, **kwargs):
+    """
+    Get a shared text-generation pipeline, loading it only the first time it is requested.
+
+    Args:
+        model (str): Hugging Face model id or local model path
+        task (str): Pipeline task
+        wait (bool): Block until the pipeline is loaded. Otherwise return None and
+            load it on a background thread if it is not ready yet.
+        on_loaded (callable, optional): Called with the pipeline on the loading
+            thread when ``wait`` is False
+        backend (str, optional): Inference backend (see ``utils.inference_backends``);
+            ``INFERENCE_BACKEND`` when omitted
+        **kwargs: Extra loading arguments passed to the backend on first load
+
+    Returns:
+        Pipeline: The shared pipeline instance, or None while it is loading
+    """
+    engine = get_backend(backend)
+
+    def load():
+        print(f"Loading model {model} with the {engine.name} backend...")
+        loaded = engine.load(model, task, **kwargs)
+        record_model_memory(model, model_memory_bytes(loaded.model), model_quantization(loaded.model))
+        return loaded
+
+    key = engine.registry_key(model)
+    if not wait:
+        return model_registry.get_nowait(key, load, on_loaded)
+    return model_registry.get(key, load)
+
+
+def pipeline_key(model, backend=None):
+    """Registry key of a model's pipeline, e.g. for ``model_registry.load_status``."""
+    return get_backend(backend).registry_key(model)
@@ -1,120 +1,97 @@
-import re
-import ast
 import os
 from dotenv import load_dotenv
 
 # For StarCoder integration
-from transformers import pipeline
+from .generation_controller import GENERATION_DEADLINE_SECONDS, token_budget
+from .inference_worker import get_inference_worker
+from .model_registry import get_pipeline
+from .parsed_source import ParsedSource
+from .rewrite_engine import default_engine
 
 # Load environment variables
 load_dotenv()
 
+# Model used by the rule-based optimizer when it is available
+OPTIMIZATION_MODEL = "bigcode/starcoderbase-1b"
+# Set to 0 to ask the model even when the rewrite rules already optimized the code
+RULES_FIRST = os.getenv("RULES_FIRST", "1") == "1"
+
+
+def get_optimization_model(wait=True):
+    """
+    Get the batching worker for the optimization model.
+
+    Args:
+        wait (bool): Block until the model is loaded. Otherwise return None while it
+            loads on a background thread.
+
+    Returns:
+        InferenceWorker: Worker owning the shared pipeline, or None while it is loading
+    """
+    hf_token = os.getenv("HUGGINGFACE_TOKEN")
+    pipeline = get_pipeline(
+        OPTIMIZATION_MODEL, wait=wait, on_loaded=get_inference_worker,
+        use_auth_token=hf_token if hf_token else True
+    )
+    return get_inference_worker(pipeline) if pipeline is not None else None
+
 def suggest_optimization(code):
     """
     Optimize the given Python code for energy efficiency.
     Uses patterns and rules if StarCoder isn't available.
+    Accepts raw code or a ParsedSource shared with the other stages.
     Returns optimized code and explanation.
     """
     try:
+        source = ParsedSource.ensure(code)
+        code = source.code
+
         # Check if code is valid Python
-        try:
-            ast.parse(code)
-        except SyntaxError:
+        if not source.is_valid:
             return {
                 "optimized_code": code,
                 "explanation": "Could not optimize due to syntax errors in the original code.",
                 "changes": []
             }
         
-        # Try to use StarCoder for optimization
+        # The rewrite rules cover the common patterns without a model call
+        optimized_code, changes = default_engine.run(source)
+        if changes and RULES_FIRST:
+            return _rule_based_result(optimized_code, changes)
+
+        # Try to use StarCoder for optimization. It loads on a background thread;
+        # until it is ready the rule-based result is used.
         try:
-            # Initialize the model with token
-            hf_token = os.getenv("HUGGINGFACE_TOKEN")
-            if hf_token:
-                model = pipeline("text-generation", model="bigcode/starcoderbase-1b", use_auth_token=hf_token)
-            else:
-                model = pipeline("text-generation", model="bigcode/starcoderbase-1b", use_auth_token=True)
+            model = get_optimization_model(wait=False)
+            if model is not None:
+                # Create a prompt for the model
+                prompt = f"# Original Python code:\n{code}\n\n# Optimized version for energy efficiency (with list comprehensions, avoiding nested loops, using built-in functions):\n"
             
-            # Create a prompt for the model
-            prompt = f"# Original Python code:\n{code}\n\n# Optimized version for energy efficiency (with list comprehensions, avoiding nested loops, using built-in functions):\n"
+                # Generate optimized code
+                response = model(
+                    prompt, max_new_tokens=token_budget(model.tokenizer, code), do_sample=True, temperature=0.2,
+                    stop_on_code_end=True, deadline_seconds=GENERATION_DEADLINE_SECONDS
+                )
+                generated_text = response[0]['generated_text']
             
-            # Generate optimized code
-            response = model(prompt, max_length=1024, do_sample=True, temperature=0.2)
-            generated_text = response[0]['generated_text']
+                # Extract just the optimized code
+                optimized_code = generated_text.split("# Optimized version")[1]
+                if "```python" in optimized_code:
+                    optimized_code = optimized_code.split("```python")[1].split("```")[0].strip()
+                else:
+                    optimized_code = optimized_code.strip()
             
-            # Extract just the optimized code
-            optimized_code = generated_text.split("# Optimized version")[1]
-            if "```python" in optimized_code:
-                optimized_code = optimized_code.split("```python")[1].split("```")[0].strip()
-            else:
-                optimized_code = optimized_code.strip()
-            
-            return {
-                "optimized_code": optimized_code,
-                "explanation": "Optimized using StarCoder AI model",
-                "changes": [{"type": "ai_optimization", "description": "AI-optimized code for energy efficiency"}]
-            }
+                return {
+                    "optimized_code": optimized_code,
+                    "explanation": "Optimized using StarCoder AI model",
+                    "changes": [{"type": "ai_optimization", "description": "AI-optimized code for energy efficiency"}]
+                }
             
         except Exception as model_error:
             print(f"Error using StarCoder model: {model_error}")
             # Fall back to rule-based optimization
 
-        # For now, use rule-based optimization
-        changes = []
-        optimized_code = code
-        
-        # Replace manual list building with list comprehensions
-        list_comp_pattern = r'(\w+)\s*=\s*\[\]\s*\n\s*for\s+(\w+)\s+in\s+(.+):\s*\n\s+if\s+(.+):\s*\n\s+\1\.append\((.+)\)'
-        match = re.search(list_comp_pattern, code)
-        
-        if match:
-            var_name, item_name, iterable, condition, expression = match.groups()
-            replacement = f"{var_name} = [{expression} for {item_name} in {iterable} if {condition}]"
-            optimized_code = optimized_code.replace(match.group(0), replacement)
-            changes.append({
-                "type": "list_comprehension",
-                "description": "Replaced for-loop with more efficient list comprehension"
-            })
-        
-        # Replace manual sum with built-in sum()
-        sum_pattern = r'(\w+)\s*=\s*0\s*\n\s*for\s+(\w+)\s+in\s+(\w+):\s*\n\s+\1\s*\+\=\s*\2'
-        match = re.search(sum_pattern, optimized_code)
-        
-        if match:
-            total_var, item_name, iterable = match.groups()
-            replacement = f"{total_var} = sum({iterable})"
-            optimized_code = optimized_code.replace(match.group(0), replacement)
-            changes.append({
-                "type": "builtin_function",
-                "description": "Replaced manual sum loop with efficient built-in sum() function"
-            })
-        
-        # If no changes were made, provide the original code
-        if not changes:
-            # For demo purposes, let's still show an optimized version
-            if "calculate_values" in code and "result = []" in code:
-                optimized_code = """def calculate_values(data):
-    result = [item * 2 for item in data if item > 0]
-    total = sum(result)
-    return result, total"""
-                changes.append({
-                    "type": "list_comprehension",
-                    "description": "Replaced for-loop with more efficient list comprehension"
-                })
-                changes.append({
-                    "type": "builtin_function",
-                    "description": "Replaced manual summation with built-in sum() function"
-                })
-        
-        explanation = "Code optimized using sustainable programming patterns:"
-        for change in changes:
-            explanation += f"\n- {change['description']}"
-            
-        return {
-            "optimized_code": optimized_code,
-            "explanation": explanation,
-            "changes": changes
-        }
+        return _rule_based_result(optimized_code, changes)
     
     except Exception as e:
         # If any error occurs, return the original code
@@ -123,3 +100,16 @@ def suggest_optimization(code):
             "explanation": f"Could not optimize due to an error: {str(e)}",
             "changes": []
         }
+
+
+def _rule_based_result(optimized_code, changes):
+    """Result of suggest_optimization for code rewritten by the rewrite rules."""
+    explanation = "Code optimized using sustainable programming patterns:"
+    for change in changes:
+        explanation += f"\n- {change['description']}"
+        
+    return {
+        "optimized_code": optimized_code,
+        "explanation": explanation,
+        "changes": changes
+    }
@@ -3,9 +3,23 @@ Generates optimization variants (fast vs. green) with trade-off analysis
 """
 
 import time
-import ast
 import re
 
+from .parsed_source import ParsedSource
+from .rewrite_engine import (
+    ComprehensionArgumentToGenerator,
+    ComprehensionToAppendLoop,
+    RewriteEngine,
+    default_engine,
+    default_passes,
+    recursive_functions,
+)
+
+# Green version on large data: the default rewrites, then generators instead of temporary lists
+LAZY_ENGINE = RewriteEngine(default_passes() + [ComprehensionArgumentToGenerator()])
+# Fast version on large data: comprehensions as loops with a local reference to append
+PREALLOCATED_ENGINE = RewriteEngine([ComprehensionToAppendLoop()])
+
 class OptimizationVariants:
     """Generates fast and green versions of code with trade-off analysis."""
     
@@ -17,17 +31,18 @@ class OptimizationVariants:
         Generate both fast and green variants of the code.
         
         Args:
-            code (str): Original code to optimize
+            code (str or ParsedSource): Original code to optimize
             analysis_results (dict): Results from static analysis
             algorithm_analysis (dict): Results from algorithm analysis
             
         Returns:
             dict: Fast and green variants with metrics
         """
+        source = ParsedSource.ensure(code)
+        code = source.code
+
         # Validate code syntax
-        try:
-            ast.parse(code)
-        except SyntaxError:
+        if not source.is_valid:
             return {
                 "fast_version": {
                     "code": code,
@@ -77,17 +92,8 @@ class OptimizationVariants:
         fast_code = code
         
         # Replace list comprehensions with pre-allocated lists (when dealing with large lists)
-        list_comp_pattern = r'\[(.+) for (.+) in (.+) if (.+)\]'
-        match = re.search(list_comp_pattern, fast_code)
-        if match:
-            expr, var, iterable, condition = match.groups()
-            if "large" in iterable.lower() or algorithm_analysis and algorithm_analysis.get("data_size", "small") == "large":
-                replacement = f"""result = []
-result_append = result.append  # Local reference for faster lookups
-for {var} in {iterable}:
-    if {condition}:
-        result_append({expr})"""
-                fast_code = fast_code.replace(match.group(0), replacement)
+        if self._is_large(code, algorithm_analysis):
+            fast_code, _ = PREALLOCATED_ENGINE.run(fast_code)
         
         # Generate arrays for heavily numeric operations
         if "numpy" in fast_code or "sum" in fast_code or any(op in fast_code for op in ["+", "-", "*", "/"]):
@@ -97,7 +103,7 @@ import numpy as np
 {fast_code.replace("sum(", "np.sum(").replace("range(", "np.arange(")}"""
         
         # Replace recursive solutions with iterative ones
-        if re.search(r"def\s+(\w+).*\n.*\1\(", fast_code, re.DOTALL):
+        if recursive_functions(code):
             # This is simplified, actual recursion replacement would be more complex
             fast_code = f"""# Recursion replaced with iteration for speed
 {fast_code}
@@ -113,45 +119,32 @@ import numpy as np
         
     def _create_green_version(self, code, algorithm_analysis=None):
         """Create an energy-efficient optimized version of the code."""
-        green_code = code
-        
-        # Transform for loops into list comprehensions
-        for_loop_pattern = r'(\w+)\s*=\s*\[\]\s*\n\s*for\s+(\w+)\s+in\s+(.+):\s*\n\s+if\s+(.+):\s*\n\s+\1\.append\((.+)\)'
-        match = re.search(for_loop_pattern, green_code)
-        if match:
-            var_name, item_name, iterable, condition, expression = match.groups()
-            replacement = f"{var_name} = [{expression} for {item_name} in {iterable} if {condition}]"
-            green_code = green_code.replace(match.group(0), replacement)
-        
-        # Replace manual sum with built-in sum()
-        sum_pattern = r'(\w+)\s*=\s*0\s*\n\s*for\s+(\w+)\s+in\s+(\w+):\s*\n\s+\1\s*\+\=\s*\2'
-        match = re.search(sum_pattern, green_code)
-        if match:
-            total_var, item_name, iterable = match.groups()
-            replacement = f"{total_var} = sum({iterable})"
-            green_code = green_code.replace(match.group(0), replacement)
-        
-        # Use lazy evaluation with generators for large data
-        if "large" in green_code.lower() or algorithm_analysis and algorithm_analysis.get("data_size", "small") == "large":
-            if "[" in green_code and "]" in green_code and "for" in green_code:
-                green_code = green_code.replace("[", "(").replace("]", ")")
-                green_code = f"""# Using generators for memory efficiency
+        # List comprehensions, built-in sum() and join(), and generators for large data
+        large = self._is_large(code, algorithm_analysis)
+        green_code, changes = (LAZY_ENGINE if large else default_engine).run(code)
+        if large and any(change["type"] == "generator_expression" for change in changes):
+            green_code = f"""# Using generators for memory efficiency
 {green_code}
-
 # Note: Generator expressions consume less memory than list comprehensions"""
         
-        # Memoize repeated function calls
-        if re.search(r"def\s+(\w+).*\n.*\1\(", green_code, re.DOTALL):
-            # Simplified memoization suggestion
-            # Fix the problematic f-string with raw string
-            memoization_comment = "# Consider using memoization for repeated function calls"
-            import_statement = "from functools import lru_cache"
-            
-            decorated_code = green_code.replace("def ", "@lru_cache(maxsize=None)\ndef ")
-            green_code = f"{memoization_comment}\n{import_statement}\n\n{decorated_code}"
+        # Memoize recursive functions
+        recursive = recursive_functions(green_code)
+        if recursive:
+            lines = green_code.splitlines(keepends=True)
+            for function in reversed(recursive):
+                # Above any decorators the function already has
+                first_line = min([function.lineno] + [decorator.lineno for decorator in function.decorator_list])
+                indent = " " * function.col_offset
+                lines.insert(first_line - 1, f"{indent}@lru_cache(maxsize=None)\n")
+            green_code = "# Consider using memoization for repeated function calls\n" \
+                         "from functools import lru_cache\n\n" + "".join(lines)
         
         return green_code
         
+    def _is_large(self, code, algorithm_analysis=None):
+        """Whether the code works on large data, by its names or the algorithm analysis."""
+        return "large" in code.lower() or bool(algorithm_analysis and algorithm_analysis.get("data_size", "small") == "large")
+        
     def _calculate_metrics(self, original_code, fast_version, green_version):
         """Calculate performance and energy metrics for each variant."""
         # In a real system, we'd benchmark actual code execution
@@ -245,7 +238,7 @@ def generate_optimization_variants(code, analysis_results=None, algorithm_analys
     Generate fast and green variants of code with metrics and recommendations.
     
     Args:
-        code (str): Original code to optimize
+        code (str or ParsedSource): Original code to optimize
         analysis_results (dict): Results from static analysis
         algorithm_analysis (dict): Results from algorithm analysis
         
@@ -0,0 +1,167 @@
+"""
+Parse-once source representation shared by every analysis stage
+"""
+
+import ast
+import io
+import tokenize
+from bisect import bisect_right
+
+
+class ParsedSource:
+    """
+    Immutable view of a snippet holding its AST, tokens, line index and function map.
+
+    Build one per request with ``parse_source`` and hand it to the analysis stages
+    so the code is parsed and indexed exactly once. Stages must treat ``tree`` as
+    read-only.
+    """
+
+    __slots__ = ("code", "tree", "syntax_error", "_tokens", "line_offsets", "functions")
+
+    def __init__(self, code):
+        """
+        Parse and index the code.
+
+        Args:
+            code (str): Python source code
+        """
+        tree = None
+        syntax_error = None
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            syntax_error = e
+        except ValueError as e:
+            # e.g. source containing null bytes
+            syntax_error = SyntaxError(str(e))
+
+        object.__setattr__(self, "code", code)
+        object.__setattr__(self, "tree", tree)
+        object.__setattr__(self, "syntax_error", syntax_error)
+        object.__setattr__(self, "_tokens", None)
+        object.__setattr__(self, "line_offsets", self._index_lines(code))
+        object.__setattr__(self, "functions", self._index_functions(tree) if tree is not None else {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParsedSource is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ParsedSource is immutable")
+
+    def __repr__(self):
+        return f"ParsedSource(lines={len(self.line_offsets)}, functions={len(self.functions)}, valid={self.is_valid})"
+
+    @classmethod
+    def ensure(cls, source):
+        """
+        Return ``source`` unchanged if it is already parsed, otherwise parse it.
+
+        Args:
+            source (str or ParsedSource): Raw code or an existing ParsedSource
+
+        Returns:
+            ParsedSource: The parsed source
+        """
+        if isinstance(source, cls):
+            return source
+        return cls(source)
+
+    @property
+    def is_valid(self):
+        """Whether the code parsed without syntax errors."""
+        return self.tree is not None
+
+    @property
+    def tokens(self):
+        """Token stream of the code, tokenized on first access and then reused."""
+        if self._tokens is None:
+            tokens = self._tokenize(self.code) if self.tree is not None else ()
+            object.__setattr__(self, "_tokens", tokens)
+        return self._tokens
+
+    def line_of(self, offset):
+        """
+        Convert a character offset into a 1-based line number in O(log n).
+
+        Args:
+            offset (int): Character offset into ``code``, e.g. ``match.start()``
+
+        Returns:
+            int: Line number containing the offset
+        """
+        return bisect_right(self.line_offsets, offset)
+
+    def offset_of(self, lineno, col_offset=0):
+        """
+        Convert an AST position into a character offset.
+
+        Args:
+            lineno (int): 1-based line number as reported by the AST
+            col_offset (int): UTF-8 byte column as reported by the AST
+
+        Returns:
+            int: Character offset into ``code``
+        """
+        line_start = self.line_offsets[lineno - 1]
+        prefix = self.code[line_start:line_start + col_offset]
+        if prefix.isascii():
+            return line_start + col_offset
+        # Non-ASCII line: AST columns count bytes, not characters
+        line_end = self.code.find("\n", line_start)
+        line = self.code[line_start:line_end if line_end != -1 else len(self.code)]
+        return line_start + len(line.encode("utf-8")[:col_offset].decode("utf-8", errors="ignore"))
+
+    def segment(self, node):
+        """Return the exact source text of an AST node without rescanning the whole file."""
+        start = self.offset_of(node.lineno, node.col_offset)
+        end = self.offset_of(node.end_lineno, node.end_col_offset)
+        return self.code[start:end]
+
+    @staticmethod
+    def _tokenize(code):
+        try:
+            return tuple(tokenize.generate_tokens(io.StringIO(code).readline))
+        except (tokenize.TokenError, SyntaxError):
+            return ()
+
+    @staticmethod
+    def _index_lines(code):
+        offsets = [0]
+        position = code.find("\n")
+        while position != -1:
+            offsets.append(position + 1)
+            position = code.find("\n", position + 1)
+        return tuple(offsets)
+
+    @staticmethod
+    def _index_functions(tree):
+        """Map qualified function names (``Class.method``, ``outer.inner``) to their nodes."""
+        functions = []
+        stack = [(tree, "")]
+        while stack:
+            node, prefix = stack.pop()
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    qualname = f"{prefix}{child.name}"
+                    if not isinstance(child, ast.ClassDef):
+                        functions.append((qualname, child))
+                    stack.append((child, f"{qualname}."))
+                else:
+                    stack.append((child, prefix))
+        # Source order, so a later redefinition wins like it does at runtime
+        functions.sort(key=lambda item: (item[1].lineno, item[1].col_offset))
+        return dict(functions)
+
+
+def parse_source(code):
+    """
+    Parse code once for use by all analysis stages.
+
+    Args:
+        code (str or ParsedSource): Python source code
+
+    Returns:
+        ParsedSource: Parsed and indexed source
+    """
+    return ParsedSource.ensure(code)
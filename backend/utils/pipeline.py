@@ -0,0 +1,111 @@
+"""
+Dependency-graph runner for the analysis pipeline stages
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "8"))
+
+
+class Stage:
+    """One step of the pipeline and the stages whose results it needs."""
+
+    def __init__(self, name, func, depends_on=()):
+        """
+        Initialize the stage.
+
+        Args:
+            name (str): Stage name, used as the key of its result
+            func (callable): Called with a dict of the results of ``depends_on``
+            depends_on (tuple): Names of the stages that must finish first
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+class StagePipeline:
+    """Runs stages on an executor as soon as everything they depend on has finished."""
+
+    def __init__(self, stages):
+        """
+        Initialize the pipeline.
+
+        Args:
+            stages (list): Stage instances. Dependencies must refer to stages in the list.
+
+        Raises:
+            ValueError: If a dependency is unknown or the stages form a cycle
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+        self._check_acyclic()
+
+    def run(self, executor, on_stage=None):
+        """
+        Run every stage, independent ones concurrently.
+
+        ``on_stage(name, result)`` is called from the calling thread as each stage
+        finishes. If a stage raises, stages not yet started are cancelled and the
+        exception is re-raised once running stages have finished.
+
+        Args:
+            executor (Executor): Executor the stages run on
+            on_stage (callable, optional): Progress callback
+
+        Returns:
+            tuple: (dict of results by stage name, dict of seconds taken by stage name)
+        """
+        results = {}
+        timings = {}
+        running = {}
+        waiting = dict(self.stages)
+
+        def timed(stage, inputs):
+            start_time = time.time()
+            result = stage.func(inputs)
+            return result, time.time() - start_time
+
+        def start_ready():
+            for name, stage in list(waiting.items()):
+                if all(dependency in results for dependency in stage.depends_on):
+                    inputs = {dependency: results[dependency] for dependency in stage.depends_on}
+                    running[executor.submit(timed, stage, inputs)] = name
+                    del waiting[name]
+
+        start_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], timings[name] = future.result()
+                except Exception:
+                    # Let stages already running finish, then report the failure
+                    wait(running)
+                    raise
+                if on_stage:
+                    on_stage(name, results[name])
+            start_ready()
+
+        return results, {name: round(seconds, 4) for name, seconds in timings.items()}
+
+    def _check_acyclic(self):
+        resolved = set()
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items() if set(stage.depends_on) <= resolved]
+            if not ready:
+                raise ValueError(f"Stages form a dependency cycle: {sorted(remaining)}")
+            for name in ready:
+                resolved.add(name)
+                del remaining[name]
+
+
+# Shared executor for pipeline stages
+stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
@@ -0,0 +1,161 @@
+"""
+Prompt-lookup decoding: drafts tokens by copying from the prompt and verifies them in one forward pass
+
+Optimized code is mostly a copy of the original with local edits. After each token,
+the last few tokens are looked up earlier in the sequence; the tokens that followed
+the match there are proposed as a draft. One forward pass scores the draft, and the
+longest prefix the model agrees with is kept, plus the model's own next token. Output
+is the same as decoding one token at a time, greedy or sampled.
+"""
+
+import os
+
+# Longest n-gram looked up, and most draft tokens proposed per step
+PROMPT_LOOKUP_NGRAM = int(os.getenv("PROMPT_LOOKUP_NGRAM", "3"))
+PROMPT_LOOKUP_TOKENS = int(os.getenv("PROMPT_LOOKUP_TOKENS", "10"))
+
+
+def find_draft(tokens, max_ngram=PROMPT_LOOKUP_NGRAM, max_tokens=PROMPT_LOOKUP_TOKENS):
+    """
+    Propose the tokens that followed the latest earlier occurrence of the sequence's suffix.
+
+    Longer suffixes are tried first, down to a single token.
+
+    Args:
+        tokens (list): Token ids so far (prompt and generated)
+        max_ngram (int): Longest suffix to match
+        max_tokens (int): Most tokens to propose
+
+    Returns:
+        list: Draft token ids, empty when nothing matches
+    """
+    length = len(tokens)
+    for size in range(min(max_ngram, length - 1), 0, -1):
+        suffix = tokens[length - size:]
+        # Latest match first: it is closest to what is being rewritten
+        for start in range(length - size - 1, -1, -1):
+            if tokens[start:start + size] == suffix:
+                draft = tokens[start + size:start + size + max_tokens]
+                if draft:
+                    return draft
+    return []
+
+
+def prompt_lookup_generate(model, input_ids, max_new_tokens, eos_token_id=None, do_sample=False,
+                           temperature=1.0, logits_processor=None, stopping_criteria=None, streamer=None,
+                           max_ngram=PROMPT_LOOKUP_NGRAM, max_draft_tokens=PROMPT_LOOKUP_TOKENS):
+    """
+    Generate for a single prompt with prompt-lookup drafts.
+
+    Each step feeds the next token plus a draft through the model with the key/value
+    cache, keeps the draft tokens up to the first one the model disagrees with, and
+    trims the cache back to the kept tokens. When sampling, a draft token is kept only
+    if the token sampled at its position is the same, which leaves the distribution of
+    the output unchanged.
+
+    Args:
+        model: Causal language model
+        input_ids (torch.Tensor): Prompt token ids of shape (1, prompt_length)
+        max_new_tokens (int): Most tokens to generate
+        eos_token_id (int, optional): Token that ends generation
+        do_sample (bool): Sample instead of taking the most likely token
+        temperature (float): Sampling temperature
+        logits_processor (list, optional): Callables ``(input_ids, scores) -> scores``
+            applied to the scores of each position, as in ``generate``
+        stopping_criteria (list, optional): Callables ``(input_ids, scores) -> bool`` checked
+            after each step's kept tokens; generation ends when one returns True
+        streamer (optional): Receives the prompt, then each step's kept tokens
+        max_ngram (int): Longest suffix looked up
+        max_draft_tokens (int): Most draft tokens per step
+
+    Returns:
+        tuple: (token ids of prompt and generated text as a (1, n) tensor, stats with
+        ``steps``, ``generated_tokens``, ``draft_tokens`` and ``accepted_draft_tokens``)
+    """
+    import torch
+
+    tokens = input_ids[0].tolist()
+    prompt_length = len(tokens)
+    stats = {"steps": 0, "generated_tokens": 0, "draft_tokens": 0, "accepted_draft_tokens": 0}
+    if streamer is not None:
+        streamer.put(input_ids.cpu())
+
+    with torch.no_grad():
+        output = model(input_ids, use_cache=True)
+    past = output.past_key_values
+    next_token = _choose(output.logits[:, -1], tokens, do_sample, temperature, logits_processor, input_ids.device)
+
+    while True:
+        remaining = max_new_tokens - (len(tokens) - prompt_length)
+        if remaining <= 0 or (eos_token_id is not None and next_token == eos_token_id):
+            if remaining > 0:
+                tokens.append(next_token)
+                stats["generated_tokens"] += 1
+                if streamer is not None:
+                    streamer.put(torch.tensor([next_token]))
+            break
+
+        draft = find_draft(tokens + [next_token], max_ngram, min(max_draft_tokens, remaining - 1))
+        block = [next_token] + draft
+        with torch.no_grad():
+            output = model(
+                torch.tensor([block], device=input_ids.device), past_key_values=past, use_cache=True
+            )
+        stats["steps"] += 1
+        stats["draft_tokens"] += len(draft)
+
+        # The model's choice after each block token; the draft is kept while they agree
+        kept = [next_token]
+        for position in range(len(block)):
+            choice = _choose(
+                output.logits[:, position], tokens + kept, do_sample, temperature, logits_processor,
+                input_ids.device
+            )
+            if position < len(draft) and choice == draft[position] and choice != eos_token_id:
+                kept.append(choice)
+                continue
+            next_token = choice
+            break
+
+        stats["accepted_draft_tokens"] += len(kept) - 1
+        stats["generated_tokens"] += len(kept)
+        tokens.extend(kept)
+        past = crop_past_key_values(output.past_key_values, len(tokens))
+        if streamer is not None:
+            streamer.put(torch.tensor(kept))
+        if eos_token_id is not None and eos_token_id in kept:
+            break
+        if stopping_criteria and any(
+            criteria(torch.tensor([tokens], device=input_ids.device), None) for criteria in stopping_criteria
+        ):
+            break
+
+    if streamer is not None:
+        streamer.end()
+    return torch.tensor([tokens], device=input_ids.device), stats
+
+
+def crop_past_key_values(past, length):
+    """
+    Keep the first ``length`` positions of a key/value cache.
+
+    Works for caches of (key, value) pairs shaped (batch, heads, sequence, dim) and for
+    fused per-layer tensors such as GPTBigCode's, whose sequence axis is also second to last.
+    """
+    if isinstance(past, (tuple, list)):
+        return type(past)(crop_past_key_values(item, length) for item in past)
+    return past[..., :length, :]
+
+
+def _choose(scores, tokens, do_sample, temperature, logits_processor, device):
+    """Pick the next token from one position's scores, like ``generate`` would."""
+    import torch
+
+    if logits_processor:
+        ids = torch.tensor([tokens], device=device)
+        for processor in logits_processor:
+            scores = processor(ids, scores)
+    if not do_sample:
+        return int(scores.argmax(-1)[0])
+    probabilities = torch.softmax(scores.float() / max(temperature, 1e-5), dim=-1)
+    return int(torch.multinomial(probabilities, 1)[0, 0])
@@ -0,0 +1,249 @@
+"""
+Content-addressed cache for analysis results (in-memory LRU backed by a shared on-disk store)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import record_cache_lookup
+
+# Bump when analysis rules or the response format change so old results are never served
+RULES_VERSION = "6"
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+DEFAULT_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+DEFAULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "greencode-ai-cache"))
+
+
+def make_cache_key(code, context="energy_efficiency", advanced=True, variants=True, model_id=None, profile=False):
+    """
+    Build a content-addressed key for an analysis request.
+
+    Args:
+        code (str): Source code being analyzed
+        context (str): Optimization context
+        advanced (bool): Whether advanced algorithm analysis is enabled
+        variants (bool): Whether fast/green variants are generated
+        model_id (str, optional): Model used for AI optimization
+        profile (bool): Whether empirical complexity profiling is enabled
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    payload = json.dumps(
+        [RULES_VERSION, code, context, bool(advanced), bool(variants), model_id, bool(profile)],
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier result cache: a per-process LRU in front of a directory shared by all workers."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, cache_dir=DEFAULT_CACHE_DIR, name="result"):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries (int): Maximum number of results kept in memory
+            ttl (float): Seconds a result stays valid in either tier
+            cache_dir (str, optional): Directory for the shared store. Disabled when empty.
+            name (str): Cache label in ``/metrics``
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_mtime = None
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key):
+        """
+        Look up a cached result.
+
+        Every call decodes a fresh copy, so callers may modify the result.
+
+        Args:
+            key (str): Key produced by ``make_cache_key``
+
+        Returns:
+            dict or None: The cached result, or None on a miss
+        """
+        self._sync_generation()
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, serialized = entry
+                if now - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    record_cache_lookup(self.name, hit=True)
+                    return json.loads(serialized)
+                del self._entries[key]
+                self._stats["expirations"] += 1
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                record_cache_lookup(self.name, hit=False)
+                return None
+            self._stats["disk_hits"] += 1
+            record_cache_lookup(self.name, hit=True)
+            self._store_memory(key, entry["created"], json.dumps(entry["value"]))
+        return entry["value"]
+
+    def set(self, key, value):
+        """
+        Store a result in both tiers.
+
+        Args:
+            key (str): Key produced by ``make_cache_key``
+            value (dict): JSON-serializable analysis result
+        """
+        self._sync_generation()
+        created = time.time()
+        try:
+            # Entries are kept as JSON so later changes to ``value`` never reach the cache
+            serialized = json.dumps(value)
+        except (TypeError, ValueError) as e:
+            print(f"Error serializing result cache entry: {e}")
+            return
+        with self._lock:
+            self._store_memory(key, created, serialized)
+        self._write_disk(key, created, serialized)
+
+    def invalidate(self):
+        """
+        Drop every cached result, in this process and for all workers sharing the store.
+
+        Call this whenever models or analysis rules change.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            old_generation = self._current_generation()
+            generation = str(int(old_generation) + 1)
+            self._atomic_write(os.path.join(self.cache_dir, "GENERATION"), generation)
+            self._sync_generation()
+            shutil.rmtree(os.path.join(self.cache_dir, f"gen-{old_generation}"), ignore_errors=True)
+        except (OSError, ValueError) as e:
+            print(f"Error invalidating result cache: {e}")
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current sizes."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        stats["disk_enabled"] = bool(self.cache_dir)
+        return stats
+
+    def _store_memory(self, key, created, serialized):
+        self._entries[key] = (created, serialized)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.cache_dir, "GENERATION")) as f:
+                return f.read().strip() or "0"
+        except OSError:
+            return "0"
+
+    def _sync_generation(self):
+        """Clear the memory tier when another process has invalidated the shared store."""
+        if not self.cache_dir:
+            return
+        try:
+            mtime = os.stat(os.path.join(self.cache_dir, "GENERATION")).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._generation_mtime and self._generation is not None:
+            return
+        generation = self._current_generation()
+        with self._lock:
+            if self._generation is not None and generation != self._generation:
+                self._entries.clear()
+            self._generation = generation
+            self._generation_mtime = mtime
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"gen-{self._generation or '0'}", key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get("created", 0) >= self.ttl:
+            with self._lock:
+                self._stats["expirations"] += 1
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key, created, serialized):
+        if not self.cache_dir:
+            return
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._atomic_write(path, '{"created": %s, "value": %s}' % (json.dumps(created), serialized))
+        except (OSError, ValueError) as e:
+            print(f"Error writing result cache entry: {e}")
+
+    @staticmethod
+    def _atomic_write(path, data):
+        # Write to a temp file in the same directory and rename, so readers
+        # in other processes never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+# Shared cache for the whole process
+result_cache = ResultCache()
@@ -0,0 +1,526 @@
+"""
+AST rewrite engine for rule-based optimizations
+
+Rewrite passes match statement patterns on the AST and replace them with new
+statements. The engine applies every pass in one traversal, retrying each block
+until no pass applies, and splices only the rewritten statements back into the
+source so the rest of the code keeps its formatting and comments.
+"""
+
+import ast
+import copy
+
+from .parsed_source import ParsedSource
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+BLOCK_FIELDS = ("body", "orelse", "finalbody")
+# Calls that consume an iterable once, so a list comprehension argument can be a generator
+CONSUMING_CALLS = {"sum", "any", "all", "min", "max", "sorted", "set", "tuple", "frozenset", "dict", "enumerate"}
+
+
+class RewriteContext:
+    """Where a block of statements sits, as seen by the passes."""
+
+    __slots__ = ("scope", "is_scope_body", "module")
+
+    def __init__(self, scope, is_scope_body, module):
+        # Enclosing function or class, or the module
+        self.scope = scope
+        # Whether the block is the scope's own body, so names bound in it die with the scope
+        self.is_scope_body = is_scope_body
+        # Whole module being rewritten
+        self.module = module
+
+
+class RewritePass:
+    """
+    Base class for a rewrite.
+
+    Subclasses implement ``rewrite``: given a block of statements and an index, it
+    returns ``(count, statements)`` to replace ``count`` statements starting at the
+    index with the new ``statements``, or None when the pattern doesn't match there.
+    A pass must only match code it can rewrite without changing behavior.
+    """
+
+    change_type = ""
+    description = ""
+    # Builtins the rewritten code calls; the pass must not apply where the code binds one of them
+    emitted_builtins = ()
+
+    def rewrite(self, body, index, context):
+        raise NotImplementedError
+
+    def change(self):
+        """The entry reported in ``changes`` when the pass applied."""
+        return {"type": self.change_type, "description": self.description}
+
+
+class ListAppendToComprehension(RewritePass):
+    """``result = []`` and a loop that only (conditionally) appends, as one list comprehension."""
+
+    change_type = "list_comprehension"
+    description = "Replaced for-loop with more efficient list comprehension"
+
+    def rewrite(self, body, index, context):
+        match = _accumulation_loop(body, index, context, _is_empty_list, self.emitted_builtins)
+        if match is None:
+            return None
+        name, loop, statement, condition = match
+        value = _append_value(statement, name)
+        if value is None or _references(value, name):
+            return None
+        comprehension = ast.ListComp(elt=value, generators=[_comprehension(loop, condition)])
+        return 2, [_assign(name, comprehension)]
+
+
+class ManualSumToBuiltin(RewritePass):
+    """``total = 0`` and a loop that only adds to ``total``, as ``sum``."""
+
+    change_type = "builtin_function"
+    description = "Replaced manual sum loop with efficient built-in sum() function"
+    emitted_builtins = ("sum",)
+
+    def rewrite(self, body, index, context):
+        match = _accumulation_loop(body, index, context, _is_zero, self.emitted_builtins)
+        if match is None:
+            return None
+        name, loop, statement, condition = match
+        value = _added_value(statement, name)
+        if value is None:
+            return None
+        args = [_iterable_of(loop, value, condition)]
+        if isinstance(body[index].value.value, float):
+            # sum() starts from the integer 0
+            args.append(ast.Constant(0.0))
+        return 2, [_assign(name, ast.Call(func=ast.Name("sum", ast.Load()), args=args, keywords=[]))]
+
+
+class StringConcatToJoin(RewritePass):
+    """``text = ""`` and a loop that only does ``text += piece``, as ``"".join``."""
+
+    change_type = "string_join"
+    description = "Replaced inefficient string concatenation with join() method"
+
+    def rewrite(self, body, index, context):
+        match = _accumulation_loop(body, index, context, _is_empty_string, self.emitted_builtins)
+        if match is None:
+            return None
+        name, loop, statement, condition = match
+        value = _added_value(statement, name)
+        if value is None:
+            return None
+        pieces = _iterable_of(loop, value, condition)
+        if isinstance(pieces, ast.GeneratorExp):
+            # join() builds a list first anyway; a list comprehension is faster than a generator
+            pieces = ast.ListComp(elt=pieces.elt, generators=pieces.generators)
+        join = ast.Call(
+            func=ast.Attribute(value=ast.Constant(""), attr="join", ctx=ast.Load()), args=[pieces], keywords=[]
+        )
+        return 2, [_assign(name, join)]
+
+
+class ComprehensionArgumentToGenerator(RewritePass):
+    """``sum([x for x in items])`` and other single-pass consumers, with a generator instead of a list."""
+
+    change_type = "generator_expression"
+    description = "Passed a generator expression instead of building a temporary list"
+
+    def rewrite(self, body, index, context):
+        statement = body[index]
+        changed = False
+        for node in _walk_statement(statement):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in CONSUMING_CALLS
+                    and len(node.args) == 1 and not node.keywords and isinstance(node.args[0], ast.ListComp)):
+                comprehension = node.args[0]
+                node.args[0] = ast.GeneratorExp(elt=comprehension.elt, generators=comprehension.generators)
+                changed = True
+        return (1, [statement]) if changed else None
+
+
+class ComprehensionToAppendLoop(RewritePass):
+    """
+    ``result = [... for ...]`` as a loop appending through a local reference to ``append``.
+
+    The inverse of ``ListAppendToComprehension``, so the two must not run in the same engine.
+    """
+
+    change_type = "preallocated_loop"
+    description = "Built the list in a loop with a local reference to append for faster lookups"
+
+    def rewrite(self, body, index, context):
+        statement = body[index]
+        if not (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Name) and isinstance(statement.value, ast.ListComp)):
+            return None
+        comprehension = statement.value
+        if len(comprehension.generators) != 1 or comprehension.generators[0].is_async:
+            return None
+        generator = comprehension.generators[0]
+        name = statement.targets[0].id
+        append = f"{name}_append"
+        if _references(comprehension, name) or _references(context.scope, append):
+            return None
+
+        inner = ast.Expr(ast.Call(func=ast.Name(append, ast.Load()), args=[comprehension.elt], keywords=[]))
+        for condition in reversed(generator.ifs):
+            inner = ast.If(test=condition, body=[inner], orelse=[])
+        return 1, [
+            _assign(name, ast.List(elts=[], ctx=ast.Load())),
+            _assign(append, ast.Attribute(value=ast.Name(name, ast.Load()), attr="append", ctx=ast.Load())),
+            ast.For(target=generator.target, iter=generator.iter, body=[inner], orelse=[]),
+        ]
+
+
+class RewriteEngine:
+    """Applies rewrite passes to a fixpoint in a single traversal and splices the result into the source."""
+
+    def __init__(self, passes=None):
+        """
+        Initialize the engine.
+
+        Args:
+            passes (list, optional): RewritePass instances, tried in order at each statement
+        """
+        self.passes = list(passes or [])
+
+    def run(self, code):
+        """
+        Rewrite code.
+
+        Blocks are rewritten innermost first. Within a block, each statement is
+        retried after a rewrite, together with the statement before it, until no
+        pass applies. The rewritten code must parse back to the rewritten AST,
+        otherwise the code is returned unchanged.
+
+        Args:
+            code (str or ParsedSource): Code to rewrite
+
+        Returns:
+            tuple: (rewritten code, list of changes, one per pass that applied)
+        """
+        source = ParsedSource.ensure(code)
+        if not source.is_valid or not self.passes:
+            return source.code, []
+
+        tree = copy.deepcopy(source.tree)
+        applied = []
+        rewritten = set()
+        self._rewrite_block(tree.body, RewriteContext(tree, True, tree), applied, rewritten)
+        if not applied:
+            return source.code, []
+
+        new_code = _splice(source, tree, rewritten)
+        if not _parses_to(new_code, tree):
+            # Splicing failed to reproduce the tree; fall back to printing the whole module
+            new_code = ast.unparse(tree) + "\n"
+            if not _parses_to(new_code, tree):
+                return source.code, []
+
+        changes = []
+        for rewrite_pass in applied:
+            if rewrite_pass.change() not in changes:
+                changes.append(rewrite_pass.change())
+        return new_code, changes
+
+    def _rewrite_block(self, body, context, applied, rewritten):
+        for statement in body:
+            for field in BLOCK_FIELDS:
+                block = getattr(statement, field, None)
+                if isinstance(block, list) and block and isinstance(block[0], ast.stmt):
+                    scope = statement if isinstance(statement, FUNCTION_NODES + (ast.ClassDef,)) else context.scope
+                    self._rewrite_block(block, RewriteContext(scope, scope is statement and field == "body",
+                                                              context.module), applied, rewritten)
+            for handler in getattr(statement, "handlers", []):
+                self._rewrite_block(handler.body, RewriteContext(context.scope, False, context.module),
+                                    applied, rewritten)
+
+        if isinstance(context.scope, ast.ClassDef):
+            # Comprehensions can't see names bound in a class body, so only its methods are rewritten
+            return
+
+        index = 0
+        while index < len(body):
+            for rewrite_pass in self.passes:
+                result = rewrite_pass.rewrite(body, index, context)
+                if result is None:
+                    continue
+                count, statements = result
+                first, last = body[index], body[index + count - 1]
+                for statement in statements:
+                    _set_span(statement, first, last)
+                    rewritten.add(id(statement))
+                body[index:index + count] = statements
+                applied.append(rewrite_pass)
+                # A rewrite can complete a pattern with the statement before it
+                index = max(index - 1, 0)
+                break
+            else:
+                index += 1
+
+
+def recursive_functions(code):
+    """
+    Find functions that call themselves by name.
+
+    Args:
+        code (str or ParsedSource): Code to search
+
+    Returns:
+        list: FunctionDef nodes of the recursive functions, in source order
+    """
+    source = ParsedSource.ensure(code)
+    if not source.is_valid:
+        return []
+    functions = [
+        node for node in ast.walk(source.tree)
+        if isinstance(node, FUNCTION_NODES) and any(
+            isinstance(child, ast.Call) and isinstance(child.func, ast.Name) and child.func.id == node.name
+            for child in ast.walk(node)
+        )
+    ]
+    return sorted(functions, key=lambda node: node.lineno)
+
+
+def default_passes():
+    """Return fresh instances of the rewrites used by rule-based optimization."""
+    return [
+        ListAppendToComprehension(),
+        ManualSumToBuiltin(),
+        StringConcatToJoin(),
+    ]
+
+
+def _accumulation_loop(body, index, context, is_initial_value, emitted_builtins=()):
+    """
+    Match ``name = <initial value>`` followed by a loop whose only statement updates ``name``.
+
+    Nothing matches when the module binds one of ``emitted_builtins`` anywhere, e.g. an
+    accumulator called ``sum``, since the rewritten code would call that binding instead.
+
+    Returns:
+        tuple: (name, loop, statement, condition or None), or None
+    """
+    if index + 1 >= len(body):
+        return None
+    initializer, loop = body[index], body[index + 1]
+    if not (isinstance(initializer, ast.Assign) and len(initializer.targets) == 1
+            and isinstance(initializer.targets[0], ast.Name) and is_initial_value(initializer.value)):
+        return None
+    if not isinstance(loop, ast.For) or loop.orelse or len(loop.body) != 1:
+        return None
+    name = initializer.targets[0].id
+    if any(_binds(context.module, builtin) for builtin in emitted_builtins):
+        return None
+    loop_names = _bound_names(loop.target)
+    if loop_names is None or name in loop_names or _references(loop.iter, name):
+        return None
+
+    statement, condition = loop.body[0], None
+    if isinstance(statement, ast.If):
+        if statement.orelse or len(statement.body) != 1 or _references(statement.test, name):
+            return None
+        statement, condition = statement.body[0], statement.test
+    # A comprehension doesn't leave its loop variables bound afterwards
+    if any(_used_after_loop(loop_name, body, index + 2, loop, context) for loop_name in loop_names):
+        return None
+    return name, loop, statement, condition
+
+
+def _used_after_loop(name, body, start, loop, context):
+    """Whether the loop variable's last value may be read after the loop."""
+    # Functions, lambdas and classes may run at any time and see the value as a closure
+    # or, for a loop binding a global, from anywhere in the module
+    declared = any(isinstance(node, (ast.Global, ast.Nonlocal)) and name in node.names
+                   for node in _walk_statement(context.scope))
+    if _read_by_nested_scope(context.module if declared else context.scope, name):
+        return True
+    for statement in body[start:]:
+        if isinstance(statement, (ast.For, ast.AsyncFor)) and name in (_bound_names(statement.target) or ()) \
+                and not _references(statement.iter, name):
+            return False
+        if (isinstance(statement, ast.Assign) and any(_references(target, name) for target in statement.targets)
+                and all(isinstance(target, ast.Name) for target in statement.targets)
+                and not _references(statement.value, name)):
+            return False
+        if _references(statement, name):
+            return True
+    if context.is_scope_body:
+        return False
+    # Nested block: the loop may run again, or code after the enclosing statement may read it
+    return any(
+        _references(statement, name) for statement in _walk_statement(context.scope)
+        if isinstance(statement, ast.stmt) and statement is not loop and not _contains(loop, statement)
+        and not isinstance(statement, (ast.Module,) + FUNCTION_NODES)
+    )
+
+
+def _read_by_nested_scope(scope, name):
+    """Whether a function, lambda or class inside ``scope`` reads ``name`` from outside itself."""
+    return any(
+        node is not scope and isinstance(node, FUNCTION_NODES + (ast.Lambda, ast.ClassDef))
+        and _references(node, name) and not _is_local_to(node, name)
+        for node in ast.walk(scope)
+    )
+
+
+def _is_local_to(function, name):
+    """Whether ``name`` is a parameter or an assigned local of the function or lambda."""
+    if isinstance(function, ast.ClassDef):
+        return False
+    arguments = function.args
+    parameters = arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]
+    if any(arg is not None and arg.arg == name for arg in parameters):
+        return True
+    if isinstance(function, ast.Lambda):
+        return False
+    nodes = [node for statement in function.body for node in _walk_statement(statement)]
+    if any(isinstance(node, (ast.Global, ast.Nonlocal)) and name in node.names for node in nodes):
+        return False
+    return any(isinstance(node, ast.Name) and node.id == name and isinstance(node.ctx, ast.Store) for node in nodes)
+
+
+def _comprehension(loop, condition):
+    return ast.comprehension(target=loop.target, iter=loop.iter, ifs=[condition] if condition is not None else [],
+                             is_async=0)
+
+
+def _iterable_of(loop, value, condition):
+    """``loop.iter`` itself when the loop adds its own variable unconditionally, else a generator."""
+    if condition is None and isinstance(value, ast.Name) and isinstance(loop.target, ast.Name) \
+            and value.id == loop.target.id:
+        return loop.iter
+    return ast.GeneratorExp(elt=value, generators=[_comprehension(loop, condition)])
+
+
+def _append_value(statement, name):
+    if not isinstance(statement, ast.Expr) or not isinstance(statement.value, ast.Call):
+        return None
+    call = statement.value
+    if (isinstance(call.func, ast.Attribute) and call.func.attr == "append"
+            and isinstance(call.func.value, ast.Name) and call.func.value.id == name
+            and len(call.args) == 1 and not isinstance(call.args[0], ast.Starred) and not call.keywords):
+        return call.args[0]
+    return None
+
+
+def _added_value(statement, name):
+    """The value of ``name += value``, when it doesn't read ``name`` itself."""
+    if (isinstance(statement, ast.AugAssign) and isinstance(statement.op, ast.Add)
+            and isinstance(statement.target, ast.Name) and statement.target.id == name
+            and not _references(statement.value, name)):
+        return statement.value
+    return None
+
+
+def _is_empty_list(node):
+    if isinstance(node, ast.List) and not node.elts:
+        return True
+    return (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "list"
+            and not node.args and not node.keywords)
+
+
+def _is_zero(node):
+    return isinstance(node, ast.Constant) and type(node.value) in (int, float) and node.value == 0
+
+
+def _is_empty_string(node):
+    return isinstance(node, ast.Constant) and node.value == "" and isinstance(node.value, str)
+
+
+def _bound_names(target):
+    """Names bound by a loop target, or None for targets other than names and tuples of names."""
+    if isinstance(target, ast.Name):
+        return [target.id]
+    if isinstance(target, (ast.Tuple, ast.List)):
+        names = [_bound_names(element) for element in target.elts]
+        if all(names):
+            return [name for group in names for name in group]
+    return None
+
+
+def _references(node, name):
+    return any(isinstance(child, ast.Name) and child.id == name for child in ast.walk(node))
+
+
+def _binds(node, name):
+    """Whether ``name`` is bound anywhere in ``node``: assigned, a parameter, defined or imported."""
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            bound = child.id if not isinstance(child.ctx, ast.Load) else None
+        elif isinstance(child, ast.arg):
+            bound = child.arg
+        elif isinstance(child, ast.alias):
+            bound = (child.asname or child.name).split(".")[0]
+        elif isinstance(child, FUNCTION_NODES + (ast.ClassDef, ast.ExceptHandler, ast.MatchAs, ast.MatchStar)):
+            bound = child.name
+        elif isinstance(child, ast.MatchMapping):
+            bound = child.rest
+        else:
+            continue
+        if bound == name:
+            return True
+    return False
+
+
+def _contains(node, child):
+    return any(descendant is child for descendant in ast.walk(node))
+
+
+def _walk_statement(node):
+    """Walk a statement without entering nested functions, classes or lambdas."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        for child in ast.iter_child_nodes(current):
+            if not isinstance(child, FUNCTION_NODES + (ast.ClassDef, ast.Lambda)):
+                stack.append(child)
+
+
+def _assign(name, value):
+    return ast.Assign(targets=[ast.Name(name, ast.Store())], value=value)
+
+
+def _set_span(statement, first, last):
+    """Give a new statement the source span of the statements it replaces."""
+    statement.lineno, statement.col_offset = first.lineno, first.col_offset
+    statement.end_lineno, statement.end_col_offset = last.end_lineno, last.end_col_offset
+
+
+def _splice(source, tree, rewritten):
+    """Replace the source text of each outermost rewritten statement with its unparsed form."""
+    replacements = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if id(node) in rewritten:
+            start = source.offset_of(node.lineno, node.col_offset)
+            end = source.offset_of(node.end_lineno, node.end_col_offset)
+            indent = source.code[source.line_offsets[node.lineno - 1]:start]
+            if indent.strip():
+                # Shares its first line with other code, e.g. after a semicolon
+                indent = " " * len(indent)
+            text = ast.unparse(ast.fix_missing_locations(node)).replace("\n", "\n" + indent)
+            replacements.append((start, end, indent, text))
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+
+    code = source.code
+    # Consecutive statements from one rewrite share a span: write their text once
+    grouped = {}
+    for start, end, indent, text in replacements:
+        grouped.setdefault((start, end, indent), []).append(text)
+    for (start, end, indent), texts in sorted(grouped.items(), reverse=True):
+        code = code[:start] + ("\n" + indent).join(reversed(texts)) + code[end:]
+    return code
+
+
+def _parses_to(code, tree):
+    try:
+        return ast.dump(ast.parse(code)) == ast.dump(tree)
+    except (SyntaxError, ValueError):
+        return False
+
+
+# Shared engine with the default rewrites
+default_engine = RewriteEngine(default_passes())
@@ -0,0 +1,251 @@
+"""
+Semantic cache for AI optimizations, keyed by a normalized AST fingerprint
+
+Snippets that differ only in whitespace, comments, docstrings or the names of local
+variables get the same fingerprint. With deterministic decoding they would get the
+same optimization, so it is generated once. It is stored with canonical local names,
+and each caller gets it back with their own names.
+"""
+
+import ast
+import builtins
+import copy
+import hashlib
+import io
+import json
+import os
+import re
+import tokenize
+
+from .parsed_source import ParsedSource
+from .result_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_ENTRIES, DEFAULT_TTL, ResultCache
+
+# Bump when the normalization changes so old fingerprints are never matched
+FINGERPRINT_VERSION = "2"
+
+# Set to 0 to always run the model
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1") == "1"
+
+CANONICAL_PREFIX = "__v"
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)
+# Analysis fields that end up in the optimization prompt
+PROMPT_ANALYSIS_FIELDS = ("time_complexity", "space_complexity", "inefficient_patterns", "algorithm_patterns")
+
+
+class CodeFingerprint:
+    """
+    Fingerprint of a snippet and the renaming between its local names and canonical ones.
+
+    Only names that are local to functions everywhere they appear are renamed:
+    parameters and assigned names that are never also used as globals, attributes,
+    keyword arguments or definition names, and that don't shadow a builtin (an
+    optimization may call the builtin where the snippet used a local of that name). That makes renaming them in any code a
+    matter of replacing name tokens.
+    """
+
+    def __init__(self, digest, names):
+        """
+        Initialize the fingerprint.
+
+        Args:
+            digest (str): Hex digest of the normalized AST
+            names (dict): Original local name -> canonical name
+        """
+        self.digest = digest
+        self.names = names
+
+    def to_canonical(self, code):
+        """
+        Rename the snippet's local names in ``code`` (e.g. its optimization) to canonical names.
+
+        Returns:
+            str: The renamed code, or None when it can't be renamed safely
+        """
+        return _rename(code, self.names)
+
+    def from_canonical(self, code):
+        """
+        Rename canonical names in ``code`` back to this snippet's local names.
+
+        Returns:
+            str: The renamed code, or None when it can't be renamed safely
+        """
+        return _rename(code, {canonical: name for name, canonical in self.names.items()})
+
+
+def fingerprint_source(source):
+    """
+    Fingerprint a snippet.
+
+    Args:
+        source (str or ParsedSource): Code to fingerprint
+
+    Returns:
+        CodeFingerprint: The fingerprint, or None for code that doesn't parse or
+        already uses canonical names
+    """
+    source = ParsedSource.ensure(source)
+    if not source.is_valid or CANONICAL_PREFIX in source.code:
+        return None
+
+    tree = copy.deepcopy(source.tree)
+    names = {}
+    for name in _local_names(tree):
+        names.setdefault(name, f"{CANONICAL_PREFIX}{len(names)}")
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in names:
+            node.id = names[node.id]
+        elif isinstance(node, ast.arg) and node.arg in names:
+            node.arg = names[node.arg]
+        elif isinstance(node, ast.ExceptHandler) and node.name in names:
+            node.name = names[node.name]
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            _strip_docstring(node)
+
+    digest = hashlib.sha256(f"{FINGERPRINT_VERSION}:{ast.dump(tree)}".encode("utf-8")).hexdigest()
+    return CodeFingerprint(digest, names)
+
+
+def make_semantic_key(fingerprint, context, model_id, analysis_results=None):
+    """
+    Build the cache key of an optimization.
+
+    Args:
+        fingerprint (CodeFingerprint): Fingerprint of the code
+        context (str): Optimization context
+        model_id (str): Model generating the optimization
+        analysis_results (dict, optional): Analysis results included in the prompt
+
+    Returns:
+        str: Hex digest identifying the optimization
+    """
+    analysis = {field: (analysis_results or {}).get(field) for field in PROMPT_ANALYSIS_FIELDS}
+    payload = json.dumps([fingerprint.digest, context, model_id, analysis], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _local_names(tree):
+    """Renamable local names, in order of first appearance."""
+    scopes = {}
+    for node in ast.walk(tree):
+        if isinstance(node, FUNCTION_NODES):
+            scopes[node] = _scope_locals(node)
+
+    occurrences = []
+    excluded = set(vars(builtins))
+
+    def visit(node, stack):
+        if isinstance(node, FUNCTION_NODES):
+            stack = stack + [scopes[node]]
+        for child in ast.iter_child_nodes(node):
+            visit(child, stack)
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            excluded.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            excluded.update(node.names)
+        elif isinstance(node, ast.alias):
+            excluded.add((node.asname or node.name).split(".")[0])
+        elif isinstance(node, ast.Attribute):
+            excluded.add(node.attr)
+        elif isinstance(node, ast.keyword) and node.arg:
+            excluded.add(node.arg)
+        elif isinstance(node, (ast.Name, ast.arg, ast.ExceptHandler)):
+            name = node.id if isinstance(node, ast.Name) else node.arg if isinstance(node, ast.arg) else node.name
+            if name is None:
+                return
+            # A name also used outside of a function where it is local stays as it is
+            if any(name in scope for scope in stack):
+                occurrences.append((node.lineno, node.col_offset, name))
+            else:
+                excluded.add(name)
+
+    visit(tree, [])
+    return [name for _, _, name in sorted(occurrences) if name not in excluded]
+
+
+def _scope_locals(function):
+    """Names bound in a function's own scope (parameters and assignments, not nested functions)."""
+    names = set()
+    declared = set()
+    arguments = function.args
+    for arg in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]:
+        if arg is not None:
+            names.add(arg.arg)
+
+    body = [function.body] if isinstance(function, ast.Lambda) else function.body
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.Global, ast.Nonlocal)):
+            declared.update(node.names)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        if not isinstance(node, FUNCTION_NODES + (ast.ClassDef,)):
+            stack.extend(ast.iter_child_nodes(node))
+    return names - declared
+
+
+def _strip_docstring(node):
+    body = node.body
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+            and isinstance(body[0].value.value, str):
+        node.body = body[1:] or [ast.Pass()]
+
+
+def _rename(code, mapping):
+    """
+    Replace name tokens of ``code`` using ``mapping``.
+
+    Returns None when the result could be wrong: code that doesn't parse, a mapped
+    name used as a keyword argument or inside an f-string, or a target name that the
+    code already uses for something else.
+    """
+    try:
+        tree = ast.parse(code)
+        tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+    except (SyntaxError, ValueError, tokenize.TokenError):
+        return None
+
+    if any(isinstance(node, ast.keyword) and node.arg in mapping for node in ast.walk(tree)):
+        return None
+    targets = set(mapping.values())
+    pattern = re.compile(r"\b(?:%s)\b" % "|".join(re.escape(name) for name in mapping)) if mapping else None
+
+    lines = code.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+
+    replacements = []
+    previous = None
+    for token in tokens:
+        if token.type == tokenize.NAME:
+            if token.string in targets and token.string not in mapping:
+                return None
+            if token.string in mapping and not (previous is not None and previous.string == "."):
+                start = offsets[token.start[0] - 1] + token.start[1]
+                replacements.append((start, start + len(token.string), mapping[token.string]))
+        elif token.type == tokenize.STRING and pattern is not None:
+            prefix = token.string[:token.string.find(token.string[-1])].lower()
+            if "f" in prefix and pattern.search(token.string):
+                return None
+        if token.type not in (tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT):
+            previous = token
+
+    for start, end, name in reversed(replacements):
+        code = code[:start] + name + code[end:]
+    return code
+
+
+# Shared cache of canonical optimizations, next to the result cache's store
+semantic_cache = ResultCache(
+    max_entries=DEFAULT_MAX_ENTRIES,
+    ttl=DEFAULT_TTL,
+    cache_dir=os.path.join(DEFAULT_CACHE_DIR, "semantic") if DEFAULT_CACHE_DIR else None,
+    name="semantic",
+)
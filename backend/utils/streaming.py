@@ -0,0 +1,165 @@
+"""
+Server-Sent Events helpers and token streaming for text generation
+"""
+
+import json
+import os
+import queue
+import threading
+
+from .generation_controller import code_end, defined_names
+
+# Seconds to wait for the next generated token before giving up
+STREAM_TOKEN_TIMEOUT = float(os.getenv("STREAM_TOKEN_TIMEOUT", "300"))
+
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Event.
+
+    Args:
+        event (str): Event name
+        data: JSON-serializable payload
+
+    Returns:
+        str: The encoded event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class StreamClosed(Exception):
+    """Raised by ``emit`` once the client reading the event stream has gone away."""
+
+
+class StopOnEvent:
+    """Stopping criterion that ends generation once ``event`` is set."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+
+def generate_with_streamer(model, prompt, on_token, timeout=STREAM_TOKEN_TIMEOUT, **generate_kwargs):
+    """
+    Run a text-generation pipeline while passing each decoded chunk to ``on_token``.
+
+    With ``stop_on_code_end``, the streamed text is cut where the code ends, the same
+    way as the final result, and text after the cut is never sent. Generation stops
+    when ``on_token`` raises, e.g. because the client reading the stream went away.
+
+    Args:
+        model: transformers text-generation pipeline
+        prompt (str): Prompt to complete
+        on_token (callable): Called with each newly generated piece of text
+        timeout (float): Maximum seconds to wait between tokens
+        **generate_kwargs: Passed through to the pipeline
+
+    Returns:
+        list: The pipeline output, same as calling ``model(prompt, ...)``
+    """
+    # Imported from its module: resolving names on the lazy top-level ``transformers``
+    # package is not thread-safe while a model is loading on another thread
+    from transformers.generation.streamers import TextIteratorStreamer
+
+    streamer = TextIteratorStreamer(model.tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+    stop = threading.Event()
+    generate_kwargs["stopping_criteria"] = list(generate_kwargs.get("stopping_criteria") or []) + [StopOnEvent(stop)]
+    cut_at_code_end = generate_kwargs.get("stop_on_code_end", False)
+    known_names = defined_names(prompt)
+    # An odd number of fences means the prompt leaves a code block open for the model
+    in_fence = prompt.count("```") % 2 == 1
+    outcome = {}
+
+    def run():
+        try:
+            outcome["generated"] = model(prompt, streamer=streamer, **generate_kwargs)
+        except Exception as e:
+            outcome["error"] = e
+            # Unblock the consumer loop below
+            streamer.end()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    completion = ""
+    sent = 0
+    try:
+        for text in streamer:
+            if not text or stop.is_set():
+                continue
+            completion += text
+            end = code_end(completion, known_names, in_fence) if cut_at_code_end else None
+            if end is not None:
+                stop.set()
+            else:
+                # Complete lines can't be cut any more; hold back the one still being written
+                end = completion.rfind("\n") + 1 if cut_at_code_end else len(completion)
+            if end > sent:
+                on_token(completion[sent:end])
+                sent = end
+        if not stop.is_set():
+            end = code_end(completion, known_names, in_fence, final=True) if cut_at_code_end else None
+            end = len(completion) if end is None else end
+            if end > sent:
+                on_token(completion[sent:end])
+    except BaseException:
+        stop.set()
+        raise
+    thread.join()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["generated"]
+
+
+def stream_events(producer):
+    """
+    Run ``producer(emit)`` in a background thread and yield what it emits as SSE.
+
+    ``emit(event, data)`` may be called any number of times. An ``error`` event is
+    sent if the producer raises. Once the client has gone away, ``emit`` raises
+    ``StreamClosed`` so the producer stops working for nobody.
+
+    Args:
+        producer (callable): Function doing the work and emitting events
+
+    Yields:
+        str: Encoded Server-Sent Events
+    """
+    events = queue.Queue()
+    closed = threading.Event()
+
+    def emit(event, data):
+        if closed.is_set():
+            # Stop the producer's work, e.g. generation, nobody will read it
+            raise StreamClosed()
+        events.put((event, data))
+
+    def run():
+        try:
+            producer(emit)
+        except StreamClosed:
+            pass
+        except Exception as e:
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield sse_event(*item)
+    finally:
+        # Runs when the client disconnects and the server closes this generator
+        closed.set()
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop reverse proxies from buffering the stream
+    "X-Accel-Buffering": "no",
+}
@@ -3,13 +3,13 @@ import { motion, AnimatePresence } from 'framer-motion';
 import styled from 'styled-components';
 
 // Import services and components
-import { analyzeCode } from '../services/api';
+import { analyzeCodeAsync } from '../services/api';
 import config from '../config';
 import ModelSelector from './editor/ModelSelector';
 import DetailedComparison from './editor/DetailedComparison';
 import ContextSelector from './editor/ContextSelector';
 
-const ImprovedOptimizedCodeBlock = ({ code, state, modelName, showVariants, onShowVariants }) => {
+const ImprovedOptimizedCodeBlock = ({ code, state, modelName, showVariants, onShowVariants, progress }) => {
   const formatCode = (code) => {
     if (!code) return [];
     
@@ -70,6 +70,11 @@ const ImprovedOptimizedCodeBlock = ({ code, state, modelName, showVariants, onSh
         >
           <div className="spinner"></div>
           <p>Optimizing your code for sustainability...</p>
+          {progress && progress.total_stages > 0 && (
+            <p className="progress-stages">
+              {progress.completed_stages.length} of {progress.total_stages} stages complete
+            </p>
+          )}
           <div className="progress-bar">
             <motion.div 
               className="progress"
@@ -343,6 +348,7 @@ const CodeEditor = () => {
     return result, total`);
   const [isOptimizing, setIsOptimizing] = useState(false);
   const [optimizationState, setOptimizationState] = useState('initial');
+  const [jobProgress, setJobProgress] = useState(null);
   const [optimizedCode, setOptimizedCode] = useState('');
   const [errorMessage, setErrorMessage] = useState('');
   const [selectedModel, setSelectedModel] = useState(config.defaultModel);
@@ -386,12 +392,15 @@ const CodeEditor = () => {
     setOptimizationState('loading');
     setErrorMessage('');
     setHasVariants(false);
+    setJobProgress(null);
     
     try {
-      // Call the API service with selected model and context
-      const result = await analyzeCode(userCode, {
+      // Run the analysis as a background job and poll it, so slow generation
+      // never hits the request timeout
+      const result = await analyzeCodeAsync(userCode, {
         model: selectedModel,
-        context: optimizationContext // Pass the optimization context
+        context: optimizationContext, // Pass the optimization context
+        onProgress: (job) => setJobProgress(job.progress)
       });
       
       // Update state with results
@@ -507,6 +516,7 @@ const CodeEditor = () => {
         <ImprovedOptimizedCodeBlock 
           code={getCurrentCode()}
           state={optimizationState}
+          progress={jobProgress}
           modelName={modelName}
           showVariants={hasVariants}
           onShowVariants={toggleComparisonModal}
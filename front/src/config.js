@@ -13,9 +13,13 @@ const config = {
     // API endpoints - Updated for ChatGPT backend
     endpoints: {
       analyze: '/analyze',
-      health: '/health'
+      health: '/health',
+      jobs: '/jobs'
     },
     
+    // Interval between job status polls in milliseconds
+    jobPollInterval: 1000,
+    
     // Request timeout in milliseconds (30 seconds for ChatGPT API)
     timeout: 30000
   },
@@ -74,6 +74,64 @@ export const analyzeCode = async (code, options = {}) => {
   }
 };
 
+/**
+ * Analyze code through the background job API
+ * The job is polled until it finishes instead of holding one long request open,
+ * so slow LLM generation never hits the request timeout.
+ * 
+ * @param {string} code - The code to be analyzed
+ * @param {Object} options - Same options as analyzeCode
+ * @param {Function} options.onProgress - Called with each job snapshot (progress and partial results)
+ * @returns {Promise<Object>} Analysis results
+ */
+export const analyzeCodeAsync = async (code, options = {}) => {
+  const { 
+    advanced = true, 
+    context = 'energy_efficiency',
+    model = config.defaultModel,
+    onProgress = () => {}
+  } = options;
+  
+  const response = await fetch(`${config.api.baseUrl}${config.api.endpoints.jobs}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify({ 
+      code,
+      advanced,
+      context,
+      variants: config.features.showVariants,
+      model: model
+    })
+  });
+  
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.error || `API request failed with status ${response.status}`);
+  }
+  
+  let job = await response.json();
+  
+  while (job.status === 'queued' || job.status === 'running') {
+    onProgress(job);
+    await new Promise(resolve => setTimeout(resolve, config.api.jobPollInterval));
+    
+    const pollResponse = await fetch(`${config.api.baseUrl}${config.api.endpoints.jobs}/${job.id}`);
+    if (!pollResponse.ok) {
+      const errorData = await pollResponse.json().catch(() => ({}));
+      throw new Error(errorData.error || `Job status request failed with status ${pollResponse.status}`);
+    }
+    job = await pollResponse.json();
+  }
+  
+  onProgress(job);
+  if (job.status === 'failed') {
+    throw new Error(job.error || 'Analysis job failed');
+  }
+  return job.result;
+};
+
 /**
  * Check API health status
  * 
@@ -141,6 +199,7 @@ export const clearModelCache = async () => {
 
 export default {
   analyzeCode,
+  analyzeCodeAsync,
   checkHealth,
   getModels,
   clearModelCache
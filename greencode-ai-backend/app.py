@@ -2,12 +2,15 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import traceback
 import os
+import time
 import logging
 from code_analysis import detect_inefficiencies, calculate_complexity
-from code_optimization import rule_based_optimization, generate_code_with_model, call_remote_model
+from code_optimization import rule_based_optimization, generate_code_with_model, generate_variants_with_model, call_remote_model
 from energy_measurement import measure_energy_consumption
 from score_calculation import calculate_green_score, generate_code_variants
-from model_loader import load_local_model, model, tokenizer
+import model_loader
+from inference_worker import get_inference_worker
+from metrics import install_metrics, observe_stage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -15,11 +18,13 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+install_metrics(app)  # Request counters, stage latencies and /metrics
 
 # Constants
 COLAB_URL = os.getenv("COLAB_URL", "")  # URL for remote StarCoder 15B
-USE_LOCAL_MODEL = model is not None
 USE_REMOTE_MODEL_FALLBACK = bool(COLAB_URL)
+# Set to 0 to ask the model even when the rewrite rules already optimized the code
+RULES_FIRST = os.getenv("RULES_FIRST", "1") == "1"
 
 @app.route('/analyze', methods=['POST'])
 def analyze_code():
@@ -42,32 +47,50 @@ def analyze_code():
         original_code = code
         
         # Detect inefficiencies
+        stage_start = time.time()
         inefficiencies = detect_inefficiencies(code)
+        observe_stage("static_analysis", time.time() - stage_start)
         
         # Calculate complexity
+        stage_start = time.time()
         time_complexity, space_complexity = calculate_complexity(code)
+        analysis_time = time.time() - stage_start
+        observe_stage("algorithm_analysis", analysis_time)
         
         # Apply rule-based optimization
+        optimization_start = time.time()
         rule_optimized_code, changes = rule_based_optimization(code)
         
         # Try model-based optimization if available
         model_optimized_code = None
+        fast_code = None
         explanation = ""
         
-        # Step 1: Try local model
-        if USE_LOCAL_MODEL:
+        # Step 1: Try local model, once it has finished loading in the background.
+        # The rewrite rules cover the common patterns without a model call.
+        if changes and RULES_FIRST:
+            explanation = "Rewrite rules applied, model not needed. "
+        elif model_loader.is_model_ready():
             try:
-                model_optimized_code = generate_code_with_model(code)
+                if variants:
+                    # Optimized and speed variants in one batched generation
+                    generated = generate_variants_with_model(code)
+                    model_optimized_code = generated.get("optimized")
+                    fast_code = generated.get("fast")
+                else:
+                    model_optimized_code = generate_code_with_model(code)
                 if model_optimized_code:
                     logger.info("Successfully generated optimized code with local model")
             except Exception as e:
                 logger.error(f"Error using local model: {str(e)}")
                 explanation = f"Local model optimization failed: {str(e)}. "
+        elif model_loader.load_status["state"] == "loading":
+            explanation = "Local model is still loading. "
         else:
             explanation = "Local model not available. "
         
         # Step 2: Try remote model if local failed and remote is configured
-        if model_optimized_code is None and USE_REMOTE_MODEL_FALLBACK:
+        if model_optimized_code is None and USE_REMOTE_MODEL_FALLBACK and not (changes and RULES_FIRST):
             try:
                 model_optimized_code = call_remote_model(code)
                 if model_optimized_code:
@@ -86,8 +109,11 @@ def analyze_code():
         else:
             optimized_code = model_optimized_code
             logger.info("Using model-based optimization")
+        optimization_time = time.time() - optimization_start
+        observe_stage("optimization", optimization_time)
         
         # Measure energy consumption (optional)
+        stage_start = time.time()
         try:
             energy_measurements = measure_energy_consumption(code)
             co2_saved = str(round(energy_measurements.get("co2", 0.0), 2))
@@ -96,12 +122,16 @@ def analyze_code():
             logger.error(f"Error measuring energy: {str(e)}")
             co2_saved = "0.0"
             energy_saved = "0.0"
+        observe_stage("energy", time.time() - stage_start)
         
         # Calculate green score
         green_score = calculate_green_score(original_code, optimized_code, inefficiencies)
         
         # Generate variants if requested
-        code_variants = generate_code_variants(original_code, optimized_code) if variants else {}
+        stage_start = time.time()
+        code_variants = generate_code_variants(original_code, optimized_code, fast_code) if variants else {}
+        if variants:
+            observe_stage("variants", time.time() - stage_start)
         
         # Generate suggestions
         suggestions = []
@@ -135,7 +165,7 @@ def analyze_code():
             "algorithm_analysis": {
                 "time_complexity": time_complexity,
                 "space_complexity": space_complexity,
-                "analysis_time": 0.0,
+                "analysis_time": analysis_time,
                 "algorithm_patterns": [],
                 "inefficient_patterns": [],
                 "optimization_suggestions": []
@@ -144,7 +174,7 @@ def analyze_code():
                 "context": context,
                 "explanation": explanation,
                 "changes": changes,
-                "optimization_time": 0.0
+                "optimization_time": optimization_time
             },
             "green_score": green_score,
             "co2_saved": co2_saved,
@@ -168,13 +198,35 @@ def analyze_code():
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    model_status = "loaded" if model is not None else "not_loaded"
+    model_status = "loaded" if model_loader.is_model_ready() else model_loader.load_status["state"]
+    worker = get_inference_worker()
     return jsonify({
         "status": "healthy",
         "model_status": model_status,
-        "remote_model_configured": bool(COLAB_URL)
+        "model": model_loader.MODEL_NAME,
+        "backend": model_loader.load_status.get("backend", model_loader.INFERENCE_BACKEND),
+        "quantization": model_loader.load_status.get("quantization", model_loader.MODEL_QUANTIZATION),
+        "model_memory_bytes": model_loader.load_status.get("memory_bytes"),
+        "remote_model_configured": bool(COLAB_URL),
+        "inference": worker.stats() if worker else None
     })
 
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 while the model is still loading, with its progress"""
+    status = model_loader.get_load_status()
+    ready = status["state"] != "loading"
+    return jsonify({
+        "ready": ready,
+        "degraded": status["state"] != "ready",
+        "model": status
+    }), 200 if ready else 503
+
 if __name__ == '__main__':
     # Load environment variables
     port = int(os.environ.get('PORT', 5000))
@@ -2,57 +2,49 @@ import re
 import logging
 import requests
 import os
-import torch
-from model_loader import model, tokenizer
+import model_loader
+from inference_worker import get_inference_worker
+from generation_controller import GENERATION_DEADLINE_SECONDS, token_budget
+from rewrite_engine import default_engine
 
 logger = logging.getLogger(__name__)
 
 # Constants
 COLAB_URL = os.getenv("COLAB_URL", "")  # URL for remote StarCoder 15B
 
+# Variant prompts share everything up to the end of the original code, so one
+# batched generation prefills the code once for all of them
+VARIANT_PROMPT_TEMPLATE = """You are an expert Python developer focused on energy-efficient, sustainable code.
+
+# Original code:
+```python
+{original_code}
+```
+
+{task}
+# Optimized code:
+```python
+"""
+
+VARIANT_TASKS = {
+    "optimized": """# Task: Optimize the above code for energy efficiency and sustainability. Focus on:
+1. Reducing unnecessary computations
+2. Minimizing memory usage
+3. Using efficient built-in functions
+4. Vectorizing operations where possible
+5. Avoiding redundant calculations
+""",
+    "fast": """# Task: Optimize the above code for maximum SPEED, regardless of energy consumption.
+""",
+}
+
 def rule_based_optimization(code):
-    """Apply basic rule-based optimizations to Python code."""
-    optimized = code
-    changes = []
-    
-    # Rule 1: Convert basic for loops to list comprehensions
-    original = optimized
-    pattern = r"(\w+)\s*=\s*\[\]\s*\n\s*for\s+(\w+)\s+in\s+(.+?):\s*\n\s*if\s+([^:]+?):\s*\n\s*\1\.append\(([^)]+)\)"
-    replacement = r"\1 = [\5 for \2 in \3 if \4]"
-    optimized = re.sub(pattern, replacement, optimized)
-    if original != optimized:
-        changes.append({
-            "type": "list_comprehension",
-            "description": "Replaced for-loop with more efficient list comprehension"
-        })
-    
-    # Rule 2: Replace manual sum with sum() function
-    original = optimized
-    pattern = r"(\w+)\s*=\s*0\s*\n\s*for\s+(\w+)\s+in\s+([^:]+?):\s*\n\s*\1\s*\+=\s*\2"
-    replacement = r"\1 = sum(\3)"
-    optimized = re.sub(pattern, replacement, optimized)
-    if original != optimized:
-        changes.append({
-            "type": "builtin_function",
-            "description": "Replaced manual sum loop with efficient built-in sum() function"
-        })
-    
-    # Rule 3: Replace string concatenation in loops with join
-    original = optimized
-    pattern = r"(\w+)\s*=\s*[\"\']\s*[\"\']\s*\n\s*for\s+(\w+)\s+in\s+(.+?):\s*\n\s*\1\s*\+=\s*(.+)"
-    replacement = r"\1 = ''.join(\4 for \2 in \3)"
-    optimized = re.sub(pattern, replacement, optimized)
-    if original != optimized:
-        changes.append({
-            "type": "string_join",
-            "description": "Replaced inefficient string concatenation with join() method"
-        })
-    
-    return optimized, changes
+    """Apply rule-based optimizations (AST rewrites) to Python code."""
+    return default_engine.run(code)
 
 def generate_code_with_model(code, prompt_template=None):
     """Use the loaded model to optimize code"""
-    if model is None or tokenizer is None:
+    if not model_loader.is_model_ready():
         logger.warning("Local model not available, skipping model-based optimization")
         return None
     
@@ -61,46 +53,41 @@ def generate_code_with_model(code, prompt_template=None):
             prompt_template = """
             You are an expert Python developer focused on energy-efficient, sustainable code.
             
-            # Original code:
-            ```python
-            {original_code}
-            ```
-            
             # Task: 
-            Optimize the above code for energy efficiency and sustainability. Focus on:
+            Optimize the code below for energy efficiency and sustainability. Focus on:
             1. Reducing unnecessary computations
             2. Minimizing memory usage
             3. Using efficient built-in functions
             4. Vectorizing operations where possible
             5. Avoiding redundant calculations
             
+            # Original code:
+            ```python
+            {original_code}
+            ```
+            
             # Optimized code:
             ```python
             """
         
         # Prepare the prompt
         prompt = prompt_template.format(original_code=code)
+        # The instructions before the code are the same for every request, so their
+        # keys and values are computed once and reused
+        prefix = prompt_template.split("{original_code}")[0] if "{original_code}" in prompt_template else None
         
-        # Encode the prompt
-        inputs = tokenizer(prompt, return_tensors="pt")
-        inputs = {k: v.to(model.device) for k, v in inputs.items()} 
-        
-        # Determine token limit based on model size
-        max_new_tokens = min(500, tokenizer.model_max_length - inputs.input_ids.shape[1] - 10)
-        
-        # Generate optimized code
-        with torch.no_grad():
-            outputs = model.generate(
-                inputs["input_ids"],
-                max_new_tokens=max_new_tokens,
-                temperature=0.2,  # More deterministic outputs
-                num_return_sequences=1,
-                pad_token_id=tokenizer.eos_token_id,
-                do_sample=True
-            )
-        
-        # Decode the generated text
-        generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        # Generate optimized code; the worker batches this with concurrent requests
+        worker = get_inference_worker()
+        generated_text = worker.generate(
+            prompt,
+            max_new_tokens=token_budget(worker.tokenizer, code),
+            temperature=0.2,  # More deterministic outputs
+            do_sample=True,
+            prefix=prefix,
+            # Stop at the end of the code block instead of cutting it out afterwards
+            stop_on_code_end=True,
+            deadline_seconds=GENERATION_DEADLINE_SECONDS
+        )
         
         # Extract only the optimized code
         pattern = r"# Optimized code:\n```python\n(.*?)(?:```|$)"
@@ -126,6 +113,48 @@ def generate_code_with_model(code, prompt_template=None):
         logger.error(f"Error generating optimized code with model: {str(e)}")
         return None
 
+def generate_variants_with_model(code, variants=("optimized", "fast")):
+    """
+    Generate several optimized variants of the code in one batched model call.
+
+    All prompts are submitted to the inference worker together, so they run as a
+    single batch and the shared prompt up to the end of the code is prefilled once.
+
+    Returns a dict mapping each variant name to its code, or None for variants that
+    could not be generated.
+    """
+    worker = get_inference_worker() if model_loader.is_model_ready() else None
+    if worker is None:
+        logger.warning("Local model not available, skipping model-based variants")
+        return {name: None for name in variants}
+
+    preamble = VARIANT_PROMPT_TEMPLATE.split("{original_code}")[0]
+    prompts = {
+        name: VARIANT_PROMPT_TEMPLATE.format(original_code=code, task=VARIANT_TASKS[name])
+        for name in variants
+    }
+    max_new_tokens = token_budget(worker.tokenizer, code)
+    futures = {
+        name: worker.submit(
+            prompt, max_new_tokens=max_new_tokens, temperature=0.2, do_sample=True, prefix=preamble,
+            stop_on_code_end=True, deadline_seconds=GENERATION_DEADLINE_SECONDS
+        )
+        for name, prompt in prompts.items()
+    }
+
+    results = {}
+    for name, future in futures.items():
+        try:
+            generated_part = future.result()[len(prompts[name]):]
+            code_end = generated_part.find("```")
+            if code_end >= 0:
+                generated_part = generated_part[:code_end]
+            results[name] = generated_part.strip() or None
+        except Exception as e:
+            logger.error(f"Error generating {name} variant with model: {str(e)}")
+            results[name] = None
+    return results
+
 def call_remote_model(code):
     """Send code to remote Colab instance running StarCoder 15B"""
     if not COLAB_URL:
@@ -1,76 +1,68 @@
-import os
-import tempfile
+import ast
 import logging
-import json
+import os
 import time
-import uuid
-from codecarbon import EmissionsTracker
+from energy_meter import cpu_seconds_to_joules, energy_meter, joules_to_co2_grams
+from input_generator import MATERIALIZE_SOURCE, build_call, dataset_cache
+from sandbox import sandbox_pool
 
 logger = logging.getLogger(__name__)
 
-def measure_energy_consumption(code):
-    """Measure energy consumption using CodeCarbon"""
+# Constants
+MEASUREMENT_INPUT_SIZE = int(os.getenv("MEASUREMENT_INPUT_SIZE", "10000"))
+
+# Runs in a sandbox worker: defines the code, then calls each function with its generated inputs
+MEASUREMENT_HARNESS = MATERIALIZE_SOURCE + r'''
+_namespace = {"__name__": "__measured__"}
+exec(compile(__code__, "<measured>", "exec"), _namespace)
+_errors = {}
+for _name, _args in __calls__:
     try:
-        # Create test data for the code to run with
-        test_data = {'data': [1, -2, 3, -4, 5, -6, 7, -8, 9, -10] * 1000}
-        
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as tmp_file:
-            # Add test data and wrap the code
-            test_code = f"""
-# Test data
-data = {json.dumps(test_data['data'])}
+        _namespace[_name](*[_materialize(arg) for arg in _args])
+    except Exception as _e:
+        _errors[_name] = f"{type(_e).__name__}: {_e}"
+__result__ = _errors
+'''
 
-# Original code to measure
-{code}
+def build_calls(code, size=MEASUREMENT_INPUT_SIZE):
+    """Build calls with generated inputs for every top-level function in the code"""
+    calls, datasets = [], {}
+    for node in ast.parse(code).body:
+        if isinstance(node, ast.FunctionDef):
+            args, files = build_call(node, size, dataset_cache)
+            calls.append((node.name, args))
+            datasets.update(files)
+    return calls, datasets
+
+def measure_energy_consumption(code):
+    """Measure energy consumption from the CPU time of the code, with the energy meter's reading as an upper bound"""
+    try:
+        # Inputs are inferred from each function's signature and usage; the generated
+        # data is cached in files that the sandbox workers read directly
+        calls, datasets = build_calls(code)
 
-# Run the code with test data
-if 'calculate_values' in locals():
-    result = calculate_values(data)
-elif 'find_pairs' in locals():
-    result = find_pairs(data, 10)
-elif 'build_message' in locals():
-    result = build_message(data)
-            """
-            tmp_file.write(test_code)
-            tmp_file_path = tmp_file.name
-        
-        # Create a unique output file for this run
-        output_file = f"emissions_{uuid.uuid4().hex}.csv"
-        
-        # Initialize the tracker
-        tracker = EmissionsTracker(
-            output_file=output_file,
-            log_level='critical',
-            save_to_file=False,  # We'll just get the value directly
-            tracking_mode='process'
-        )
-        
-        # Track emissions
-        tracker.start()
         start_time = time.time()
-        
-        try:
-            # Execute the code
-            exec(open(tmp_file_path).read(), {})
-        except Exception as e:
-            logger.warning(f"Error executing code for energy measurement: {str(e)}")
-        
-        # Stop tracking and get the results
-        emissions = tracker.stop()
-        execution_time = time.time() - start_time
-        
-        # Clean up
-        os.unlink(tmp_file_path)
-        if os.path.exists(output_file):
-            os.unlink(output_file)
-        
+        # Execute the code in a worker process with CPU, memory and wall-clock limits.
+        # The worker measures the CPU time of the code alone; the machine-wide meter
+        # also counts concurrent work, so its reading is only an upper bound
+        execution = sandbox_pool.run(MEASUREMENT_HARNESS, inputs={"__code__": code, "__calls__": calls},
+                                     datasets=datasets, meter=energy_meter)
+        energy = cpu_seconds_to_joules(execution["cpu_time"]) if execution["cpu_time"] is not None else 0.0
+        execution_time = execution["wall_time"] if execution["wall_time"] is not None else time.time() - start_time
+        if execution["status"] != "ok":
+            logger.warning(f"Error executing code for energy measurement: {execution['error']}")
+        elif execution["result"]:
+            logger.warning(f"Functions failed on generated inputs: {execution['result']}")
+
         return {
-            "co2": emissions or 0.0,
-            "energy": emissions * 1000 if emissions else 0.0,  # Convert to milligrams
-            "time": execution_time
+            "co2": joules_to_co2_grams(energy),
+            "energy": energy,  # Joules
+            "energy_upper_bound": execution["energy_joules"],
+            "time": execution_time,
+            "meter": energy_meter.name if energy_meter else None,
+            "functions": [name for name, _ in calls]
         }
-    
+
     except Exception as e:
         logger.error(f"Error measuring energy consumption: {str(e)}")
-        return {"co2": 0.0, "energy": 0.0, "time": 0.0}
\ No newline at end of file
+        return {"co2": 0.0, "energy": 0.0, "time": 0.0}
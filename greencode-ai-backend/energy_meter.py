@@ -0,0 +1,225 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Constants
+
+POWERCAP_ROOT = os.getenv("POWERCAP_ROOT", "/sys/class/powercap")
+CGROUP_ROOT = os.getenv("CGROUP_ROOT", "/sys/fs/cgroup")
+PROC_STAT = os.getenv("PROC_STAT", "/proc/stat")
+# Power drawn by one fully busy core, used where only CPU time can be measured
+WATTS_PER_CORE = float(os.getenv("ENERGY_WATTS_PER_CORE", "10"))
+# Grid carbon intensity used to turn energy into CO2 (world average)
+CARBON_INTENSITY_G_PER_KWH = float(os.getenv("CARBON_INTENSITY_G_PER_KWH", "475"))
+
+JOULES_PER_KWH = 3.6e6
+
+
+class EnergyMeter:
+    """
+    Base class for an energy meter.
+
+    ``read()`` returns an opaque counter snapshot and ``joules(start, end)`` turns two
+    snapshots into the energy used in between. Counter files are kept open and re-read
+    with ``pread`` so a reading costs a few microseconds.
+    """
+
+    name = ""
+
+    def read(self):
+        raise NotImplementedError
+
+    def joules(self, start, end):
+        raise NotImplementedError
+
+    def close(self):
+        """Close the counter files."""
+        for fd in getattr(self, "_fds", []):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds = []
+
+    def describe(self):
+        """Return the meter's name and settings for reporting."""
+        return {"meter": self.name}
+
+
+class RaplMeter(EnergyMeter):
+    """Reads the CPU package energy counters exposed by the Linux powercap RAPL driver."""
+
+    name = "rapl"
+
+    def __init__(self, root=POWERCAP_ROOT):
+        """
+        Initialize the meter.
+
+        Args:
+            root (str): powercap sysfs directory
+
+        Raises:
+            OSError: If no readable RAPL package counter is found
+        """
+        domains = []
+        for entry in sorted(os.listdir(root)):
+            # Top-level zones only ("intel-rapl:0"); subzones ("intel-rapl:0:0") are part of them
+            if not entry.startswith("intel-rapl:") or entry.count(":") != 1:
+                continue
+            zone = os.path.join(root, entry)
+            domains.append((_read_text(os.path.join(zone, "name")), zone))
+
+        # Package zones cover the cores; fall back to whatever top-level zones exist
+        packages = [zone for name, zone in domains if name.startswith("package")] or [zone for _, zone in domains]
+        if not packages:
+            raise OSError(f"No RAPL zones found in {root}")
+
+        self.zones = packages
+        self._fds = []
+        self._ranges = []
+        try:
+            for zone in packages:
+                self._fds.append(os.open(os.path.join(zone, "energy_uj"), os.O_RDONLY))
+                self._ranges.append(int(_read_text(os.path.join(zone, "max_energy_range_uj"))))
+            self.read()
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def read(self):
+        return tuple(int(os.pread(fd, 32, 0)) for fd in self._fds)
+
+    def joules(self, start, end):
+        total = 0
+        for before, after, max_range in zip(start, end, self._ranges):
+            # Counters wrap around at max_energy_range_uj
+            total += after - before if after >= before else after + max_range - before
+        return total / 1e6
+
+    def describe(self):
+        return {"meter": self.name, "zones": [os.path.basename(zone) for zone in self.zones]}
+
+
+class CgroupCpuMeter(EnergyMeter):
+    """Converts the CPU time of this container's cgroup (v2 ``cpu.stat``) into energy."""
+
+    name = "cgroup"
+
+    def __init__(self, root=CGROUP_ROOT, watts_per_core=WATTS_PER_CORE):
+        """
+        Initialize the meter.
+
+        Args:
+            root (str): cgroup v2 directory containing ``cpu.stat``
+            watts_per_core (float): Power of one fully busy core
+
+        Raises:
+            OSError: If ``cpu.stat`` is missing or has no ``usage_usec``
+        """
+        self.watts_per_core = watts_per_core
+        self._fds = [os.open(os.path.join(root, "cpu.stat"), os.O_RDONLY)]
+        try:
+            self.read()
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def read(self):
+        data = os.pread(self._fds[0], 4096, 0)
+        # First line is "usage_usec <n>"
+        for line in data.split(b"\n"):
+            if line.startswith(b"usage_usec "):
+                return int(line.split()[1])
+        raise ValueError("usage_usec missing from cpu.stat")
+
+    def joules(self, start, end):
+        return (end - start) / 1e6 * self.watts_per_core
+
+    def describe(self):
+        return {"meter": self.name, "watts_per_core": self.watts_per_core}
+
+
+class CpuTimeMeter(EnergyMeter):
+    """Converts machine-wide busy CPU time from ``/proc/stat`` into energy with a per-core power model."""
+
+    name = "cpu_time"
+
+    def __init__(self, proc_stat=PROC_STAT, watts_per_core=WATTS_PER_CORE):
+        """
+        Initialize the meter.
+
+        Args:
+            proc_stat (str): Path of ``/proc/stat``
+            watts_per_core (float): Power of one fully busy core
+        """
+        self.watts_per_core = watts_per_core
+        self._ticks_per_second = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._fds = [os.open(proc_stat, os.O_RDONLY)]
+        try:
+            self.read()
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+    def read(self):
+        # "cpu  user nice system idle iowait irq softirq steal ..."
+        fields = os.pread(self._fds[0], 256, 0).split(b"\n", 1)[0].split()
+        user, nice, system, _idle, _iowait, irq, softirq = (int(value) for value in fields[1:8])
+        return user + nice + system + irq + softirq
+
+    def joules(self, start, end):
+        return (end - start) / self._ticks_per_second * self.watts_per_core
+
+    def describe(self):
+        return {"meter": self.name, "watts_per_core": self.watts_per_core}
+
+
+METERS = {
+    "rapl": lambda: RaplMeter(POWERCAP_ROOT),
+    "cgroup": lambda: CgroupCpuMeter(CGROUP_ROOT),
+    "cpu_time": lambda: CpuTimeMeter(PROC_STAT),
+}
+
+
+def select_energy_meter(preferred=None, meters=None):
+    """
+    Pick the most accurate meter that works on this machine.
+
+    Args:
+        preferred (str, optional): Meter name to try first (``ENERGY_METER``)
+        meters (dict, optional): Name to factory mapping, tried in order
+
+    Returns:
+        EnergyMeter or None: The first meter that could be opened
+    """
+    meters = meters or METERS
+    order = list(meters)
+    if preferred in meters:
+        order.remove(preferred)
+        order.insert(0, preferred)
+    for name in order:
+        try:
+            return meters[name]()
+        except (OSError, ValueError) as e:
+            logger.info(f"Energy meter {name} unavailable: {str(e)}")
+    return None
+
+
+def cpu_seconds_to_joules(cpu_seconds, watts_per_core=WATTS_PER_CORE):
+    """Convert the CPU time of one process into energy with the per-core power model."""
+    return cpu_seconds * watts_per_core
+
+
+def joules_to_co2_grams(joules, intensity=CARBON_INTENSITY_G_PER_KWH):
+    """Convert energy in joules to grams of CO2."""
+    return joules / JOULES_PER_KWH * intensity
+
+
+def _read_text(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+# Meter chosen once at startup and shared by all requests
+energy_meter = select_energy_meter(os.getenv("ENERGY_METER"))
@@ -0,0 +1,192 @@
+import math
+import os
+import re
+import time
+
+# Constants
+# New-token budget: the submitted code's token count times this ratio, within the bounds below
+GENERATION_BUDGET_RATIO = float(os.getenv("GENERATION_BUDGET_RATIO", "1.5"))
+GENERATION_MIN_NEW_TOKENS = int(os.getenv("GENERATION_MIN_NEW_TOKENS", "64"))
+GENERATION_MAX_NEW_TOKENS = int(os.getenv("GENERATION_MAX_NEW_TOKENS", "512"))
+# Budgets are rounded up to a multiple of this, so requests of similar size still batch together
+GENERATION_BUDGET_STEP = 32
+# Wall-clock limit per request, counted from when it was queued
+GENERATION_DEADLINE_SECONDS = float(os.getenv("GENERATION_DEADLINE_SECONDS", "60"))
+
+DEFINITION_PATTERN = re.compile(r"(?:async\s+def|def|class)\s+(\w+)")
+
+
+def token_budget(tokenizer, code, ratio=GENERATION_BUDGET_RATIO, minimum=GENERATION_MIN_NEW_TOKENS,
+                 maximum=GENERATION_MAX_NEW_TOKENS):
+    """
+    Size the new-token budget of a rewrite from the code being rewritten.
+
+    Args:
+        tokenizer: Tokenizer of the model
+        code (str): Submitted code
+        ratio (float): Budget per token of code
+        minimum (int): Smallest budget
+        maximum (int): Largest budget
+
+    Returns:
+        int: Most new tokens to generate
+    """
+    code_tokens = len(tokenizer(code, add_special_tokens=False)["input_ids"])
+    budget = math.ceil(code_tokens * ratio / GENERATION_BUDGET_STEP) * GENERATION_BUDGET_STEP
+    return max(minimum, min(maximum, budget))
+
+
+def defined_names(text):
+    """Names of the functions and classes defined anywhere in ``text``."""
+    return set(DEFINITION_PATTERN.findall(text))
+
+
+def code_end(completion, known_names=(), in_fence=False, final=False):
+    """
+    Find where the code of a completion ends.
+
+    The code ends after the fence closing its code block, or before a fence or a
+    top-level definition that follows the code when the definition is neither one of
+    ``known_names`` nor used by the code generated so far.
+
+    Args:
+        completion (str): Generated text after the prompt
+        known_names (set): Names defined in the prompt's code
+        in_fence (bool): Whether the prompt ends inside an open code fence
+        final (bool): Whether generation has finished, so the last line is complete
+
+    Returns:
+        int: Length of the completion to keep, or None while the code may continue
+    """
+    position = 0
+    has_code = False
+    decorators_start = None
+    for line in completion.splitlines(keepends=True):
+        stripped = line.strip()
+        # A cut before a definition also drops the decorators right above it
+        definition_start = position if decorators_start is None else decorators_start
+        if not line.startswith("@"):
+            decorators_start = None
+        elif decorators_start is None:
+            decorators_start = position
+        if stripped.startswith("```"):
+            if in_fence:
+                return position + line.index("```") + 3
+            if has_code:
+                return position
+            in_fence = True
+        elif not line.endswith("\n") and not final:
+            # Wait for the rest of the line
+            break
+        elif line[:1] not in (" ", "\t", "#") and stripped:
+            match = DEFINITION_PATTERN.match(line)
+            if (match and has_code and match.group(1) not in known_names
+                    and not re.search(rf"\b{match.group(1)}\b", completion[:position])):
+                return definition_start
+            has_code = True
+        elif stripped and not stripped.startswith("#"):
+            has_code = True
+        position += len(line)
+    return None
+
+
+class GenerationController:
+    """
+    Stopping criterion that ends generation once every sequence's code is complete.
+
+    Passed to ``generate`` in ``stopping_criteria``, it is called with the token ids
+    after every new token. A sequence is finished when ``code_end`` finds the end of
+    its code or it emits the end-of-sequence token; generation stops when all
+    sequences are finished or the deadline has passed. ``finish`` then cuts each
+    sequence's text at the end of its code and reports how it stopped.
+    """
+
+    def __init__(self, tokenizer, prompts, max_new_tokens=None, stop_on_code_end=True, deadline=None,
+                 prompt_length=None):
+        """
+        Initialize the controller for one batch.
+
+        Args:
+            tokenizer: Tokenizer of the model
+            prompts (list): Prompts of the batch, in order
+            max_new_tokens (int, optional): Token budget of each sequence
+            stop_on_code_end (bool): Stop sequences once their code is complete
+            deadline (float, optional): ``time.time()`` after which generation stops
+            prompt_length (int, optional): Padded prompt length in tokens; learned from
+                the first call when omitted
+        """
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.stop_on_code_end = stop_on_code_end
+        self.deadline = deadline
+        self.prompt_length = prompt_length
+        self.known_names = [defined_names(prompt) for prompt in prompts]
+        # An odd number of fences means the prompt leaves a code block open for the model
+        self.in_fence = [prompt.count("```") % 2 == 1 for prompt in prompts]
+        self.stop_reasons = [None] * len(prompts)
+        self.stopped_at = [None] * len(prompts)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.prompt_length is None:
+            # First call: the prompt plus the first generated token
+            self.prompt_length = input_ids.shape[1] - 1
+        new_tokens = input_ids.shape[1] - self.prompt_length
+        for row, tokens in enumerate(input_ids.tolist()):
+            if self.stop_reasons[row] is not None:
+                continue
+            if tokens[-1] == self.tokenizer.eos_token_id:
+                self._stop(row, "eos", new_tokens)
+                continue
+            if not self.stop_on_code_end:
+                continue
+            # Only a new line or a fence can end the code
+            last = self.tokenizer.decode(tokens[-1:])
+            if "\n" not in last and "`" not in last:
+                continue
+            completion = self.tokenizer.decode(tokens[self.prompt_length:], skip_special_tokens=True)
+            if code_end(completion, self.known_names[row], self.in_fence[row]) is not None:
+                self._stop(row, "code_end", new_tokens)
+
+        if self.deadline is not None and time.time() >= self.deadline:
+            for row, reason in enumerate(self.stop_reasons):
+                if reason is None:
+                    self._stop(row, "deadline", new_tokens)
+        return all(reason is not None for reason in self.stop_reasons)
+
+    def _stop(self, row, reason, new_tokens):
+        self.stop_reasons[row] = reason
+        self.stopped_at[row] = new_tokens
+
+    def finish(self, row, completion):
+        """
+        Cut a sequence's generated text at the end of its code.
+
+        Args:
+            row (int): Index of the sequence in the batch
+            completion (str): Generated text after the prompt
+
+        Returns:
+            tuple: (text to keep, report with ``stop_reason``, ``new_tokens``,
+            ``token_budget`` and ``saved_tokens``)
+        """
+        new_tokens = self.stopped_at[row]
+        if new_tokens is None:
+            new_tokens = len(self.tokenizer(completion, add_special_tokens=False)["input_ids"])
+        reason = self.stop_reasons[row]
+        end = code_end(completion, self.known_names[row], self.in_fence[row], final=True) if self.stop_on_code_end else None
+        if end is not None:
+            completion = completion[:end]
+            reason = reason or "code_end"
+        elif reason is None:
+            reason = "budget" if self.max_new_tokens and new_tokens >= self.max_new_tokens else "eos"
+
+        # Tokens of the budget left ungenerated because the code was complete
+        saved_tokens = 0
+        if reason == "code_end" and self.max_new_tokens:
+            saved_tokens = max(0, self.max_new_tokens - new_tokens)
+        return completion, {
+            "stop_reason": reason,
+            "new_tokens": new_tokens,
+            "token_budget": self.max_new_tokens,
+            "saved_tokens": saved_tokens,
+        }
@@ -0,0 +1,252 @@
+import os
+import logging
+import time
+from quantization import MODEL_QUANTIZATION, quantize_model
+
+logger = logging.getLogger(__name__)
+
+# Constants
+# transformers (default), onnx or stub
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "transformers").lower()
+# Exported ONNX graphs are kept here, one directory per model
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", "./models/onnx")
+# Optional delay per generated token, so the stub can stand in for a real model in load tests
+STUB_TOKEN_DELAY_MS = float(os.getenv("STUB_TOKEN_DELAY_MS", "0"))
+
+
+class InferenceBackend:
+    """
+    Base class: loads a model and tokenizer for one inference engine.
+
+    Every backend returns a model with a transformers-style ``generate`` taking token
+    id tensors, so the inference worker runs all of them the same way.
+    """
+
+    name = None
+    # Whether the inference worker may feed cached preamble keys and values to ``generate``
+    supports_prefix_cache = True
+
+    def load(self, model_name, token=None, cache_dir=None, on_phase=None):
+        """
+        Load a model and its tokenizer.
+
+        Args:
+            model_name (str): Hugging Face model id or local path
+            token (str, optional): Hugging Face token
+            cache_dir (str, optional): Download cache
+            on_phase (callable, optional): Called with the name of each loading phase
+
+        Returns:
+            tuple: (model, tokenizer)
+        """
+        raise NotImplementedError
+
+    def _phase(self, on_phase, phase):
+        if on_phase is not None:
+            on_phase(phase)
+
+
+class TransformersBackend(InferenceBackend):
+    """PyTorch models through ``AutoModelForCausalLM``, sized to the available memory."""
+
+    name = "transformers"
+
+    def load(self, model_name, token=None, cache_dir=None, on_phase=None):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        import torch
+
+        self._phase(on_phase, "loading_tokenizer")
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_name,
+            use_auth_token=token,
+            cache_dir=cache_dir
+        )
+
+        # Check available memory and use appropriate settings
+        self._phase(on_phase, "loading_weights")
+        if MODEL_QUANTIZATION != "none":
+            # Quantized inference runs on CPU, from float32 weights
+            logger.info(f"Loading float32 model on CPU for {MODEL_QUANTIZATION} quantization")
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                use_auth_token=token,
+                cache_dir=cache_dir,
+                device_map="cpu",
+                torch_dtype=torch.float32,
+                low_cpu_mem_usage=True
+            )
+            self._phase(on_phase, "quantizing")
+            model = quantize_model(model, MODEL_QUANTIZATION)
+        else:
+            try:
+                import psutil
+                available_memory_gb = psutil.virtual_memory().available / (1024 ** 3)
+                logger.info(f"Available memory: {available_memory_gb:.2f} GB")
+
+                # If limited memory, use CPU or 8-bit quantization
+                if available_memory_gb < 8:
+                    logger.info("Limited memory detected, using CPU model")
+                    model = AutoModelForCausalLM.from_pretrained(
+                        model_name,
+                        use_auth_token=token,
+                        cache_dir=cache_dir,
+                        device_map="cpu",
+                        low_cpu_mem_usage=True
+                    )
+                else:
+                    # Try to use GPU if available or 8-bit quantization
+                    device = "cuda" if torch.cuda.is_available() else "cpu"
+                    logger.info(f"Using device: {device}")
+
+                    model = AutoModelForCausalLM.from_pretrained(
+                        model_name,
+                        use_auth_token=token,
+                        cache_dir=cache_dir,
+                        device_map="auto",
+                        low_cpu_mem_usage=True
+                    )
+
+            except ImportError:
+                logger.info("psutil not available, using default model loading settings")
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_name,
+                    use_auth_token=token,
+                    cache_dir=cache_dir,
+                    device_map="auto",
+                    low_cpu_mem_usage=True
+                )
+        return model, tokenizer
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    ONNX Runtime on CPU, through ``optimum.onnxruntime``.
+
+    The model is exported to ONNX the first time it is loaded and the graphs are saved
+    under ``ONNX_EXPORT_DIR``; later loads read the exported graphs directly.
+    """
+
+    name = "onnx"
+    # The exported decoder takes its past keys and values in its own layout
+    supports_prefix_cache = False
+
+    def load(self, model_name, token=None, cache_dir=None, on_phase=None):
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError:
+            raise RuntimeError("The onnx backend needs optimum with ONNX Runtime: pip install optimum[onnxruntime]")
+        from transformers import AutoTokenizer
+
+        export_path = os.path.join(ONNX_EXPORT_DIR, model_name.strip("./").replace("/", "--"))
+        self._phase(on_phase, "loading_weights")
+        if os.path.exists(os.path.join(export_path, "config.json")):
+            logger.info(f"Using exported ONNX graphs from {export_path}")
+            model = ORTModelForCausalLM.from_pretrained(export_path, provider="CPUExecutionProvider")
+            tokenizer = AutoTokenizer.from_pretrained(export_path)
+        else:
+            logger.info(f"Exporting {model_name} to ONNX (first load only)...")
+            self._phase(on_phase, "exporting")
+            model = ORTModelForCausalLM.from_pretrained(
+                model_name, export=True, provider="CPUExecutionProvider", use_auth_token=token, cache_dir=cache_dir
+            )
+            tokenizer = AutoTokenizer.from_pretrained(model_name, use_auth_token=token, cache_dir=cache_dir)
+            model.save_pretrained(export_path)
+            tokenizer.save_pretrained(export_path)
+        model.supports_prefix_cache = self.supports_prefix_cache
+        return model, tokenizer
+
+
+class StubBackend(InferenceBackend):
+    """Deterministic local stand-in that needs no weights, for tests and load tests."""
+
+    name = "stub"
+    supports_prefix_cache = False
+
+    def load(self, model_name, token=None, cache_dir=None, on_phase=None):
+        return StubModel(f"stub:{model_name}"), StubTokenizer()
+
+
+class StubTokenizer:
+    """One token per character, returning torch tensors like a transformers tokenizer."""
+
+    pad_token = "\0"
+    eos_token = "\0"
+    pad_token_id = 0
+    eos_token_id = 0
+    padding_side = "left"
+    model_max_length = 8192
+
+    def __call__(self, texts, return_tensors=None, padding=False, **kwargs):
+        import torch
+
+        single = isinstance(texts, str)
+        rows = [self.encode(text) for text in ([texts] if single else texts)]
+        width = max(len(row) for row in rows)
+        # Left padding, as the inference worker sets for batched generation
+        input_ids = [[self.pad_token_id] * (width - len(row)) + row for row in rows]
+        attention_mask = [[0] * (width - len(row)) + [1] * len(row) for row in rows]
+        if return_tensors != "pt":
+            return {"input_ids": input_ids[0] if single else input_ids}
+        return {"input_ids": torch.tensor(input_ids), "attention_mask": torch.tensor(attention_mask)}
+
+    def encode(self, text, **kwargs):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens, skip_special_tokens=False, **kwargs):
+        if hasattr(tokens, "tolist"):
+            tokens = tokens.tolist()
+        return "".join(chr(token) for token in tokens if token or not skip_special_tokens)
+
+
+class StubModel:
+    """
+    Answers every prompt with the code it contains.
+
+    The completion is the last non-empty fenced code block of the prompt (for
+    prompts that end by opening a fence), or else the prompt without its comment
+    lines.
+    """
+
+    supports_prefix_cache = False
+
+    def __init__(self, name_or_path):
+        self.name_or_path = name_or_path
+        self.device = "cpu"
+
+    def generate(self, input_ids=None, attention_mask=None, max_new_tokens=None, pad_token_id=0, **kwargs):
+        import torch
+
+        rows = []
+        for row in input_ids.tolist():
+            prompt = "".join(chr(token) for token in row if token)
+            completion = [ord(char) for char in complete(prompt)][:max_new_tokens]
+            if STUB_TOKEN_DELAY_MS:
+                time.sleep(len(completion) * STUB_TOKEN_DELAY_MS / 1000.0)
+            rows.append(row + completion)
+        width = max(len(row) for row in rows)
+        return torch.tensor([row + [pad_token_id] * (width - len(row)) for row in rows])
+
+
+def complete(prompt):
+    """Deterministic completion used by the stub backend"""
+    blocks = [block.split("```")[0].strip("\n") for block in prompt.split("```python")[1:]]
+    blocks = [block for block in blocks if block.strip()]
+    if blocks:
+        return blocks[-1] + "\n```\n"
+    lines = [line for line in prompt.splitlines() if not line.lstrip().startswith(("#", "```"))]
+    return "\n" + "\n".join(lines).strip("\n") + "\n"
+
+
+BACKENDS = {
+    "transformers": TransformersBackend,
+    "onnx": OnnxBackend,
+    "stub": StubBackend,
+}
+
+
+def get_backend(name=None):
+    """Get an inference backend by name (INFERENCE_BACKEND when omitted)"""
+    name = (name or INFERENCE_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
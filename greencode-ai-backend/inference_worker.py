@@ -0,0 +1,242 @@
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from prefix_cache import PrefixCache
+from metrics import GenerationTimer, record_generation_stop
+from generation_controller import GenerationController
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "25"))
+DEFAULT_MAX_NEW_TOKENS = 500
+
+
+class InferenceWorker:
+    """
+    Owns the model and runs all generation on one thread.
+
+    Concurrent callers submit prompts; the worker collects whatever arrives within
+    ``max_wait_ms`` (up to ``max_batch_size`` prompts), runs them as a single padded
+    batched ``generate`` call and hands each caller its own output. Prompts submitted
+    with a ``prefix`` reuse the cached keys and values of that preamble. With
+    ``stop_on_code_end`` or ``deadline_seconds``, a ``GenerationController`` ends
+    generation once the code is complete or the deadline has passed.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._pending = []
+        self._thread = None
+        self.prefix_cache = PrefixCache(model, tokenizer)
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "generated_tokens": 0,
+            "generate_seconds": 0.0,
+            "batch_sizes": {},
+            "queue_wait_seconds": 0.0,
+            "stop_reasons": {},
+            "saved_tokens": 0,
+        }
+
+        # Batched generation of decoder-only models needs left padding
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+    def start(self):
+        """Start the worker thread if it is not running yet."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, prompt, max_new_tokens=DEFAULT_MAX_NEW_TOKENS, temperature=0.2, do_sample=True, prefix=None,
+               stop_on_code_end=False, deadline_seconds=None):
+        """Queue a prompt and return a Future resolving to the full generated text (prompt included)."""
+        self.start()
+        future = Future()
+        self._queue.put({
+            "prompt": prompt,
+            "max_new_tokens": max_new_tokens,
+            "prefix": prefix,
+            "sampling": (bool(do_sample), float(temperature) if do_sample else None),
+            "stop_on_code_end": stop_on_code_end,
+            "deadline": time.time() + deadline_seconds if deadline_seconds else None,
+            "future": future,
+            "enqueued_at": time.time(),
+        })
+        return future
+
+    def generate(self, prompt, timeout=None, **kwargs):
+        """Submit a prompt and wait for its generated text."""
+        return self.submit(prompt, **kwargs).result(timeout=timeout)
+
+    def stats(self):
+        """Return throughput and batch-size statistics."""
+        with self._lock:
+            stats = dict(self._stats, batch_sizes=dict(self._stats["batch_sizes"]),
+                         stop_reasons=dict(self._stats["stop_reasons"]))
+        stats["tokens_per_second"] = (
+            round(stats["generated_tokens"] / stats["generate_seconds"], 2) if stats["generate_seconds"] else 0.0
+        )
+        stats["average_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize() + len(self._pending)
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_wait_ms"] = self.max_wait * 1000
+        stats["prefix_cache"] = self.prefix_cache.stats()
+        return stats
+
+    def _next_request(self, timeout=None):
+        if self._pending:
+            return self._pending.pop(0)
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _collect_batch(self):
+        """Block for one request, then gather compatible ones until the batch is full or the window closes."""
+        first = self._next_request()
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        deferred = []
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self._next_request(timeout=remaining)
+            except queue.Empty:
+                break
+            # Requests are only batched with others using the same sampling settings, preamble and stop rule
+            if (request["sampling"] == first["sampling"] and request["prefix"] == first["prefix"]
+                    and request["stop_on_code_end"] == first["stop_on_code_end"]):
+                batch.append(request)
+            else:
+                deferred.append(request)
+        self._pending = deferred + self._pending
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [r for r in self._collect_batch() if r["future"].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self._generate_batch(batch)
+            except Exception as e:
+                logger.error(f"Error in batched generation: {str(e)}")
+                for request in batch:
+                    request["future"].set_exception(e)
+                continue
+            for request, output in zip(batch, outputs):
+                request["future"].set_result(output)
+
+    def _generate_batch(self, batch):
+        import torch
+
+        start_time = time.time()
+        prompts = [request["prompt"] for request in batch]
+        # Reuse the preamble's keys and values when there is one and the backend can take them
+        use_prefix = batch[0]["prefix"] and getattr(self.model, "supports_prefix_cache", True)
+        inputs = self.prefix_cache.prepare(prompts, batch[0]["prefix"]) if use_prefix else None
+        if inputs is None:
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        input_length = inputs["input_ids"].shape[1]
+
+        # Token budget: the largest request in the batch, capped by the context window
+        max_new_tokens = max(request["max_new_tokens"] for request in batch)
+        max_new_tokens = max(1, min(max_new_tokens, self.tokenizer.model_max_length - input_length - 10))
+
+        do_sample, temperature = batch[0]["sampling"]
+        generate_kwargs = {"do_sample": do_sample}
+        if do_sample:
+            generate_kwargs["temperature"] = temperature
+
+        # Stops once every sequence's code is complete or the earliest deadline has passed
+        deadlines = [request["deadline"] for request in batch if request["deadline"] is not None]
+        controller = None
+        if batch[0]["stop_on_code_end"] or deadlines:
+            controller = GenerationController(
+                self.tokenizer, prompts,
+                max_new_tokens=max_new_tokens,
+                stop_on_code_end=batch[0]["stop_on_code_end"],
+                deadline=min(deadlines) if deadlines else None,
+                prompt_length=input_length
+            )
+            generate_kwargs["stopping_criteria"] = [controller]
+
+        # Records prefill and decode time for /metrics
+        timer = GenerationTimer()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                logits_processor=[timer],
+                **generate_kwargs
+            )
+
+        texts = []
+        generated_tokens = 0
+        for index, (request, prompt, row) in enumerate(zip(batch, prompts, outputs)):
+            new_tokens = row[input_length:input_length + request["max_new_tokens"]].tolist()
+            # Drop padding after the sequence finished
+            if self.tokenizer.eos_token_id in new_tokens:
+                new_tokens = new_tokens[:new_tokens.index(self.tokenizer.eos_token_id)]
+            generated_tokens += len(new_tokens)
+            completion = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+            if controller is not None:
+                completion, report = controller.finish(index, completion)
+                self._record_stop(request, report)
+            texts.append(prompt + completion)
+        timer.observe(generated_tokens)
+
+        now = time.time()
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["generated_tokens"] += generated_tokens
+            self._stats["generate_seconds"] += now - start_time
+            self._stats["batch_sizes"][len(batch)] = self._stats["batch_sizes"].get(len(batch), 0) + 1
+            self._stats["queue_wait_seconds"] += sum(start_time - r["enqueued_at"] for r in batch)
+        return texts
+
+    def _record_stop(self, request, report):
+        # Each request has its own budget, while the batch generated up to the largest one
+        saved_tokens = 0
+        if report["stop_reason"] == "code_end":
+            saved_tokens = max(0, request["max_new_tokens"] - report["new_tokens"])
+        record_generation_stop(report["stop_reason"], saved_tokens)
+        with self._lock:
+            reasons = self._stats["stop_reasons"]
+            reasons[report["stop_reason"]] = reasons.get(report["stop_reason"], 0) + 1
+            self._stats["saved_tokens"] += saved_tokens
+
+
+# Worker for the model loaded by model_loader, created on first use
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_inference_worker():
+    """Return the shared inference worker, or None if no model is loaded."""
+    global _worker
+    import model_loader
+
+    if model_loader.model is None or model_loader.tokenizer is None:
+        return None
+    with _worker_lock:
+        if _worker is None or _worker.model is not model_loader.model:
+            _worker = InferenceWorker(model_loader.model, model_loader.tokenizer).start()
+        return _worker
@@ -1,99 +1,124 @@
 import os
 import logging
+import threading
+import time
 import traceback
+from metrics import record_model_loaded, record_model_memory
+from inference_backends import INFERENCE_BACKEND, get_backend
+from quantization import model_memory_bytes, model_quantization
 
 logger = logging.getLogger(__name__)
 
 # Constants
 HUGGINGFACE_TOKEN = os.getenv("HUGGINGFACE_TOKEN", "")
 LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "./models")
-MODEL_NAME = "bigcode/starcoderbase-1b"  # Smaller model that works with limited RAM
+# Smaller model that works with limited RAM; with MODEL_QUANTIZATION=int8 the 3b model fits where the 1b did
+MODEL_NAME = os.getenv("MODEL_NAME", "bigcode/starcoderbase-1b")
 
 # Global variables for the model
 model = None
 tokenizer = None
 transformers_available = False
 
+# Progress of the background load, reported by /health/ready
+load_status = {"state": "not_started", "phase": None, "error": None, "started_at": None, "finished_at": None}
+_load_thread = None
+_load_lock = threading.Lock()
+
 # Try to import transformers
 try:
-    from transformers import AutoModelForCausalLM, AutoTokenizer
+    import transformers
     import torch
     transformers_available = True
 except ImportError:
     logger.warning("Transformers library not available. Install with: pip install transformers")
 
 def load_local_model():
-    """Load the smaller StarCoder model with memory optimizations"""
+    """Load the StarCoder model with the configured inference backend"""
     global model, tokenizer
     
-    if not transformers_available:
+    backend = get_backend()
+    # The stub needs only torch; the other backends need transformers
+    if backend.name != "stub" and not transformers_available:
         logger.error("Transformers library not available. Cannot load model.")
         return False
     
     try:
-        logger.info(f"Loading model {MODEL_NAME}...")
+        logger.info(f"Loading model {MODEL_NAME} with the {backend.name} backend...")
+        start_time = time.time()
         
-        # Load tokenizer and model
-        tokenizer = AutoTokenizer.from_pretrained(
-            MODEL_NAME, 
-            use_auth_token=HUGGINGFACE_TOKEN,
-            cache_dir=LOCAL_MODEL_PATH
+        # Load tokenizer and model. They are only published once both are loaded,
+        # so requests never see a half-loaded model.
+        loaded_model, loaded_tokenizer = backend.load(
+            MODEL_NAME,
+            token=HUGGINGFACE_TOKEN,
+            cache_dir=LOCAL_MODEL_PATH,
+            on_phase=lambda phase: load_status.update(phase=phase)
         )
         
-        # Check available memory and use appropriate settings
-        try:
-            import psutil
-            available_memory_gb = psutil.virtual_memory().available / (1024 ** 3)
-            logger.info(f"Available memory: {available_memory_gb:.2f} GB")
-            
-            # If limited memory, use CPU or 8-bit quantization
-            if available_memory_gb < 8:
-                logger.info("Limited memory detected, using CPU model")
-                model = AutoModelForCausalLM.from_pretrained(
-                    MODEL_NAME,
-                    use_auth_token=HUGGINGFACE_TOKEN,
-                    cache_dir=LOCAL_MODEL_PATH,
-                    device_map="cpu",
-                    low_cpu_mem_usage=True
-                )
-            else:
-                # Try to use GPU if available or 8-bit quantization 
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-                logger.info(f"Using device: {device}")
-                
-                model = AutoModelForCausalLM.from_pretrained(
-                    MODEL_NAME,
-                    use_auth_token=HUGGINGFACE_TOKEN,
-                    cache_dir=LOCAL_MODEL_PATH,
-                    device_map="auto",
-                    low_cpu_mem_usage=True
-                )
-                
-        except ImportError:
-            logger.info("psutil not available, using default model loading settings")
-            model = AutoModelForCausalLM.from_pretrained(
-                MODEL_NAME,
-                use_auth_token=HUGGINGFACE_TOKEN,
-                cache_dir=LOCAL_MODEL_PATH,
-                device_map="auto",
-                low_cpu_mem_usage=True
-            )
-        
+        tokenizer = loaded_tokenizer
+        model = loaded_model
+        record_model_loaded(MODEL_NAME, time.time() - start_time)
+        load_status["backend"] = backend.name
+        load_status["quantization"] = model_quantization(loaded_model)
+        load_status["memory_bytes"] = model_memory_bytes(loaded_model)
+        record_model_memory(MODEL_NAME, load_status["memory_bytes"], load_status["quantization"])
         logger.info("Model loaded successfully!")
         return True
         
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
         logger.error(traceback.format_exc())
+        load_status["error"] = str(e)
         model = None
         tokenizer = None
         logger.warning("Failed to load model. Continuing with rule-based optimization only.")
         return False
 
-# Try to load the model if imports succeeded
-if transformers_available and HUGGINGFACE_TOKEN:
+def _load_in_background():
+    """Run load_local_model on the loading thread and record the outcome"""
     try:
-        load_local_model()
+        loaded = load_local_model()
+        if loaded:
+            # Start the inference worker before reporting ready
+            load_status["phase"] = "warming_up"
+            from inference_worker import get_inference_worker
+            get_inference_worker()
     except Exception as e:
-        logger.error(f"Error during initial model loading: {str(e)}")
-        logger.error(traceback.format_exc())
\ No newline at end of file
+        logger.error(f"Error during background model loading: {str(e)}")
+        logger.error(traceback.format_exc())
+        loaded = False
+    load_status["finished_at"] = time.time()
+    if not loaded:
+        load_status["error"] = load_status["error"] or "Model failed to load"
+    load_status["state"] = load_status["phase"] = "ready" if loaded else "failed"
+
+def start_background_loading():
+    """Start loading the model on a daemon thread, unless it is already loading or loaded"""
+    global _load_thread
+    with _load_lock:
+        if load_status["state"] in ("loading", "ready"):
+            return False
+        load_status.update(state="loading", phase="starting", error=None, started_at=time.time(), finished_at=None)
+        _load_thread = threading.Thread(target=_load_in_background, name="model-loader", daemon=True)
+        _load_thread.start()
+        return True
+
+def get_load_status():
+    """Return the state, phase and elapsed seconds of the model load"""
+    status = dict(load_status)
+    if status["started_at"] is not None:
+        status["elapsed_seconds"] = round((status.pop("finished_at") or time.time()) - status.pop("started_at"), 2)
+    else:
+        status.pop("started_at")
+        status.pop("finished_at")
+    return status
+
+def is_model_ready():
+    """Whether the model is loaded and its inference worker is running"""
+    return load_status["state"] == "ready"
+
+# Start loading the model in the background if imports succeeded. The server
+# starts right away and uses rule-based optimization until the model is ready.
+if INFERENCE_BACKEND == "stub" or (transformers_available and HUGGINGFACE_TOKEN):
+    start_background_loading()
\ No newline at end of file
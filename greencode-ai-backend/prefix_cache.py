@@ -0,0 +1,183 @@
+import copy
+import os
+import time
+from collections import OrderedDict
+from metrics import record_cache_lookup
+
+# Constants
+PREFIX_CACHE_SIZE = int(os.getenv("PREFIX_CACHE_SIZE", "8"))
+
+
+class PrefixCache:
+    """
+    Encodes each prompt preamble once and reuses its ``past_key_values``.
+
+    Prompts built from the same template share a long instruction preamble. Only
+    the part after the preamble (the user's code) needs to be prefilled per request.
+    The cache is not thread-safe; it is meant to be owned by an inference worker.
+    """
+
+    def __init__(self, model, tokenizer, max_entries=PREFIX_CACHE_SIZE):
+        """
+        Initialize the prefix cache.
+
+        Args:
+            model: Causal language model
+            tokenizer: Tokenizer for ``model``
+            max_entries (int): Number of preambles kept
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "reused_tokens": 0,
+                       "shared_tokens": 0, "boundary_mismatches": 0, "prefill_seconds": 0.0}
+
+    def get(self, prefix):
+        """
+        Get the token ids and key/value cache for a preamble, encoding it on first use.
+
+        Args:
+            prefix (str): Prompt preamble
+
+        Returns:
+            tuple: (input_ids tensor of shape (1, prefix_length), past_key_values)
+        """
+        import torch
+
+        entry = self._entries.get(prefix)
+        if entry is not None:
+            self._entries.move_to_end(prefix)
+            self._stats["hits"] += 1
+            record_cache_lookup("prefix", True)
+            return entry
+
+        self._stats["misses"] += 1
+        record_cache_lookup("prefix", False)
+        start_time = time.time()
+        input_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+        with torch.no_grad():
+            past_key_values = self.model(input_ids, use_cache=True).past_key_values
+        self._stats["prefill_seconds"] += time.time() - start_time
+
+        entry = (input_ids, past_key_values)
+        self._entries[prefix] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+        return entry
+
+    def prepare(self, prompts, prefix):
+        """
+        Build ``generate`` inputs for prompts starting with ``prefix``, reusing its cache.
+
+        Tokens shared by all the prompts after the preamble (e.g. the same code with
+        different instructions) are prefilled once for the whole batch. The remaining
+        tokens are left-padded and prefilled on top, except for their last token,
+        which ``generate`` feeds itself.
+
+        Args:
+            prompts (list): Prompts that all start with ``prefix``
+            prefix (str): Shared preamble
+
+        Returns:
+            dict or None: ``input_ids``, ``attention_mask`` and ``past_key_values`` for
+            ``model.generate``, or None if a prompt's tokens do not start with the preamble's
+        """
+        if not prefix or not all(prompt.startswith(prefix) and len(prompt) > len(prefix) for prompt in prompts):
+            return None
+        split = _split_prompt_ids(self.tokenizer, prompts, prefix)
+        if split is None:
+            self._stats["boundary_mismatches"] += 1
+            return None
+
+        import torch
+
+        _, stem, rests = split
+        prefix_ids, past_key_values = self.get(prefix)
+        batch_size = len(prompts)
+        self._stats["reused_tokens"] += prefix_ids.shape[1] * batch_size
+
+        if stem:
+            stem_ids = torch.tensor([stem], device=self.model.device)
+            with torch.no_grad():
+                past_key_values = self.model(
+                    stem_ids,
+                    past_key_values=_repeat_batch(past_key_values, 1),
+                    use_cache=True,
+                ).past_key_values
+            prefix_ids = torch.cat([prefix_ids, stem_ids], dim=1)
+            self._stats["shared_tokens"] += len(stem) * (batch_size - 1)
+
+        width = max(len(rest) for rest in rests)
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else 0
+        suffix_ids = torch.tensor(
+            [[pad_token_id] * (width - len(rest)) + rest for rest in rests], device=self.model.device
+        )
+        suffix_mask = torch.tensor(
+            [[0] * (width - len(rest)) + [1] * len(rest) for rest in rests], device=self.model.device
+        )
+
+        input_ids = torch.cat([prefix_ids.expand(batch_size, -1), suffix_ids], dim=1)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids).expand(batch_size, -1), suffix_mask], dim=1)
+        # Padding sits between the shared text and the rest, so positions come from the mask
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+
+        past_key_values = _repeat_batch(past_key_values, batch_size)
+        prefix_length = prefix_ids.shape[1]
+        if suffix_ids.shape[1] > 1:
+            with torch.no_grad():
+                past_key_values = self.model(
+                    suffix_ids[:, :-1],
+                    past_key_values=past_key_values,
+                    attention_mask=attention_mask[:, :-1],
+                    position_ids=position_ids[:, prefix_length:-1],
+                    use_cache=True,
+                ).past_key_values
+
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "past_key_values": past_key_values}
+
+    def stats(self):
+        """Return cache counters."""
+        return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+
+def _split_prompt_ids(tokenizer, prompts, prefix):
+    """
+    Token ids of each whole prompt, split into the preamble, a shared stem and the rest.
+
+    Tokenizing the preamble and the rest of a prompt separately can merge tokens
+    differently at the boundary, so each prompt is tokenized whole. The cached
+    preamble is only reused when every prompt's ids start with the preamble's ids.
+
+    Returns:
+        tuple: (preamble ids, ids every prompt has next, remaining ids of each prompt),
+        or None when a prompt's ids don't start with the preamble's
+    """
+    prefix_ids = list(tokenizer(prefix)["input_ids"])
+    prompt_ids = [list(ids) for ids in tokenizer(list(prompts))["input_ids"]]
+    prefix_length = len(prefix_ids)
+    if any(ids[:prefix_length] != prefix_ids or len(ids) == prefix_length for ids in prompt_ids):
+        return None
+    rests = [ids[prefix_length:] for ids in prompt_ids]
+
+    # Leave every prompt at least one token of its own
+    stem_length = 0
+    if len(rests) > 1:
+        limit = min(len(rest) for rest in rests) - 1
+        while stem_length < limit and all(rest[stem_length] == rests[0][stem_length] for rest in rests):
+            stem_length += 1
+    return prefix_ids, rests[0][:stem_length], [rest[stem_length:] for rest in rests]
+
+
+def _repeat_batch(past_key_values, batch_size):
+    """Copy a batch-of-one key/value cache so it can be extended by ``batch_size`` sequences."""
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        # Cache objects are updated in place by the model
+        past_key_values = copy.deepcopy(past_key_values)
+        past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+    if isinstance(past_key_values, (tuple, list)):
+        return type(past_key_values)(_repeat_batch(item, batch_size) for item in past_key_values)
+    return past_key_values.repeat(batch_size, *([1] * (past_key_values.dim() - 1)))
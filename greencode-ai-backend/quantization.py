@@ -0,0 +1,108 @@
+import os
+
+# Constants
+# "int8" stores the weights of every Linear layer as int8 and quantizes activations
+# on the fly; "none" keeps the model in float32
+MODEL_QUANTIZATION = os.getenv("MODEL_QUANTIZATION", "none").lower()
+QUANTIZATION_MODES = ("none", "int8")
+
+
+def quantize_model(model, mode=MODEL_QUANTIZATION):
+    """
+    Apply dynamic quantization to a model loaded on CPU.
+
+    The Linear layers are swapped in place, so no second copy of the weights is
+    made. Embeddings and layer norms stay in float32.
+
+    Args:
+        model: torch causal language model on CPU
+        mode (str): One of ``QUANTIZATION_MODES``
+
+    Returns:
+        The quantized model (the same object when ``mode`` is ``"none"``)
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode {mode!r}, expected one of {', '.join(QUANTIZATION_MODES)}")
+    if mode == "none" or model_quantization(model) == mode:
+        return model
+
+    import torch
+
+    if any(parameter.device.type != "cpu" for parameter in model.parameters()):
+        raise ValueError("Dynamic int8 quantization only runs on CPU; load the model with device_map='cpu'")
+    # Quantized kernels need float32 inputs and weights
+    model = model.float().eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def model_quantization(model):
+    """Return ``"int8"`` if the model has dynamically quantized layers, otherwise ``"none"``."""
+    modules = getattr(model, "modules", None)
+    if modules is None:
+        return "none"
+    for module in modules():
+        if module._get_name() == "DynamicQuantizedLinear":
+            return "int8"
+    return "none"
+
+
+def model_memory_bytes(model):
+    """
+    Bytes held by a model's weights and buffers, including packed int8 weights.
+
+    Tied weights are counted once. Returns None for objects that are not torch modules.
+    """
+    state_dict = getattr(model, "state_dict", None)
+    if state_dict is None:
+        return None
+    seen = set()
+    return sum(_tensor_bytes(value, seen) for value in state_dict().values())
+
+
+def _tensor_bytes(value, seen):
+    if isinstance(value, (tuple, list)):
+        # Packed parameters of quantized layers are (weight, bias) tuples
+        return sum(_tensor_bytes(item, seen) for item in value)
+    if not hasattr(value, "numel") or not hasattr(value, "element_size"):
+        return 0
+    key = (value.data_ptr(), value.numel())
+    if key in seen:
+        return 0
+    seen.add(key)
+    return value.numel() * value.element_size()
+
+
+def parity_metrics(reference, candidate):
+    """
+    Compare generations of a quantized model with its float32 reference.
+
+    Args:
+        reference (list): Token id lists generated by the reference model, one per prompt
+        candidate (list): Token id lists generated by the quantized model for the same prompts
+
+    Returns:
+        dict: ``exact_match`` (share of identical generations), ``prefix_agreement``
+        (mean share of reference tokens before the first difference) and
+        ``token_agreement`` (mean share of positions holding the same token)
+    """
+    if not reference:
+        return {"prompts": 0, "exact_match": None, "prefix_agreement": None, "token_agreement": None}
+    exact, prefix, agreement = 0, 0.0, 0.0
+    for expected, actual in zip(reference, candidate):
+        expected, actual = list(expected), list(actual)
+        exact += expected == actual
+        length = max(len(expected), len(actual)) or 1
+        common = 0
+        for a, b in zip(expected, actual):
+            if a != b:
+                break
+            common += 1
+        prefix += common / length
+        agreement += sum(a == b for a, b in zip(expected, actual)) / length
+    count = len(reference)
+    return {
+        "prompts": count,
+        "exact_match": round(exact / count, 3),
+        "prefix_agreement": round(prefix / count, 3),
+        "token_agreement": round(agreement / count, 3),
+    }
@@ -0,0 +1,377 @@
+import atexit
+import builtins
+from array import array
+from collections import OrderedDict
+import io
+import json
+import logging
+import math
+import os
+import pickle
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+logger = logging.getLogger(__name__)
+
+# Constants
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "10"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "10"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "1024"))
+SANDBOX_MAX_RUNS = int(os.getenv("SANDBOX_MAX_RUNS", "50"))
+MAX_CAPTURED_OUTPUT = 10000
+# Decoded datasets each worker keeps between runs
+WORKER_DATASET_CACHE = 16
+
+# Imported once per worker so the first run doesn't pay for them
+PREWARM_MODULES = ("math", "collections", "itertools", "functools", "json", "re")
+# Fields of the outcome a worker sends back for each run
+OUTCOME_KEYS = frozenset(("status", "error", "wall_time", "cpu_time", "max_rss_kb", "stdout", "result"))
+
+
+def _load_dataset(path, fmt):
+    """Decode a dataset file written by the input generator into its compact in-memory form."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if fmt in ("q", "d"):
+        values = array(fmt)
+        values.frombytes(data)
+        return values
+    if fmt == "str":
+        return data.decode("utf-8")
+    if fmt == "lines":
+        return data.decode("utf-8").split("\n") if data else []
+    return pickle.loads(data)
+
+
+def _worker_main(reader, writer, cpu_seconds, memory_mb):
+    """Worker process loop: receive code, run it under limits, send back the outcome."""
+    import resource
+
+    for name in PREWARM_MODULES:
+        __import__(name)
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    datasets = OrderedDict()
+
+    while True:
+        try:
+            message = reader.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        code, allowed_builtins, inputs, dataset_files = message
+
+        # The CPU limit is cumulative for the process, so move it forward for each run.
+        # Exceeding it sends SIGXCPU, which kills the worker.
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_before = usage.ru_utime + usage.ru_stime
+        if cpu_seconds:
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+            soft = math.ceil(cpu_before + cpu_seconds)
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+        if allowed_builtins is None:
+            namespace = {"__name__": "__sandbox__"}
+        else:
+            namespace = {"__builtins__": {name: getattr(builtins, name) for name in allowed_builtins}}
+        namespace.update(inputs or {})
+
+        stdout = io.StringIO()
+        status, error = "ok", None
+        real_stdout = sys.stdout
+        sys.stdout = stdout
+        start_time = time.perf_counter()
+        exec_cpu = cpu_before
+        try:
+            # Datasets are read from their files once and reused by later runs
+            for name, (path, fmt) in (dataset_files or {}).items():
+                if path not in datasets:
+                    datasets[path] = _load_dataset(path, fmt)
+                    if len(datasets) > WORKER_DATASET_CACHE:
+                        datasets.popitem(last=False)
+                datasets.move_to_end(path)
+                namespace[name] = datasets[path]
+            compiled = compile(code, "<sandbox>", "exec")
+            # Time and CPU are counted around the code only, not the dataset loading
+            start_time = time.perf_counter()
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            exec_cpu = usage.ru_utime + usage.ru_stime
+            exec(compiled, namespace)
+        except MemoryError:
+            status, error = "memory_limit", "Memory limit exceeded"
+        except BaseException as e:
+            status, error = "error", f"{type(e).__name__}: {e}"
+        finally:
+            wall_time = time.perf_counter() - start_time
+            sys.stdout = real_stdout
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        writer.send_bytes(_encode_outcome({
+            "status": status,
+            "error": error,
+            "wall_time": wall_time,
+            "cpu_time": usage.ru_utime + usage.ru_stime - exec_cpu,
+            "max_rss_kb": usage.ru_maxrss,
+            "stdout": stdout.getvalue()[:MAX_CAPTURED_OUTPUT],
+            # Code can hand back data by assigning it to __result__
+            "result": namespace.get("__result__"),
+        }))
+
+
+def _encode_outcome(outcome):
+    """Serialize a run's outcome as JSON; a result that isn't plain data is sent as its repr."""
+    try:
+        return json.dumps(outcome).encode("utf-8")
+    except Exception:
+        pass
+    try:
+        outcome["result"] = str.__str__(repr(outcome["result"]))[:MAX_CAPTURED_OUTPUT]
+    except Exception:
+        outcome["result"] = None
+    return json.dumps(outcome).encode("utf-8")
+
+
+def _decode_outcome(data):
+    """
+    Parse an outcome sent by a worker.
+
+    Workers run untrusted code that can write to the pipe, so their messages are
+    only ever parsed as JSON, never unpickled.
+
+    Raises:
+        ValueError: If the message is not a JSON outcome
+    """
+    outcome = json.loads(data.decode("utf-8"))
+    if not isinstance(outcome, dict) or not OUTCOME_KEYS <= outcome.keys() or not isinstance(outcome["status"], str):
+        raise ValueError("Malformed outcome")
+    return {key: outcome[key] for key in OUTCOME_KEYS}
+
+
+class _Worker:
+    """Handle on one worker process and the parent's ends of its pipes."""
+
+    def __init__(self, cpu_seconds, memory_mb):
+        parent_read, child_write = os.pipe()
+        child_read, parent_write = os.pipe()
+        # A fresh interpreter in isolated mode: nothing from the server process
+        # (threads, loaded models, environment) leaks into the worker
+        self.process = subprocess.Popen(
+            [sys.executable, "-I", os.path.abspath(__file__),
+             str(child_read), str(child_write), str(cpu_seconds), str(memory_mb)],
+            pass_fds=(child_read, child_write),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        os.close(child_read)
+        os.close(child_write)
+        self.reader = Connection(parent_read, writable=False)
+        self.writer = Connection(parent_write, readable=False)
+        self.runs = 0
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(1)
+        except Exception:
+            pass
+        self._close_pipes()
+
+    def close(self):
+        try:
+            self.writer.send(None)
+            self.process.wait(1)
+        except Exception:
+            self.kill()
+        self._close_pipes()
+
+    def _close_pipes(self):
+        for conn in (self.reader, self.writer):
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+
+class SandboxPool:
+    """
+    Runs untrusted code in a pool of long-lived worker processes.
+
+    Workers are separate interpreters started ahead of time, so a run doesn't pay
+    for interpreter startup.
+    Each run is limited in CPU seconds and address space, and killed after a wall-clock
+    timeout. Code travels to the workers over pipes and results come back as JSON,
+    so nothing a worker sends is ever unpickled. A worker is replaced after
+    ``max_runs`` runs, or as soon as it dies or times out.
+    """
+
+    def __init__(self, size=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT, cpu_seconds=SANDBOX_CPU_SECONDS,
+                 memory_mb=SANDBOX_MEMORY_MB, max_runs=SANDBOX_MAX_RUNS):
+        """
+        Initialize the pool. Workers are started on first use.
+
+        Args:
+            size (int): Number of worker processes
+            timeout (float): Wall-clock seconds before a run is killed
+            cpu_seconds (int): CPU seconds allowed per run
+            memory_mb (int): Address space limit of each worker in MB (0 for no limit)
+            max_runs (int): Runs before a worker is recycled
+        """
+        self.size = size
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_runs = max_runs
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {"runs": 0, "timeouts": 0, "cpu_limits": 0, "memory_limits": 0, "crashes": 0, "recycled": 0}
+
+    def start(self):
+        """Start the worker processes if they are not running yet."""
+        with self._lock:
+            if self._started:
+                return self
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._started = True
+        return self
+
+    def run(self, code, allowed_builtins=None, inputs=None, timeout=None, datasets=None, meter=None):
+        """
+        Execute code in a worker.
+
+        Args:
+            code (str): Source to execute
+            allowed_builtins (iterable, optional): Names of the only builtins the code may
+                use. All builtins are available when None.
+            inputs (dict, optional): Picklable globals made available to the code
+            timeout (float, optional): Wall-clock limit, defaults to the pool's
+            datasets (dict, optional): Global name to ``(path, format)`` of dataset files.
+                Workers read each file once and keep the compact value for later runs,
+                so large inputs are not pickled with every run.
+            meter (EnergyMeter, optional): Meter read once a worker is free and again when
+                its outcome arrives, so time spent waiting for a worker is not counted
+
+        Returns:
+            dict: ``status`` (ok, error, timeout, cpu_limit, memory_limit or crashed), ``error``,
+            ``wall_time`` and ``cpu_time`` of the code itself (measured by the worker),
+            ``max_rss_kb``, captured ``stdout``, the ``result`` the code assigned to ``__result__``
+            as JSON data (tuples become lists) or its repr, and ``energy_joules`` read from
+            ``meter``. Meters are machine-wide, so that reading is an upper bound that also
+            covers the pipe transfer and anything else running at the same time.
+        """
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        allowed = None if allowed_builtins is None else tuple(allowed_builtins)
+        worker = self._idle.get()
+        replace = False
+        start_reading = end_reading = None
+        try:
+            worker.runs += 1
+            if meter:
+                start_reading = meter.read()
+            worker.writer.send((code, allowed, inputs, datasets))
+            if worker.reader.poll(timeout):
+                try:
+                    data = worker.reader.recv_bytes()
+                    if meter:
+                        end_reading = meter.read()
+                    result = _decode_outcome(data)
+                except EOFError:
+                    result = self._died(worker)
+                    replace = True
+                except ValueError:
+                    result = self._failure("crashed", "Worker sent a malformed outcome")
+                    replace = True
+            else:
+                result = self._failure("timeout", f"Execution exceeded {timeout} seconds")
+                replace = True
+        except (OSError, EOFError) as e:
+            result = self._failure("crashed", f"Worker failed: {e}")
+            replace = True
+        finally:
+            # Hand back a working process even if something above went wrong
+            if replace or worker.runs >= self.max_runs or not worker.is_alive():
+                self._replace(worker, recycled=not replace)
+            else:
+                self._idle.put(worker)
+        result["energy_joules"] = meter.joules(start_reading, end_reading) if end_reading is not None else None
+
+        with self._lock:
+            self._stats["runs"] += 1
+            key = {"timeout": "timeouts", "cpu_limit": "cpu_limits", "memory_limit": "memory_limits",
+                   "crashed": "crashes"}.get(result["status"])
+            if key:
+                self._stats[key] += 1
+        return result
+
+    def stats(self):
+        """Return run and limit counters."""
+        with self._lock:
+            return dict(self._stats, workers=self.size if self._started else 0, idle=self._idle.qsize())
+
+    def shutdown(self):
+        """Stop all idle workers."""
+        with self._lock:
+            self._started = False
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _spawn(self):
+        return _Worker(self.cpu_seconds, self.memory_mb)
+
+    def _replace(self, worker, recycled):
+        if recycled:
+            worker.close()
+            with self._lock:
+                self._stats["recycled"] += 1
+        else:
+            worker.kill()
+        try:
+            self._idle.put(self._spawn())
+        except Exception as e:
+            logger.error(f"Error starting sandbox worker: {str(e)}")
+            with self._lock:
+                self.size -= 1
+
+    def _died(self, worker):
+        try:
+            returncode = worker.process.wait(1)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        if returncode == -signal.SIGXCPU:
+            return self._failure("cpu_limit", f"CPU limit of {self.cpu_seconds} seconds exceeded")
+        return self._failure("crashed", f"Worker exited with code {returncode}")
+
+    @staticmethod
+    def _failure(status, error):
+        return {"status": status, "error": error, "wall_time": None, "cpu_time": None, "max_rss_kb": None,
+                "stdout": "", "result": None}
+
+
+# Shared pool for the whole process
+sandbox_pool = SandboxPool()
+atexit.register(sandbox_pool.shutdown)
+
+
+if __name__ == "__main__":
+    # Entry point of a worker process started by SandboxPool
+    _read_fd, _write_fd, _cpu_seconds, _memory_mb = (int(arg) for arg in sys.argv[1:5])
+    _worker_main(Connection(_read_fd, writable=False), Connection(_write_fd, readable=False), _cpu_seconds, _memory_mb)
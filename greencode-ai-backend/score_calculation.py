@@ -1,7 +1,5 @@
 import re
 import logging
-from model_loader import model, tokenizer
-from code_optimization import generate_code_with_model
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +46,7 @@ def calculate_green_score(code, optimized, inefficiencies):
         "improvement": optimized_score - original_score
     }
 
-def generate_code_variants(original_code, optimized_code):
+def generate_code_variants(original_code, optimized_code, fast_code=None):
     """Generate different optimization variants for speed vs energy efficiency"""
     
     # Default values if we can't generate proper variants
@@ -66,27 +64,9 @@ def generate_code_variants(original_code, optimized_code):
         "energy": 60 if original_code != optimized_code else 70.0
     }
     
-    # Try to use the model to generate proper variants if available
-    if model is not None and tokenizer is not None:
-        try:
-            # Try to generate a speed-optimized version
-            speed_prompt = f"""
-            # Original code:
-            ```python
-            {original_code}
-            ```
-            
-            # Task: Optimize the above code for maximum SPEED, regardless of energy consumption.
-            
-            # Speed-optimized code:
-            ```python
-            """
-            
-            fast_code = generate_code_with_model(original_code, speed_prompt)
-            if fast_code and fast_code != original_code:
-                fast_version["code"] = fast_code
-        except Exception as e:
-            logger.warning(f"Error generating speed variant: {str(e)}")
+    # Use the model-generated speed variant if there is one
+    if fast_code and fast_code != original_code:
+        fast_version["code"] = fast_code
     
     # Determine which version to recommend
     if original_code == optimized_code:
@@ -0,0 +1,124 @@
+import unittest
+from concurrent.futures import Future
+
+import code_optimization
+import model_loader
+from code_optimization import VARIANT_PROMPT_TEMPLATE, generate_variants_with_model
+from energy_meter import cpu_seconds_to_joules
+from energy_measurement import measure_energy_consumption
+from prefix_cache import _split_prompt_ids
+from sandbox import sandbox_pool
+from score_calculation import generate_code_variants
+
+
+class CharTokenizer:
+    """One token per character."""
+
+    pad_token_id = 0
+
+    def __call__(self, text, **kwargs):
+        if isinstance(text, list):
+            return {"input_ids": [self(item)["input_ids"] for item in text]}
+        return {"input_ids": [ord(char) for char in text]}
+
+
+class FakeWorker:
+    """Inference worker that completes each prompt with a fixed answer per task."""
+
+    tokenizer = CharTokenizer()
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.submitted = []
+
+    def submit(self, prompt, **kwargs):
+        self.submitted.append((prompt, kwargs))
+        answer = next(answer for task, answer in self.answers.items() if task in prompt)
+        future = Future()
+        future.set_result(prompt + answer + "\n```\n# trailing text")
+        return future
+
+
+class VariantGenerationTests(unittest.TestCase):
+
+    code = "def f(items):\n    return {x: x * 2 for x in items}\n"
+
+    def setUp(self):
+        self.worker = FakeWorker({"energy efficiency": "def f(items):\n    return dict.fromkeys(items)",
+                                  "maximum SPEED": "def f(items):\n    return {x: x + x for x in items}"})
+        state = model_loader.load_status["state"]
+        get_worker = code_optimization.get_inference_worker
+        model_loader.load_status["state"] = "ready"
+        code_optimization.get_inference_worker = lambda: self.worker
+
+        def restore():
+            model_loader.load_status["state"] = state
+            code_optimization.get_inference_worker = get_worker
+        self.addCleanup(restore)
+
+    def test_variants_are_submitted_together_with_the_shared_preamble(self):
+        """Test that every variant is submitted with the preamble as its prefix and the code after it"""
+        results = generate_variants_with_model(self.code)
+
+        self.assertEqual(results, {"optimized": "def f(items):\n    return dict.fromkeys(items)",
+                                   "fast": "def f(items):\n    return {x: x + x for x in items}"})
+        preamble = VARIANT_PROMPT_TEMPLATE.split("{original_code}")[0]
+        self.assertEqual(len(self.worker.submitted), 2)
+        for prompt, kwargs in self.worker.submitted:
+            self.assertEqual(kwargs["prefix"], preamble)
+            self.assertTrue(prompt.startswith(preamble + self.code))
+
+    def test_variant_prompts_share_the_code_as_a_token_stem(self):
+        """Test that the tokens after the preamble are split into the shared code and each task"""
+        generate_variants_with_model(self.code)
+        prompts = [prompt for prompt, _ in self.worker.submitted]
+        preamble = self.worker.submitted[0][1]["prefix"]
+
+        prefix_ids, stem, rests = _split_prompt_ids(CharTokenizer(), prompts, preamble)
+        shared = "".join(map(chr, stem))
+        self.assertTrue(shared.startswith(self.code))
+        self.assertEqual([preamble + shared + "".join(map(chr, rest)) for rest in rests], prompts)
+        self.assertNotEqual(rests[0][0], rests[1][0])
+
+    def test_unavailable_model_gives_no_variants(self):
+        """Test that every variant is None while the model is not loaded"""
+        model_loader.load_status["state"] = "loading"
+        self.assertEqual(generate_variants_with_model(self.code), {"optimized": None, "fast": None})
+        self.assertEqual(self.worker.submitted, [])
+
+    def test_generated_speed_variant_is_used(self):
+        """Test that the green variant stays the optimized code and the speed variant is the generated one"""
+        optimized = "def f(items):\n    return dict.fromkeys(items)"
+        fast = "def f(items):\n    return {x: x + x for x in items}"
+        variants = generate_code_variants(self.code, optimized, fast)
+
+        self.assertEqual(variants["green_version"]["code"], optimized)
+        self.assertEqual(variants["fast_version"]["code"], fast)
+        self.assertEqual(variants["recommended"], "green")
+
+        fallback = generate_code_variants(self.code, optimized)
+        self.assertTrue(fallback["fast_version"]["code"].endswith(self.code))
+        self.assertEqual(fallback["green_version"], variants["green_version"])
+
+
+class EnergyMeasurementTests(unittest.TestCase):
+
+    def test_energy_comes_from_the_cpu_time_of_the_code(self):
+        """Test that the code runs in the sandbox and its energy is its own CPU time"""
+        original_run = sandbox_pool.run
+        executions = []
+
+        def run(*args, **kwargs):
+            executions.append(original_run(*args, **kwargs))
+            return executions[-1]
+        sandbox_pool.run = run
+        self.addCleanup(setattr, sandbox_pool, "run", original_run)
+
+        result = measure_energy_consumption("def f(data):\n    return sorted(x * x for x in data)\n")
+        self.assertEqual(executions[0]["status"], "ok")
+        self.assertEqual(result["functions"], ["f"])
+        self.assertEqual(result["energy"], cpu_seconds_to_joules(executions[0]["cpu_time"]))
+
+
+if __name__ == "__main__":
+    unittest.main()